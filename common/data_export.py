@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模拟数据列式导出模块 - 供db_maintenance命令和data_api导出接口共享
+
+将consumer_actions、consumers、daily_stats分块读取并写为列式文件：
+安装了pyarrow时写Parquet(每块一个row group)，否则写NumPy的.npz。
+消费者类型、地区、产品等低基数文本列按字典编码，pandas可直接读为category类型。
+内存占用只与分块大小有关，与总行数无关。
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import zipfile
+
+try:
+    from db_pool import get_pool
+except ImportError:
+    # 作为common包的子模块导入(erniebot端)
+    from common.db_pool import get_pool
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger('data_export')
+
+# 可导出的表
+EXPORT_TABLES = ("consumer_actions", "consumers", "daily_stats")
+
+# 按字典编码导出的低基数文本列
+CATEGORICAL_COLUMNS = frozenset(("consumer_type", "customer_type", "region", "city_type", "product_name"))
+
+DEFAULT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "50000"))
+
+FORMAT_EXTENSIONS = {"parquet": ".parquet", "npz": ".npz"}
+
+
+def available_formats():
+    """返回当前环境可用的导出格式，按优先级排序"""
+    formats = []
+    if pa is not None:
+        formats.append("parquet")
+    if np is not None:
+        formats.append("npz")
+    return formats
+
+
+def resolve_format(fmt="auto"):
+    """解析导出格式
+
+    Args:
+        fmt: "auto"、"parquet" 或 "npz"
+
+    Returns:
+        str: 实际使用的格式
+
+    Raises:
+        ValueError: 格式名称无效
+        RuntimeError: 所需的库未安装
+    """
+    fmt = (fmt or "auto").lower()
+    if fmt != "auto" and fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"不支持的导出格式: {fmt}，可选: auto, parquet, npz")
+
+    formats = available_formats()
+    if fmt == "auto":
+        if not formats:
+            raise RuntimeError("导出需要安装pyarrow(Parquet)或numpy(.npz)")
+        return formats[0]
+    if fmt not in formats:
+        raise RuntimeError(f"导出{fmt}格式需要安装{'pyarrow' if fmt == 'parquet' else 'numpy'}")
+    return fmt
+
+
+def _column_kind(name, declared_type):
+    """根据列名和声明类型确定导出的列类型"""
+    if name in CATEGORICAL_COLUMNS:
+        return "category"
+    declared_type = (declared_type or "").upper()
+    if "BOOL" in declared_type:
+        return "bool"
+    if "INT" in declared_type:
+        return "int"
+    if any(token in declared_type for token in ("DEC", "REAL", "FLOA", "DOUB", "NUM")):
+        return "float"
+    return "text"
+
+
+def _to_int(value):
+    try:
+        return None if value is None else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_text(value):
+    return None if value is None else str(value)
+
+
+class _ParquetWriter:
+    """按块写入Parquet文件，每块一个row group"""
+
+    ARROW_TYPES = {
+        "int": lambda: pa.int64(),
+        "bool": lambda: pa.bool_(),
+        "float": lambda: pa.float64(),
+        "text": lambda: pa.string(),
+        "category": lambda: pa.dictionary(pa.int32(), pa.string()),
+    }
+
+    def __init__(self, path, columns, kinds, stats):
+        self.columns = columns
+        self.kinds = kinds
+        self.schema = pa.schema([pa.field(name, self.ARROW_TYPES[kinds[name]]()) for name in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="snappy")
+
+    def write(self, values):
+        arrays = []
+        for name in self.columns:
+            kind = self.kinds[name]
+            column = values[name]
+            if kind == "int":
+                arrays.append(pa.array([_to_int(v) for v in column], type=pa.int64()))
+            elif kind == "bool":
+                arrays.append(pa.array([None if v is None else bool(v) for v in column], type=pa.bool_()))
+            elif kind == "float":
+                arrays.append(pa.array([_to_float(v) for v in column], type=pa.float64()))
+            elif kind == "category":
+                arrays.append(pa.array([_to_text(v) for v in column], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array([_to_text(v) for v in column], type=pa.string()))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _NpzWriter:
+    """按块写入.npz文件
+
+    行数和文本列最大长度预先统计，每列写入磁盘上的内存映射.npy文件，
+    最后打包为.npz(与np.savez相同的未压缩zip)。
+    字典编码列保存为 {列名} (int32编码，空值为-1) 和 {列名}__categories 两个数组；
+    含空值的整数/布尔列保存为float64，空值为NaN。
+    """
+
+    def __init__(self, path, columns, kinds, stats):
+        self.path = path
+        self.columns = columns
+        self.kinds = kinds
+        self.rows = stats["rows"]
+        self.offset = 0
+        self.categories = {name: {} for name in columns if kinds[name] == "category"}
+        self.tmpdir = tempfile.mkdtemp(prefix="export_", dir=os.path.dirname(os.path.abspath(path)))
+
+        self.arrays = {}
+        for name in columns:
+            kind = kinds[name]
+            has_nulls = stats["nulls"][name] > 0
+            if kind == "int":
+                dtype = "f8" if has_nulls else "i8"
+            elif kind == "bool":
+                dtype = "f8" if has_nulls else "?"
+            elif kind == "float":
+                dtype = "f8"
+            elif kind == "category":
+                dtype = "i4"
+            else:
+                dtype = f"U{max(1, stats['max_lengths'][name])}"
+            self.arrays[name] = self._open_array(name, np.dtype(dtype))
+
+    def _open_array(self, name, dtype):
+        array_path = os.path.join(self.tmpdir, f"{name}.npy")
+        if self.rows == 0:
+            # 空文件无法建立内存映射
+            np.save(array_path, np.empty(0, dtype=dtype))
+            return None
+        return np.lib.format.open_memmap(array_path, mode="w+", dtype=dtype, shape=(self.rows,))
+
+    def write(self, values):
+        count = len(values[self.columns[0]])
+        end = self.offset + count
+        for name in self.columns:
+            kind = self.kinds[name]
+            array = self.arrays[name]
+            column = values[name]
+            if kind == "category":
+                codes = self.categories[name]
+                array[self.offset:end] = [
+                    -1 if v is None else codes.setdefault(str(v), len(codes)) for v in column
+                ]
+            elif array.dtype.kind == "f":
+                converter = _to_float if kind == "float" else _to_int
+                converted = (converter(v) for v in column)
+                array[self.offset:end] = [float("nan") if v is None else v for v in converted]
+            elif kind == "int":
+                array[self.offset:end] = [_to_int(v) for v in column]
+            elif kind == "bool":
+                array[self.offset:end] = [bool(v) for v in column]
+            else:
+                array[self.offset:end] = ["" if v is None else str(v) for v in column]
+        self.offset = end
+
+    def close(self):
+        try:
+            for name, array in self.arrays.items():
+                if array is not None:
+                    array.flush()
+            self.arrays.clear()
+
+            for name, codes in self.categories.items():
+                np.save(os.path.join(self.tmpdir, f"{name}__categories.npy"), np.array(list(codes), dtype=str))
+
+            with zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for filename in sorted(os.listdir(self.tmpdir)):
+                    archive.write(os.path.join(self.tmpdir, filename), arcname=filename)
+        finally:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+WRITERS = {"parquet": _ParquetWriter, "npz": _NpzWriter}
+
+
+def _table_stats(cursor, table, columns, kinds, where_sql="", params=()):
+    """一次扫描统计行数、每列空值数和文本列最大长度"""
+    expressions = ["COUNT(*)"]
+    for name in columns:
+        expressions.append(f'SUM(CASE WHEN "{name}" IS NULL THEN 1 ELSE 0 END)')
+        if kinds[name] == "text":
+            expressions.append(f'MAX(LENGTH("{name}"))')
+    cursor.execute(f'SELECT {", ".join(expressions)} FROM "{table}" {where_sql}', params)
+    row = list(cursor.fetchone())
+
+    stats = {"rows": row.pop(0) or 0, "nulls": {}, "max_lengths": {}}
+    for name in columns:
+        stats["nulls"][name] = row.pop(0) or 0
+        if kinds[name] == "text":
+            stats["max_lengths"][name] = row.pop(0) or 0
+    return stats
+
+
+def export_table(conn, table, path, fmt, chunk_size=DEFAULT_CHUNK_SIZE, run_id=None):
+    """将一张表分块导出到列式文件
+
+    Args:
+        conn: 数据库连接(调用方负责开启读事务以保证快照一致)
+        table: 表名，必须在EXPORT_TABLES中
+        path: 输出文件路径
+        fmt: "parquet" 或 "npz"
+        chunk_size: 每次读取的行数
+        run_id: 只导出指定运行的数据，为None时导出全部
+
+    Returns:
+        int: 导出的行数
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"不支持导出的表: {table}，可选: {', '.join(EXPORT_TABLES)}")
+
+    cursor = conn.cursor()
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    table_info = cursor.fetchall()
+    if not table_info:
+        raise ValueError(f"数据库中不存在表: {table}")
+    columns = [row[1] for row in table_info]
+    kinds = {row[1]: _column_kind(row[1], row[2]) for row in table_info}
+
+    where_sql, params = ('WHERE "run_id" = ?', (run_id,)) if run_id and "run_id" in columns else ("", ())
+
+    # npz需要预先知道行数和文本列宽度
+    stats = _table_stats(cursor, table, columns, kinds, where_sql, params) if fmt == "npz" else None
+
+    writer = WRITERS[fmt](path, columns, kinds, stats)
+    rows = 0
+    try:
+        column_list = ", ".join(f'"{name}"' for name in columns)
+        cursor.execute(f'SELECT {column_list} FROM "{table}" {where_sql} ORDER BY rowid', params)
+        while True:
+            batch = cursor.fetchmany(chunk_size)
+            if not batch:
+                break
+            values = dict(zip(columns, zip(*batch)))
+            writer.write(values)
+            rows += len(batch)
+    finally:
+        writer.close()
+    return rows
+
+
+def export_database(db_path, output_dir, tables=EXPORT_TABLES, fmt="auto", chunk_size=DEFAULT_CHUNK_SIZE,
+                    run_id=None):
+    """导出模拟数据库中的表
+
+    所有表在同一个读事务中导出，得到一致的数据快照，导出期间模拟仍可继续写入。
+
+    Args:
+        db_path: 数据库文件路径(按运行分库时为该运行的数据库文件)
+        output_dir: 输出目录
+        tables: 要导出的表名列表
+        fmt: "auto"、"parquet" 或 "npz"
+        chunk_size: 每次读取的行数
+        run_id: 只导出指定运行的数据，文件名带上运行ID；为None时导出全部
+
+    Returns:
+        dict: {表名: {"path": 文件路径, "rows": 行数, "format": 格式}}
+    """
+    fmt = resolve_format(fmt)
+    for table in tables:
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"不支持导出的表: {table}，可选: {', '.join(EXPORT_TABLES)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    result = {}
+    conn = get_pool(db_path).connect()
+    try:
+        conn.execute("BEGIN")
+        for table in tables:
+            suffix = f"_{run_id}" if run_id else ""
+            path = os.path.join(output_dir, f"{table}{suffix}{FORMAT_EXTENSIONS[fmt]}")
+            rows = export_table(conn, table, path, fmt, chunk_size, run_id)
+            logger.info(f"已导出 {table}: {rows} 行 -> {path}")
+            result[table] = {"path": path, "rows": rows, "format": fmt}
+    finally:
+        conn.rollback()
+        conn.close()
+    return result
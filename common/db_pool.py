@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+SQLite连接池模块 - 供erniebot写入端和data_api读取端共享
+
+每个连接创建时只设置一次PRAGMA(WAL、synchronous=NORMAL、busy_timeout、
+mmap_size、cache_size)，归还后复用，避免每次请求重新连接，
+同时让模拟写入与Flask/WebSocket读取可以并发进行而不互相锁死。
+只读服务(data_api的生产入口)可以通过set_pool_defaults让之后创建的连接池
+都以只读方式打开数据库，并在启动时预先建立连接。
+"""
+
+import os
+import queue
+import sqlite3
+import logging
+import threading
+import weakref
+from pathlib import Path
+from contextlib import contextmanager
+
+logger = logging.getLogger('db_pool')
+
+# 默认参数，可通过环境变量覆盖
+DEFAULT_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DEFAULT_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30.0"))  # 等待空闲连接的秒数
+DEFAULT_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", "5000"))  # 毫秒
+DEFAULT_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", "-16000"))  # 负数表示KB，约16MB
+DEFAULT_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256MB
+
+# 同一数据库文件共享一个连接池
+_pools = {}
+_pools_lock = threading.Lock()
+
+# get_pool创建连接池时使用的默认参数，由set_pool_defaults设置
+_pool_defaults = {}
+
+
+class PooledConnection:
+    """连接池中的连接包装，close()时归还到连接池而不是真正关闭
+
+    未调用close()就被回收的包装会关闭底层连接并释放名额，
+    避免出错的请求永久占用连接池。
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        # 底层连接上可能还有游标在用，不能放回空闲队列，只能丢弃
+        self._finalizer = weakref.finalize(self, pool._discard_leaked, conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("连接已归还到连接池")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # row_factory等属性设置到底层连接上，归还时会被重置
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        """归还连接到连接池"""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._finalizer.detach()
+        self._pool.release(conn)
+
+
+class SQLiteConnectionPool:
+    """基于队列的SQLite连接池"""
+
+    def __init__(self, db_path, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 busy_timeout=DEFAULT_BUSY_TIMEOUT, cache_size=DEFAULT_CACHE_SIZE,
+                 mmap_size=DEFAULT_MMAP_SIZE, read_only=False):
+        """初始化连接池
+
+        Args:
+            db_path (str): 数据库文件路径
+            pool_size (int): 最大连接数
+            timeout (float): 连接全部占用时等待空闲连接的秒数
+            busy_timeout (int): SQLite忙等待超时(毫秒)
+            cache_size (int): 每个连接的页缓存大小(PRAGMA cache_size)
+            mmap_size (int): 内存映射大小(字节)
+            read_only (bool): 以只读方式(mode=ro)打开数据库，并禁止写入语句
+        """
+        self.db_path = db_path
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.read_only = read_only
+
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create_connection(self):
+        """创建新连接并设置PRAGMA"""
+        if self.read_only:
+            # 只读连接不能切换日志模式，WAL由写入端(erniebot)设置
+            conn = sqlite3.connect(
+                f"{Path(self.db_path).resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=self.busy_timeout / 1000.0,
+                check_same_thread=False
+            )
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout / 1000.0,
+                check_same_thread=False  # 连接会在不同线程间复用，同一时刻只由一个线程持有
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        return conn
+
+    def connect(self):
+        """从连接池获取连接
+
+        Returns:
+            PooledConnection: 用法与sqlite3.Connection相同，close()时归还
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"连接池已关闭: {self.db_path}")
+
+        try:
+            return PooledConnection(self, self._idle.get_nowait())
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.pool_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return PooledConnection(self, self._create_connection())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"等待数据库连接超时({self.timeout}秒)，连接池大小: {self.pool_size}"
+            )
+        return PooledConnection(self, conn)
+
+    def prewarm(self, count=None):
+        """预先建立连接放入空闲队列，避免第一批请求等待建立连接
+
+        Args:
+            count (int): 预建连接数，默认为连接池大小
+
+        Returns:
+            int: 实际新建的连接数
+        """
+        target = self.pool_size if count is None else min(int(count), self.pool_size)
+        created = 0
+        while True:
+            with self._lock:
+                if self._closed or self._created >= target:
+                    break
+                self._created += 1
+            try:
+                conn = self._create_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._idle.put(conn)
+            created += 1
+        return created
+
+    def release(self, conn):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error as e:
+            logger.warning(f"归还连接时出错，丢弃该连接: {e}")
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def _discard_leaked(self, conn):
+        """包装被回收但未归还的连接：丢弃并释放名额"""
+        logger.warning(f"数据库连接未归还就被回收，已丢弃: {self.db_path}")
+        self._discard(conn)
+
+    def _discard(self, conn):
+        """真正关闭连接并释放名额"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器方式使用连接"""
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close_all(self):
+        """关闭连接池中所有空闲连接，之后归还的连接也会被关闭"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def get_pool(db_path, **kwargs):
+    """获取指定数据库文件的共享连接池，不存在时创建
+
+    首次创建时的参数生效，未指定的参数使用set_pool_defaults设置的默认值。
+
+    Args:
+        db_path (str): 数据库文件路径
+        **kwargs: 传给SQLiteConnectionPool的参数
+
+    Returns:
+        SQLiteConnectionPool: 连接池
+    """
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = SQLiteConnectionPool(db_path, **{**_pool_defaults, **kwargs})
+            _pools[key] = pool
+            logger.info(f"创建数据库连接池: {db_path} (大小: {pool.pool_size}{', 只读' if pool.read_only else ''})")
+        return pool
+
+
+def set_pool_defaults(**kwargs):
+    """设置本进程中之后新建连接池的默认参数
+
+    应在创建任何连接池之前调用，例如只读服务启动时设置read_only=True和与工作线程数相同的pool_size。
+
+    Args:
+        **kwargs: SQLiteConnectionPool的参数
+    """
+    with _pools_lock:
+        _pool_defaults.update(kwargs)
+
+
+def close_all_pools():
+    """关闭所有连接池"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+TCP消息分帧模块 - 供TCPServer、socketplus和TCPClient共享
+
+支持三种帧格式，接收端逐帧自动识别，无需事先约定：
+- length: 4字节大端无符号长度 + JSON字节。长度首字节必须为0(单帧最大16MB)，
+          因此与以"{"开头的旧格式不会混淆
+- ndjson: 每行一条JSON，以换行结尾
+- raw:    旧客户端直接发送的JSON对象，没有分隔符，按括号配对切分
+另外兼容旧心跳 b"ping"/b"pong"。
+
+发送端使用哪种格式由握手决定：客户端在带client_type的第一条消息中附带
+"framing": "length"/"ndjson"，服务器此后按该格式发送；未指定时保持raw，兼容旧客户端。
+
+FrameDecoder用bytearray缓冲区和读偏移量切分消息，每个字节只扫描一次，
+整体为O(n)，一次recv中收到的多条消息会被逐条切出。
+"""
+
+import re
+
+FRAMING_LENGTH = "length"
+FRAMING_NDJSON = "ndjson"
+FRAMING_RAW = "raw"
+SUPPORTED_FRAMINGS = (FRAMING_LENGTH, FRAMING_NDJSON, FRAMING_RAW)
+
+# 长度前缀字节数及单帧上限(首字节为0)
+LENGTH_PREFIX_SIZE = 4
+MAX_LENGTH_FRAME = 0x00FFFFFF
+
+# 旧版心跳消息
+HEARTBEAT_MESSAGES = (b"ping", b"pong")
+
+DEFAULT_RECV_SIZE = 64 * 1024
+
+_WHITESPACE = b" \t\r\n"
+# raw格式中影响括号配对的字符
+_RAW_TOKENS = re.compile(rb'[\[\]{}"\\]')
+_OPEN = frozenset(b"{[")
+_CLOSE = frozenset(b"}]")
+_QUOTE = ord('"')
+_BACKSLASH = ord("\\")
+
+
+class FrameError(ValueError):
+    """帧格式错误或超出大小限制，接收缓冲区已清空"""
+
+
+def encode_frame(payload, framing=FRAMING_RAW):
+    """按帧格式封装消息
+
+    Args:
+        payload (bytes): 已序列化的消息
+        framing (str): 帧格式
+
+    Returns:
+        bytes: 可直接发送的字节
+    """
+    if framing == FRAMING_LENGTH:
+        if len(payload) > MAX_LENGTH_FRAME:
+            raise FrameError(f"消息过大: {len(payload)} 字节，单帧最大 {MAX_LENGTH_FRAME} 字节")
+        return len(payload).to_bytes(LENGTH_PREFIX_SIZE, "big") + payload
+    if framing == FRAMING_NDJSON:
+        # 紧凑JSON中字符串内的换行已被转义，换行只会出现在行尾
+        return payload + b"\n"
+    return payload
+
+
+class FrameDecoder:
+    """接收缓冲区，从字节流中逐条切出完整消息"""
+
+    def __init__(self, max_frame_size=1024 * 1024):
+        """初始化
+
+        Args:
+            max_frame_size (int): 单条消息的最大字节数，超出时抛出FrameError
+        """
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._offset = 0          # 已切出消息之后的读位置
+        self._scan_pos = 0        # raw/ndjson格式下已扫描到的位置，避免重复扫描
+        self._depth = 0           # raw格式的括号深度
+        self._in_string = False   # raw格式当前是否在字符串内
+        self._recv_buffer = None
+
+    def __len__(self):
+        """缓冲区中尚未切出的字节数"""
+        return len(self._buffer) - self._offset
+
+    def feed(self, data):
+        """追加收到的字节
+
+        Args:
+            data: bytes、bytearray或memoryview
+        """
+        if self._offset:
+            # 丢弃已切出的部分(bytearray删除前缀为均摊O(1))，扫描位置随之平移
+            del self._buffer[:self._offset]
+            self._scan_pos = max(0, self._scan_pos - self._offset)
+            self._offset = 0
+        self._buffer += data
+
+    def read_from(self, sock, size=DEFAULT_RECV_SIZE):
+        """从socket读取一次数据到缓冲区(复用同一块接收内存，不为每次recv分配新对象)
+
+        Returns:
+            int: 读取的字节数，0表示对方已关闭连接
+        """
+        if self._recv_buffer is None or len(self._recv_buffer) != size:
+            self._recv_buffer = bytearray(size)
+        count = sock.recv_into(self._recv_buffer)
+        if count:
+            with memoryview(self._recv_buffer) as view:
+                self.feed(view[:count])
+        return count
+
+    def next_frame(self):
+        """切出下一条完整消息
+
+        Returns:
+            bytes: 消息内容(不含长度前缀和换行)，数据不完整时返回None
+
+        Raises:
+            FrameError: 无法识别的数据或消息超出大小限制
+        """
+        buffer = self._buffer
+        end = len(buffer)
+
+        # 跳过消息之间的空白(ndjson的换行等)
+        offset = self._offset
+        while offset < end and buffer[offset] in _WHITESPACE:
+            offset += 1
+        if offset != self._offset:
+            self._offset = offset
+            self._scan_pos = max(self._scan_pos, offset)
+        if offset >= end:
+            return None
+
+        first = buffer[offset]
+        if first == 0:
+            return self._next_length_frame(offset, end)
+        if first in _OPEN:
+            return self._next_raw_frame(offset, end)
+        if end - offset < 4 and any(message.startswith(buffer[offset:end]) for message in HEARTBEAT_MESSAGES):
+            return None
+        if bytes(buffer[offset:offset + 4]) in HEARTBEAT_MESSAGES:
+            return self._take(offset, offset + 4)
+        self._fail(f"无法识别的消息起始字节: {bytes(buffer[offset:offset + 16])!r}")
+
+    def _next_length_frame(self, offset, end):
+        if end - offset < LENGTH_PREFIX_SIZE:
+            return None
+        length = int.from_bytes(self._buffer[offset:offset + LENGTH_PREFIX_SIZE], "big")
+        if length > self.max_frame_size:
+            self._fail(f"消息过大: {length} 字节，最大 {self.max_frame_size} 字节")
+        start = offset + LENGTH_PREFIX_SIZE
+        if end - start < length:
+            return None
+        return self._take(start, start + length)
+
+    def _next_raw_frame(self, offset, end):
+        """按括号配对切出一个JSON对象，只扫描上次之后新到的字节"""
+        buffer = self._buffer
+        pos = self._scan_pos if self._scan_pos > offset else offset
+        while True:
+            match = _RAW_TOKENS.search(buffer, pos)
+            if match is None:
+                self._scan_pos = end
+                break
+            index = match.start()
+            char = buffer[index]
+            pos = index + 1
+            if self._in_string:
+                if char == _BACKSLASH:
+                    if pos >= end:
+                        # 转义字符还没收到，下次从反斜杠处重新扫描
+                        self._scan_pos = index
+                        break
+                    pos += 1
+                elif char == _QUOTE:
+                    self._in_string = False
+            elif char == _QUOTE:
+                self._in_string = True
+            elif char in _OPEN:
+                self._depth += 1
+            elif char in _CLOSE:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._take(offset, pos)
+
+        if end - offset > self.max_frame_size:
+            self._fail(f"消息过大或格式错误: 已缓冲 {end - offset} 字节仍不完整")
+        return None
+
+    def _take(self, start, stop):
+        """取出buffer[start:stop]作为一条消息，并将读位置移到消息之后"""
+        with memoryview(self._buffer) as view:
+            frame = view[start:stop].tobytes()
+        self._offset = stop
+        self._scan_pos = stop
+        self._depth = 0
+        self._in_string = False
+        return frame
+
+    def _fail(self, message):
+        self.reset()
+        raise FrameError(message)
+
+    def reset(self):
+        """清空缓冲区"""
+        self._buffer = bytearray()
+        self._offset = 0
+        self._scan_pos = 0
+        self._depth = 0
+        self._in_string = False
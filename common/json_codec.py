@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+JSON编解码模块 - 全项目共享
+
+安装了orjson时使用orjson，否则回退到标准库json，两者输出一致：
+紧凑格式、中文不转义(等同ensure_ascii=False)的UTF-8。
+dumpb()直接返回bytes，发送方序列化一次后可把同一份字节发给所有接收方。
+解码失败统一抛出JSONDecodeError(即json.JSONDecodeError，orjson的异常是它的子类)。
+"""
+
+import os
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 设置环境变量JSON_CODEC=stdlib可强制使用标准库，便于排查编码差异
+if orjson is not None and os.environ.get("JSON_CODEC", "auto").lower() != "stdlib":
+    BACKEND = "orjson"
+    # 允许非字符串键(与标准库一致转为字符串)，并直接序列化numpy数组
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+else:
+    BACKEND = "json"
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def _std_dumps(obj, default=None, indent=None, sort_keys=False):
+    return json.dumps(obj, ensure_ascii=False, default=default, indent=indent, sort_keys=sort_keys,
+                      separators=None if indent else (",", ":"))
+
+
+def dumpb(obj, default=None, indent=None, sort_keys=False, native_datetime=True):
+    """序列化为UTF-8编码的JSON字节
+
+    Args:
+        obj: 要序列化的对象
+        default: 无法直接序列化的对象的转换函数，与json.dumps的default相同
+        indent: 缩进空格数，None为紧凑格式；orjson只支持2，其他值使用标准库
+        sort_keys: 是否按键排序
+        native_datetime: orjson是否直接把datetime编码为ISO 8601；为False时
+            与标准库一样交给default处理
+
+    Returns:
+        bytes: JSON字节
+    """
+    if BACKEND == "orjson" and indent in (None, 2):
+        option = _ORJSON_OPTIONS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if not native_datetime:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except orjson.JSONEncodeError:
+            # 超出64位的整数等orjson不支持的值，交给标准库处理
+            pass
+    return _std_dumps(obj, default, indent, sort_keys).encode("utf-8")
+
+
+def dumps(obj, default=None, indent=None, sort_keys=False, native_datetime=True):
+    """序列化为JSON字符串，参数同dumpb"""
+    if BACKEND == "orjson":
+        return dumpb(obj, default, indent, sort_keys, native_datetime).decode("utf-8")
+    return _std_dumps(obj, default, indent, sort_keys)
+
+
+def loads(data):
+    """解析JSON
+
+    Args:
+        data: str、bytes、bytearray或memoryview，字节按UTF-8解码
+
+    Returns:
+        解析后的对象
+
+    Raises:
+        JSONDecodeError: 不是合法的JSON(包括不完整的消息和非法UTF-8)
+    """
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if isinstance(data, (bytes, bytearray)):
+        try:
+            data = data.decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise JSONDecodeError(f"非法的UTF-8编码: {e}", "", 0)
+    return json.loads(data)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模拟运行登记模块 - 供erniebot写入端和data_api读取端共享
+
+每次模拟运行在主数据库的simulation_runs表中登记一行，所有数据表都带有run_id列。
+开启按运行分库时，运行的数据写入主数据库旁 runs/<run_id>.db 文件(表结构与主库相同，
+可直接ATTACH到其他连接做跨运行对比)，删除旧运行只需删除该文件。
+"""
+
+import os
+import sqlite3
+
+try:
+    from db_pool import get_pool
+except ImportError:
+    # 作为common包的子模块导入(erniebot端)
+    from common.db_pool import get_pool
+
+# 未指定运行时使用的运行ID，旧数据库中的历史数据迁移后也归入此运行
+DEFAULT_RUN_ID = "default"
+
+# 按运行分库时，运行数据库文件所在的子目录(相对主数据库所在目录)
+RUNS_DIR_NAME = "runs"
+
+
+class UnknownRunError(KeyError):
+    """指定的运行ID不存在"""
+
+
+def run_db_path(main_db_path, db_file):
+    """将登记表中的db_file(相对主数据库目录)转换为绝对路径，未分库时返回主数据库路径"""
+    if not db_file:
+        return main_db_path
+    if os.path.isabs(db_file):
+        return db_file
+    return os.path.join(os.path.dirname(os.path.abspath(main_db_path)), db_file)
+
+
+def _query_registry(main_db_path, query, params=()):
+    """查询登记表
+
+    Returns:
+        list: 查询结果；数据库文件不存在(只读模式)或旧数据库没有登记表时返回None
+    """
+    try:
+        conn = get_pool(main_db_path).connect()
+    except sqlite3.OperationalError:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+def list_runs(main_db_path):
+    """列出所有登记的运行，按最近更新时间倒序
+
+    Returns:
+        list: 运行信息字典列表，旧数据库没有登记表时返回空列表
+    """
+    rows = _query_registry(main_db_path, '''
+    SELECT run_id, label, status, db_file, last_day, started_at, updated_at, finished_at
+    FROM simulation_runs
+    ORDER BY updated_at DESC, started_at DESC
+    ''')
+    return [dict(row) for row in rows or []]
+
+
+def resolve_run(main_db_path, run_id=None):
+    """确定要查询的运行及其数据所在的数据库文件
+
+    Args:
+        main_db_path: 主数据库路径
+        run_id: 运行ID，为None时使用最近有数据写入的运行
+
+    Returns:
+        tuple: (运行ID, 数据库文件路径)
+
+    Raises:
+        UnknownRunError: 指定的运行ID未登记
+    """
+    if run_id:
+        rows = _query_registry(main_db_path, "SELECT run_id, db_file FROM simulation_runs WHERE run_id = ?", (run_id,))
+    else:
+        rows = _query_registry(main_db_path, '''
+        SELECT run_id, db_file FROM simulation_runs
+        ORDER BY updated_at DESC, started_at DESC
+        LIMIT 1
+        ''')
+
+    if not rows:
+        # 没有登记表(旧数据库)时所有数据都属于默认运行
+        if run_id and run_id != DEFAULT_RUN_ID:
+            raise UnknownRunError(run_id)
+        return DEFAULT_RUN_ID, main_db_path
+    return rows[0][0], run_db_path(main_db_path, rows[0][1])
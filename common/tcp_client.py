@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+统一TCP客户端模块 - 与TCPServer和socketplus配套使用
+
+连接后发送带client_type的握手消息并协商帧格式(默认length)，
+之后收发的每条消息都按协商的格式分帧。
+"""
+
+import socket
+import logging
+from typing import Any, Optional
+
+try:
+    import json_codec
+    from framing import FrameDecoder, encode_frame, FRAMING_LENGTH, FRAMING_RAW, SUPPORTED_FRAMINGS
+except ImportError:
+    # 作为common包的子模块导入(erniebot端)
+    from common import json_codec
+    from common.framing import FrameDecoder, encode_frame, FRAMING_LENGTH, FRAMING_RAW, SUPPORTED_FRAMINGS
+
+logger = logging.getLogger('TCPClient')
+
+
+class TCPClient:
+    """统一TCP客户端实现"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 12339,
+                 client_type: str = "generic",
+                 framing: str = FRAMING_LENGTH,
+                 timeout: Optional[float] = 30.0,
+                 max_message_size: int = 1024 * 1024):
+        """初始化TCP客户端
+
+        Args:
+            host: 服务器地址
+            port: 服务器端口
+            client_type: 客户端类型标识符
+            framing: 希望使用的帧格式(length/ndjson/raw)
+            timeout: socket超时时间（秒），None表示一直阻塞
+            max_message_size: 单条消息的最大字节数
+        """
+        if framing not in SUPPORTED_FRAMINGS:
+            raise ValueError(f"不支持的帧格式: {framing}")
+        self.host = host
+        self.port = port
+        self.client_type = client_type
+        self.framing = framing
+        self.timeout = timeout
+        self.sock = None
+        self.client_id = None
+        # 握手确认前服务器仍按raw发送，解码器逐帧自动识别格式
+        self.send_framing = FRAMING_RAW
+        self.decoder = FrameDecoder(max_message_size)
+
+    def connect(self) -> dict:
+        """连接服务器并完成握手
+
+        Returns:
+            dict: 服务器的connection_established确认消息
+
+        Raises:
+            ConnectionError: 连接被关闭或服务器拒绝了帧格式
+        """
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.decoder.reset()
+        self.send_framing = FRAMING_RAW
+        # 握手消息本身用raw发送，旧服务器也能识别
+        self.send({"client_type": self.client_type, "framing": self.framing})
+
+        while True:
+            message = self.recv()
+            if message is None:
+                raise ConnectionError("握手期间连接被关闭")
+            msg_type = message.get("type") if isinstance(message, dict) else None
+            if msg_type == "welcome":
+                self.client_id = message.get("client_id")
+            elif msg_type == "connection_established":
+                self.client_id = message.get("client_id", self.client_id)
+                # 旧服务器不返回framing字段，继续使用raw
+                self.send_framing = message.get("framing", FRAMING_RAW)
+                logger.info(f"已连接到 {self.host}:{self.port}, 帧格式: {self.send_framing}")
+                return message
+            elif msg_type == "error":
+                raise ConnectionError(f"握手失败: {message.get('message')}")
+
+    def send(self, message: Any) -> None:
+        """发送一条消息
+
+        Args:
+            message: 要发送的消息，字典会被转换为JSON，bytes为已序列化的消息
+        """
+        if isinstance(message, (bytes, bytearray)):
+            data = bytes(message)
+        elif isinstance(message, str):
+            data = message.encode('utf-8')
+        else:
+            data = json_codec.dumpb(message)
+        self.sock.sendall(encode_frame(data, self.send_framing))
+
+    def recv(self) -> Any:
+        """接收一条完整消息
+
+        Returns:
+            解析后的消息，旧心跳返回"ping"/"pong"字符串；连接关闭时返回None
+
+        Raises:
+            FrameError: 收到无法识别的数据
+        """
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                if frame in (b"ping", b"pong"):
+                    return frame.decode('ascii')
+                return json_codec.loads(frame)
+            if not self.decoder.read_from(self.sock):
+                return None
+
+    def close(self) -> None:
+        """关闭连接"""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError as e:
+                logger.debug(f"关闭连接时出错: {e}")
+            self.sock = None
+
@@ -3,20 +3,36 @@
 
 """
 统一TCP服务器模块 - 供erniebot和data_api使用
+
+基于asyncio实现：每个连接一个读取任务，心跳和超时检查共用一个定时任务，
+所有连接在同一个事件循环线程中处理，不再为每个客户端创建线程。
+
+每个连接有自己的有界发送队列和写任务，慢客户端只会积压自己的队列，
+不影响其他客户端。队列满时按溢出策略处理：
+- drop_oldest: 丢弃队列中最早的消息
+- coalesce: 丢弃队列中同类型(type字段相同)的旧消息，只保留最新的一条；没有同类型消息时丢弃最早的
+- disconnect: 断开该客户端
 """
 
 import asyncio
-import json
+import functools
+import inspect
 import logging
 import uuid
 import time
 import traceback
-import socket
-import select
-import threading
+from collections import deque
 from typing import Dict, List, Any, Callable, Optional, Union
 from datetime import datetime
 
+try:
+    import json_codec
+    from framing import FrameDecoder, FrameError, encode_frame, FRAMING_RAW, SUPPORTED_FRAMINGS, DEFAULT_RECV_SIZE
+except ImportError:
+    # 作为common包的子模块导入(erniebot端)
+    from common import json_codec
+    from common.framing import FrameDecoder, FrameError, encode_frame, FRAMING_RAW, SUPPORTED_FRAMINGS, DEFAULT_RECV_SIZE
+
 # 配置日志
 logging.basicConfig(
     level=logging.DEBUG,  # 使用DEBUG级别获取更多日志
@@ -28,12 +44,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger('TCPServer')
 
+# 发送队列溢出策略
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT)
+
+class ClientSendQueue:
+    """单个客户端的有界发送队列"""
+    
+    def __init__(self, maxsize: int):
+        self.items = deque()  # (消息类型, 帧字节)
+        self.maxsize = maxsize
+        self.ready = asyncio.Event()
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+    
+    def __len__(self):
+        return len(self.items)
+
 class TCPServer:
     """统一TCP服务器实现"""
     
     def __init__(self, host: str = "0.0.0.0", port: int = 12339, 
                 heartbeat_interval: int = 30,
-                connection_timeout: int = 60):
+                connection_timeout: int = 60,
+                send_queue_size: int = 256,
+                overflow_policy: str = OVERFLOW_DROP_OLDEST,
+                overflow_policies: Optional[Dict[str, str]] = None,
+                send_timeout: float = 30.0):
         """初始化TCP服务器
         
         Args:
@@ -41,43 +82,59 @@ class TCPServer:
             port: 服务器端口
             heartbeat_interval: 心跳包发送间隔（秒）
             connection_timeout: 连接超时时间（秒）
+            send_queue_size: 每个客户端发送队列的最大消息数
+            overflow_policy: 发送队列满时的默认处理策略(drop_oldest/coalesce/disconnect)
+            overflow_policies: 按客户端类型指定的溢出策略，如 {"dashboard": "coalesce"}
+            send_timeout: 单次写出超过该时间(秒)仍未完成的客户端视为卡死并断开
         """
+        for policy in [overflow_policy] + list((overflow_policies or {}).values()):
+            if policy not in OVERFLOW_POLICIES:
+                raise ValueError(f"未知的发送队列溢出策略: {policy}")
         self.host = host
         self.port = port
-        self.clients = {}  # 客户端连接字典 {client_id: socket}
+        self.clients = {}  # 客户端连接字典 {client_id: StreamWriter}
         self.client_types = {}  # 客户端类型映射，如 "unity", "dashboard" 等
+        self.client_framing = {}  # 客户端协商的帧格式，未协商的旧客户端为raw
         self.client_last_seen = {}  # 客户端最后活动时间
+        self.client_tasks = {}  # 每个连接的读取任务 {client_id: Task}
+        self.send_queues = {}  # 每个连接的发送队列 {client_id: ClientSendQueue}
+        self.writer_tasks = {}  # 每个连接的写任务 {client_id: Task}
         self.handlers = {}  # 消息处理器
-        self.server_socket = None
+        self.on_connect = None  # 可选的连接回调，参数为(client_id)
+        self.on_disconnect = None  # 可选的断开回调，参数为(client_id)
+        self.server = None
         self.running = False
         self.heartbeat_interval = heartbeat_interval
         self.connection_timeout = connection_timeout
-        self.heartbeat_thread = None
-        self.cleanup_thread = None
         self.max_message_size = 1024 * 1024  # 1MB
-        self.max_retries = 3
-        self.retry_delay = 1.0
-        self.client_thread = None
-        self.lock = threading.Lock()  # 用于线程安全操作
+        self.send_queue_size = send_queue_size
+        self.overflow_policy = overflow_policy
+        self.overflow_policies = dict(overflow_policies or {})
+        self.send_timeout = send_timeout
+        # 累计统计(包含已断开的客户端)
+        self.dropped_messages = 0
+        self.coalesced_messages = 0
+        self.evicted_clients = 0
+        self.sweep_task = None
+        self._stopped = None
         
         logger.info(f"TCP服务器初始化: {host}:{port}")
         logger.info(f"心跳间隔: {heartbeat_interval}秒, 连接超时: {connection_timeout}秒")
     
-    def handle_client(self, client_socket, address):
-        """处理客户端连接
-        
-        Args:
-            client_socket: 客户端socket
-            address: 客户端地址
-        """
-        # 生成客户端ID
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理单个客户端连接(每个连接一个任务)"""
+        address = writer.get_extra_info('peername')
         client_id = str(uuid.uuid4())
-        with self.lock:
-            self.clients[client_id] = client_socket
-            self.client_last_seen[client_id] = time.time()
         client_type = "unknown"
         
-        logger.info(f"客户端连接: {client_id} 从 {address}")
+        self.clients[client_id] = writer
+        self.client_last_seen[client_id] = time.time()
+        self.client_tasks[client_id] = asyncio.current_task()
+        queue = ClientSendQueue(self.send_queue_size)
+        self.send_queues[client_id] = queue
+        self.writer_tasks[client_id] = asyncio.create_task(self._writer_loop(client_id, writer, queue))
+        
+        logger.info(f"新客户端连接: {client_id} 来自 {address}")
         logger.info(f"当前连接数: {len(self.clients)}")
         
         try:
@@ -88,149 +145,188 @@ class TCPServer:
                 "message": "欢迎连接到TCP服务器",
                 "server_time": time.time()
             }
-            self.send_to_client(client_id, welcome_msg)
+            await self.send_to_client(client_id, welcome_msg)
             logger.info(f"已发送欢迎消息到客户端 {client_id}")
             
+            if self.on_connect:
+                await self._call_handler(self.on_connect, client_id)
+            
             # 处理客户端消息
-            data_buffer = b""
+            decoder = FrameDecoder(self.max_message_size)
             while self.running:
-                try:
-                    ready = select.select([client_socket], [], [], 1.0)
-                    if ready[0]:
-                        chunk = client_socket.recv(4096)
-                        if not chunk:
-                            logger.info(f"客户端 {client_id} 关闭连接")
-                            break
-                        
-                        data_buffer += chunk
-                        # 更新客户端最后活动时间
-                        with self.lock:
-                            self.client_last_seen[client_id] = time.time()
-                        
-                        # 尝试处理完整的JSON消息
-                        try:
-                            # 检查是否是心跳消息 "ping"
-                            if data_buffer == b"ping":
-                                client_socket.send(b"pong")
-                                logger.debug(f"收到ping,回复pong (客户端: {client_id})")
-                                data_buffer = b""
-                                continue
-                            
-                            # 尝试解析JSON
-                            message = data_buffer.decode('utf-8')
-                            data = json.loads(message)
-                            logger.info(f"收到来自客户端 {client_id} 的消息: {data}")
-                            data_buffer = b""  # 清空缓冲区
-                            
-                            # 识别客户端类型
-                            if 'client_type' in data:
-                                client_type = data['client_type']
-                                with self.lock:
-                                    self.client_types[client_id] = client_type
-                                logger.info(f"客户端 {client_id} 标识为: {client_type}")
-                                
-                                # 发送确认消息
-                                self.send_to_client(client_id, {
-                                    "type": "connection_established",
-                                    "client_id": client_id,
-                                    "message": f"连接已建立 ({client_type})",
-                                    "server_time": time.time()
-                                })
-                                continue
-                            
-                            # 处理消息类型
-                            if 'type' in data:
-                                msg_type = data['type']
-                                logger.info(f"处理类型 {msg_type} 的消息")
-                                
-                                # 处理心跳消息
-                                if msg_type == "heartbeat":
-                                    self.send_to_client(client_id, {
-                                        "type": "heartbeat",
-                                        "server_time": time.time()
-                                    })
-                                    logger.debug(f"收到心跳包,已回复 (客户端: {client_id})")
-                                    continue
-                                
-                                # 处理Unity客户端直接发送的问题消息
-                                if msg_type == "question":
-                                    logger.info(f"收到Unity客户端直接发送的问题消息: {data}")
-                                    # 将这种消息路由到task_new处理器
-                                    if "task_new" in self.handlers:
-                                        for handler in self.handlers["task_new"]:
-                                            try:
-                                                handler(client_id, data)
-                                            except Exception as e:
-                                                logger.error(f"处理question消息时出错: {e}")
-                                                logger.error(traceback.format_exc())
-                                                self.send_error(client_id, f"处理消息时出错: {str(e)}")
-                                    else:
-                                        logger.warning("未找到task_new处理器，无法处理question类型消息")
-                                        self.send_error(client_id, "服务器未配置处理此类消息的处理器")
-                                    continue
-                                
-                                # 调用对应的消息处理器
-                                if msg_type in self.handlers:
-                                    for handler in self.handlers[msg_type]:
-                                        try:
-                                            handler(client_id, data)
-                                        except Exception as e:
-                                            logger.error(f"处理消息时出错: {e}")
-                                            logger.error(traceback.format_exc())
-                                            self.send_error(client_id, f"处理消息时出错: {str(e)}")
-                                else:
-                                    logger.warning(f"未处理的消息类型: {msg_type}")
-                                    self.send_error(client_id, f"未知的消息类型: {msg_type}")
-                            else:
-                                logger.warning(f"消息缺少类型字段: {data}")
-                                self.send_error(client_id, "消息缺少类型字段")
-                                
-                        except json.JSONDecodeError as e:
-                            # 如果JSON解析失败，可能是数据不完整，继续等待更多数据
-                            if len(data_buffer) > self.max_message_size:
-                                logger.error(f"消息太大或格式错误，清空缓冲区: {e}")
-                                logger.error(f"缓冲区数据: {data_buffer[:100]}...")
-                                data_buffer = b""
-                                self.send_error(client_id, "消息格式错误或太大")
-                        except UnicodeDecodeError as e:
-                            logger.error(f"解码错误，清空缓冲区: {e}")
-                            data_buffer = b""
-                            self.send_error(client_id, "消息编码错误")
-                        
-                except Exception as e:
-                    logger.error(f"处理客户端消息时出错: {e}")
-                    logger.error(traceback.format_exc())
+                chunk = await reader.read(DEFAULT_RECV_SIZE)
+                if not chunk:
+                    logger.info(f"客户端 {client_id} 关闭连接")
                     break
+                
+                decoder.feed(chunk)
+                # 更新客户端最后活动时间
+                self.client_last_seen[client_id] = time.time()
+                
+                # 一次读取可能包含多条消息，逐条切出处理
+                while True:
+                    try:
+                        frame = decoder.next_frame()
+                    except FrameError as e:
+                        logger.error(f"消息格式错误或太大，清空缓冲区: {e}")
+                        await self.send_error(client_id, "消息格式错误或太大")
+                        break
+                    if frame is None:
+                        break
+                    
+                    # 检查是否是心跳消息 "ping"
+                    if frame == b"ping":
+                        await self.send_to_client(client_id, b"pong", msg_type="pong")
+                        logger.debug(f"收到ping,回复pong (客户端: {client_id})")
+                        continue
+                    
+                    try:
+                        data = json_codec.loads(frame)
+                    except json_codec.JSONDecodeError as e:
+                        logger.error(f"JSON解析失败: {e}, 数据: {frame[:100]}...")
+                        await self.send_error(client_id, "消息格式错误")
+                        continue
+                    logger.info(f"收到来自客户端 {client_id} 的消息: {data}")
+                    
+                    # 识别客户端类型，同时协商帧格式
+                    if isinstance(data, dict) and 'client_type' in data:
+                        framing = data.get('framing') or FRAMING_RAW
+                        if framing not in SUPPORTED_FRAMINGS:
+                            await self.send_error(client_id, f"不支持的帧格式: {framing}")
+                            continue
+                        client_type = data['client_type']
+                        self.client_types[client_id] = client_type
+                        self.client_framing[client_id] = framing
+                        logger.info(f"客户端 {client_id} 标识为: {client_type}, 帧格式: {framing}")
+                        
+                        # 发送确认消息(已按协商的帧格式发送)
+                        await self.send_to_client(client_id, {
+                            "type": "connection_established",
+                            "client_id": client_id,
+                            "message": f"连接已建立 ({client_type})",
+                            "framing": framing,
+                            "framings": list(SUPPORTED_FRAMINGS),
+                            "server_time": time.time()
+                        })
+                        continue
+                    
+                    await self._dispatch_message(client_id, data)
                     
+        except asyncio.CancelledError:
+            # 超时清理或服务器停止时取消
+            pass
+        except (ConnectionError, OSError) as e:
+            logger.info(f"客户端 {client_id} 连接断开: {e}")
         except Exception as e:
             logger.error(f"处理客户端连接时出错: {e}")
             logger.error(traceback.format_exc())
         finally:
             # 清理客户端连接
-            self.remove_client(client_id, client_type)
+            await self.remove_client(client_id, client_type)
     
-    def remove_client(self, client_id: str, client_type: str = "unknown"):
-        """安全地移除客户端连接
+    async def _call_handler(self, handler: Callable, *args):
+        """调用处理器，同时支持普通函数和协程函数
+        
+        普通函数在线程池中执行，其中的阻塞调用不会卡住事件循环上的其他连接。
+        """
+        if inspect.iscoroutinefunction(handler):
+            result = handler(*args)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, functools.partial(handler, *args))
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    
+    async def _dispatch_message(self, client_id: str, data: Any):
+        """按消息类型调用处理器
         
         Args:
             client_id: 客户端ID
-            client_type: 客户端类型
+            data: 解析后的消息
         """
-        with self.lock:
-            if client_id in self.clients:
+        if not isinstance(data, dict) or 'type' not in data:
+            logger.warning(f"消息缺少类型字段: {data}")
+            await self.send_error(client_id, "消息缺少类型字段")
+            return
+        
+        msg_type = data['type']
+        logger.info(f"处理类型 {msg_type} 的消息")
+        
+        # 处理心跳消息
+        if msg_type == "heartbeat":
+            await self.send_to_client(client_id, {
+                "type": "heartbeat",
+                "server_time": time.time()
+            })
+            logger.debug(f"收到心跳包,已回复 (客户端: {client_id})")
+            return
+        
+        # 处理Unity客户端直接发送的问题消息
+        if msg_type == "question":
+            logger.info(f"收到Unity客户端直接发送的问题消息: {data}")
+            # 将这种消息路由到task_new处理器
+            if "task_new" in self.handlers:
+                for handler in self.handlers["task_new"]:
+                    try:
+                        await self._call_handler(handler, client_id, data)
+                    except Exception as e:
+                        logger.error(f"处理question消息时出错: {e}")
+                        logger.error(traceback.format_exc())
+                        await self.send_error(client_id, f"处理消息时出错: {str(e)}")
+            else:
+                logger.warning("未找到task_new处理器，无法处理question类型消息")
+                await self.send_error(client_id, "服务器未配置处理此类消息的处理器")
+            return
+        
+        # 调用对应的消息处理器
+        if msg_type in self.handlers:
+            for handler in self.handlers[msg_type]:
                 try:
-                    # 尝试优雅地关闭连接
-                    self.clients[client_id].close()
+                    await self._call_handler(handler, client_id, data)
                 except Exception as e:
-                    logger.debug(f"关闭连接时出错: {e}")
-                    
-                del self.clients[client_id]
-                
-            if client_id in self.client_types:
-                del self.client_types[client_id]
-                
-            if client_id in self.client_last_seen:
-                del self.client_last_seen[client_id]
+                    logger.error(f"处理消息时出错: {e}")
+                    logger.error(traceback.format_exc())
+                    await self.send_error(client_id, f"处理消息时出错: {str(e)}")
+        else:
+            logger.warning(f"未处理的消息类型: {msg_type}")
+            await self.send_error(client_id, f"未知的消息类型: {msg_type}")
+    
+    async def remove_client(self, client_id: str, client_type: str = "unknown"):
+        """安全地移除客户端连接，可重复调用
+        
+        Args:
+            client_id: 客户端ID
+            client_type: 客户端类型
+        """
+        writer = self.clients.pop(client_id, None)
+        if writer is None:
+            return
+        
+        client_type = self.client_types.pop(client_id, client_type)
+        self.client_framing.pop(client_id, None)
+        self.client_last_seen.pop(client_id, None)
+        self.send_queues.pop(client_id, None)
+        tasks = (self.client_tasks.pop(client_id, None), self.writer_tasks.pop(client_id, None))
+        
+        try:
+            # 尝试优雅地关闭连接
+            writer.close()
+        except Exception as e:
+            logger.debug(f"关闭连接时出错: {e}")
+        
+        # 结束该连接的读取和写任务(调用者自身所在的任务除外)，等待其退出
+        tasks = [task for task in tasks if task is not None and task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        if self.on_disconnect:
+            try:
+                await self._call_handler(self.on_disconnect, client_id)
+            except Exception as e:
+                logger.error(f"处理客户端断开回调时出错: {e}")
                 
         logger.info(f"客户端 {client_id} ({client_type}) 连接已清理")
     
@@ -239,199 +335,238 @@ class TCPServer:
         
         Args:
             message_type: 消息类型
-            handler: 处理函数，参数为(client_id, message)
+            handler: 处理函数或协程函数，参数为(client_id, message)。
+                普通函数在线程池中执行；协程函数在事件循环中执行，其中的阻塞调用应使用asyncio.to_thread
         """
-        with self.lock:
-            if message_type not in self.handlers:
-                self.handlers[message_type] = []
-            
-            self.handlers[message_type].append(handler)
+        if message_type not in self.handlers:
+            self.handlers[message_type] = []
+        
+        self.handlers[message_type].append(handler)
         logger.info(f"已注册处理器用于消息类型 {message_type}")
     
-    def send_to_client(self, client_id: str, message: Union[dict, str]) -> bool:
+    async def send_to_client(self, client_id: str, message: Union[dict, str, bytes],
+                             msg_type: Optional[str] = None) -> bool:
         """发送消息到特定客户端
         
+        消息放入该客户端的发送队列后立即返回，由其写任务按顺序发出。
+        
         Args:
             client_id: 客户端ID
-            message: 要发送的消息，字典会被转换为JSON
+            message: 要发送的消息，字典会被转换为JSON，bytes为已序列化的消息
+            msg_type: 消息类型，用于coalesce策略；字典消息默认取其type字段
             
         Returns:
-            bool: 是否成功发送
+            bool: 是否已放入发送队列
         """
-        with self.lock:
-            if client_id not in self.clients:
-                logger.warning(f"客户端 {client_id} 不存在")
-                return False
+        if client_id not in self.clients:
+            logger.warning(f"客户端 {client_id} 不存在")
+            return False
+        if msg_type is None and isinstance(message, dict):
+            msg_type = message.get('type')
+        framing = self.client_framing.get(client_id, FRAMING_RAW)
         
         try:
-            if isinstance(message, dict):
-                message = json.dumps(message, ensure_ascii=False)
-            
-            data = message.encode('utf-8')
-            
-            with self.lock:
-                client_socket = self.clients.get(client_id)
-                if not client_socket:
-                    return False
-                client_socket.sendall(data)
+            data = encode_frame(self._encode_message(message), framing)
+        except FrameError as e:
+            logger.error(f"发送消息到客户端 {client_id} 失败: {e}")
+            return False
+        return await self._enqueue(client_id, data, msg_type)
+    
+    def get_overflow_policy(self, client_id: str) -> str:
+        """获取客户端发送队列的溢出策略"""
+        client_type = self.client_types.get(client_id)
+        return self.overflow_policies.get(client_type, self.overflow_policy)
+    
+    async def _enqueue(self, client_id: str, frame: bytes, msg_type: Optional[str] = None) -> bool:
+        """将已封装好的帧放入客户端发送队列，队列满时按溢出策略处理"""
+        queue = self.send_queues.get(client_id)
+        if queue is None:
+            return False
+        
+        if len(queue) >= queue.maxsize:
+            policy = self.get_overflow_policy(client_id)
+            if policy == OVERFLOW_DISCONNECT:
+                logger.warning(f"客户端 {client_id} 发送队列已满({len(queue)}条)，断开慢客户端")
+                self.evicted_clients += 1
+                await self.remove_client(client_id)
+                return False
             
-            logger.debug(f"已发送消息到客户端 {client_id}")
-            return True
+            same_type = None
+            if policy == OVERFLOW_COALESCE and msg_type is not None:
+                same_type = next((i for i, item in enumerate(queue.items) if item[0] == msg_type), None)
+            if same_type is not None:
+                # 同类型的旧消息已过时，用新消息替代
+                del queue.items[same_type]
+                queue.coalesced += 1
+                self.coalesced_messages += 1
+            else:
+                queue.items.popleft()
+                queue.dropped += 1
+                self.dropped_messages += 1
+                if queue.dropped == 1 or queue.dropped % 100 == 0:
+                    logger.warning(f"客户端 {client_id} 发送队列已满，已丢弃 {queue.dropped} 条消息")
+        
+        queue.items.append((msg_type, frame))
+        queue.max_depth = max(queue.max_depth, len(queue))
+        queue.ready.set()
+        return True
+    
+    async def _writer_loop(self, client_id: str, writer: asyncio.StreamWriter, queue: ClientSendQueue):
+        """客户端写任务：取出队列中的全部消息一次写出，等待对方接收后再取下一批"""
+        try:
+            while True:
+                await queue.ready.wait()
+                queue.ready.clear()
+                if not queue.items:
+                    continue
+                
+                frames = [frame for _, frame in queue.items]
+                queue.items.clear()
+                writer.writelines(frames)
+                await asyncio.wait_for(writer.drain(), self.send_timeout)
+                queue.sent += len(frames)
+                logger.debug(f"已发送 {len(frames)} 条消息到客户端 {client_id}")
+        except asyncio.CancelledError:
+            return
+        except asyncio.TimeoutError:
+            logger.warning(f"客户端 {client_id} 超过 {self.send_timeout} 秒未接收数据，断开慢客户端")
+            self.evicted_clients += 1
         except Exception as e:
             logger.error(f"发送消息到客户端 {client_id} 时出错: {e}")
-            logger.error(traceback.format_exc())
-            # 连接可能已关闭，移除客户端
-            with self.lock:
-                client_type = self.client_types.get(client_id, "unknown")
-            self.remove_client(client_id, client_type)
-            return False
+        # 连接可能已关闭，移除客户端
+        await self.remove_client(client_id, self.client_types.get(client_id, "unknown"))
+    
+    @staticmethod
+    def _encode_message(message: Union[dict, str, bytes]) -> bytes:
+        """将消息转换为发送用的字节"""
+        if isinstance(message, (bytes, bytearray)):
+            return message
+        if isinstance(message, str):
+            return message.encode('utf-8')
+        return json_codec.dumpb(message)
     
-    def broadcast(self, message: Union[dict, str], client_type: Optional[str] = None) -> int:
+    async def broadcast(self, message: Union[dict, str, bytes], client_type: Optional[str] = None,
+                        msg_type: Optional[str] = None) -> int:
         """广播消息到所有客户端或特定类型的客户端
         
+        消息只序列化一次，每种帧格式只封装一次，同一份字节放入所有客户端的发送队列。
+        
         Args:
             message: 要发送的消息，字典会被转换为JSON
             client_type: 可选，客户端类型
+            msg_type: 消息类型，用于coalesce策略；字典消息默认取其type字段
             
         Returns:
-            int: 成功发送的客户端数量
+            int: 成功放入发送队列的客户端数量
         """
-        sent_count = 0
-        client_ids = []
-        
-        with self.lock:
-            if client_type:
-                # 广播到特定类型的客户端
-                for cid, ctype in self.client_types.items():
-                    if ctype == client_type:
-                        client_ids.append(cid)
-            else:
-                # 广播到所有客户端
-                client_ids = list(self.clients.keys())
+        if client_type:
+            # 广播到特定类型的客户端
+            client_ids = [cid for cid, ctype in self.client_types.items() if ctype == client_type]
+        else:
+            # 广播到所有客户端
+            client_ids = list(self.clients.keys())
         
+        if msg_type is None and isinstance(message, dict):
+            msg_type = message.get('type')
+        data = self._encode_message(message)
+        frames = {}
+        sent_count = 0
         for client_id in client_ids:
-            if self.send_to_client(client_id, message):
+            framing = self.client_framing.get(client_id, FRAMING_RAW)
+            if framing not in frames:
+                try:
+                    frames[framing] = encode_frame(data, framing)
+                except FrameError as e:
+                    logger.error(f"广播消息失败: {e}")
+                    return sent_count
+            if await self._enqueue(client_id, frames[framing], msg_type):
                 sent_count += 1
         
         logger.info(f"广播消息到 {sent_count} 个客户端")
         return sent_count
     
-    def heartbeat_sender(self):
-        """发送心跳包线程"""
-        while self.running:
-            try:
-                current_time = time.time()
-                with self.lock:
-                    for client_id in list(self.clients.keys()):
-                        try:
-                            # 发送心跳包
-                            self.send_to_client(client_id, {
-                                "type": "heartbeat",
-                                "server_time": current_time
-                            })
-                        except Exception as e:
-                            logger.error(f"发送心跳包到客户端 {client_id} 时出错: {e}")
-            except Exception as e:
-                logger.error(f"心跳发送器出错: {e}")
-                logger.error(traceback.format_exc())
-            
-            # 等待下一次心跳
-            time.sleep(self.heartbeat_interval)
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接和发送队列统计信息"""
+        queues = {}
+        for client_id, queue in self.send_queues.items():
+            queues[client_id] = {
+                'client_type': self.client_types.get(client_id, "unknown"),
+                'overflow_policy': self.get_overflow_policy(client_id),
+                'queue_depth': len(queue),
+                'max_queue_depth': queue.max_depth,
+                'sent': queue.sent,
+                'dropped': queue.dropped,
+                'coalesced': queue.coalesced
+            }
+        client_types = {}
+        for client_id in self.clients:
+            client_type = self.client_types.get(client_id, "unknown")
+            client_types[client_type] = client_types.get(client_type, 0) + 1
+        return {
+            'running': self.running,
+            'clients': len(self.clients),
+            'client_types': client_types,
+            'send_queue_size': self.send_queue_size,
+            'overflow_policy': self.overflow_policy,
+            'overflow_policies': dict(self.overflow_policies),
+            'queued_messages': sum(len(queue) for queue in self.send_queues.values()),
+            'dropped_messages': self.dropped_messages,
+            'coalesced_messages': self.coalesced_messages,
+            'evicted_clients': self.evicted_clients,
+            'queues': queues
+        }
     
-    def connection_cleanup(self):
-        """连接清理线程"""
+    async def sweep_loop(self):
+        """心跳和超时检查共用的定时任务"""
+        interval = max(1, min(self.heartbeat_interval, 10))
+        last_heartbeat = time.time()
         while self.running:
+            await asyncio.sleep(interval)
             try:
                 current_time = time.time()
-                clients_to_remove = []
-                
-                with self.lock:
-                    # 检查超时的客户端
-                    for client_id, last_seen in self.client_last_seen.items():
-                        if current_time - last_seen > self.connection_timeout:
-                            client_type = self.client_types.get(client_id, "unknown")
-                            logger.info(f"客户端 {client_id} ({client_type}) 连接超时")
-                            clients_to_remove.append((client_id, client_type))
                 
                 # 移除超时的客户端
-                for client_id, client_type in clients_to_remove:
-                    self.remove_client(client_id, client_type)
-            except Exception as e:
-                logger.error(f"连接清理器出错: {e}")
-                logger.error(traceback.format_exc())
-            
-            # 等待下一次清理
-            time.sleep(10)  # 每10秒检查一次
-    
-    def client_acceptor(self):
-        """客户端接受线程"""
-        self.server_socket.listen(5)
-        logger.info(f"TCP服务器监听在 {self.host}:{self.port}")
-        
-        while self.running:
-            try:
-                # 等待新客户端连接
-                try:
-                    client_socket, address = self.server_socket.accept()
-                    logger.info(f"新客户端连接来自 {address}")
-                    # 为每个客户端创建一个新线程
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                except socket.timeout:
-                    # 超时继续循环
-                    continue
-                except Exception as e:
-                    logger.error(f"接受客户端连接时出错: {e}")
-                    if not self.running:
-                        break
+                for client_id, last_seen in list(self.client_last_seen.items()):
+                    if current_time - last_seen > self.connection_timeout:
+                        client_type = self.client_types.get(client_id, "unknown")
+                        logger.info(f"客户端 {client_id} ({client_type}) 连接超时")
+                        await self.remove_client(client_id, client_type)
+                
+                # 发送心跳包
+                if current_time - last_heartbeat >= self.heartbeat_interval:
+                    last_heartbeat = current_time
+                    await self.broadcast({
+                        "type": "heartbeat",
+                        "server_time": current_time
+                    })
             except Exception as e:
-                logger.error(f"客户端接受器出错: {e}")
+                logger.error(f"心跳和超时检查出错: {e}")
                 logger.error(traceback.format_exc())
-                if not self.running:
-                    break
     
-    def start(self):
-        """启动服务器"""
+    async def start(self):
+        """启动服务器，并一直运行到调用stop()为止"""
         if self.running:
             logger.warning("服务器已经在运行")
             return
         
+        self.running = True
+        self._stopped = asyncio.Event()
         try:
-            # 创建服务器socket
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.settimeout(1.0)  # 设置超时以允许正常关闭
-            self.server_socket.bind((self.host, self.port))
-            
-            self.running = True
-            
-            # 启动客户端接受线程
-            self.client_thread = threading.Thread(target=self.client_acceptor)
-            self.client_thread.daemon = True
-            self.client_thread.start()
-            
-            # 启动心跳发送线程
-            self.heartbeat_thread = threading.Thread(target=self.heartbeat_sender)
-            self.heartbeat_thread.daemon = True
-            self.heartbeat_thread.start()
-            
-            # 启动连接清理线程
-            self.cleanup_thread = threading.Thread(target=self.connection_cleanup)
-            self.cleanup_thread.daemon = True
-            self.cleanup_thread.start()
-            
-            logger.info("TCP服务器已启动")
+            self.server = await asyncio.start_server(
+                self.handle_client, self.host, self.port, reuse_address=True
+            )
         except Exception as e:
             self.running = False
             logger.error(f"启动服务器时出错: {e}")
             logger.error(traceback.format_exc())
             raise
+        
+        self.sweep_task = asyncio.create_task(self.sweep_loop())
+        logger.info(f"TCP服务器监听在 {self.host}:{self.port}")
+        logger.info("TCP服务器已启动")
+        await self._stopped.wait()
     
-    def stop(self):
+    async def stop(self):
         """停止服务器"""
         if not self.running:
             logger.warning("服务器已经停止")
@@ -441,29 +576,32 @@ class TCPServer:
         logger.info("正在停止TCP服务器...")
         
         try:
+            # 停止接受新连接
+            if self.server:
+                self.server.close()
+            
+            if self.sweep_task:
+                self.sweep_task.cancel()
+                await asyncio.gather(self.sweep_task, return_exceptions=True)
+                self.sweep_task = None
+            
             # 关闭所有客户端连接
-            with self.lock:
-                for client_id, client_socket in list(self.clients.items()):
-                    try:
-                        client_socket.close()
-                    except Exception as e:
-                        logger.debug(f"关闭客户端 {client_id} 连接时出错: {e}")
-                
-                self.clients.clear()
-                self.client_types.clear()
-                self.client_last_seen.clear()
+            for client_id in list(self.clients.keys()):
+                await self.remove_client(client_id)
             
-            # 关闭服务器socket
-            if self.server_socket:
-                self.server_socket.close()
-                self.server_socket = None
+            if self.server:
+                await self.server.wait_closed()
+                self.server = None
             
             logger.info("TCP服务器已停止")
         except Exception as e:
             logger.error(f"停止服务器时出错: {e}")
             logger.error(traceback.format_exc())
+        finally:
+            if self._stopped:
+                self._stopped.set()
     
-    def send_error(self, client_id: str, error_message: str):
+    async def send_error(self, client_id: str, error_message: str):
         """发送错误消息到客户端
         
         Args:
@@ -475,7 +613,7 @@ class TCPServer:
             "error": error_message,
             "server_time": time.time()
         }
-        self.send_to_client(client_id, error_data)
+        await self.send_to_client(client_id, error_data)
 
 # 兼容性别名，保持API一致性
 WebSocketServer = TCPServer
@@ -493,14 +631,9 @@ if __name__ == "__main__":
     server.register_handler("echo", echo_handler)
     
     try:
-        server.start()
         print("服务器已启动，按 Ctrl+C 停止")
-        
-        # 保持主线程运行
-        while True:
-            time.sleep(1)
+        asyncio.run(server.start())
     except KeyboardInterrupt:
         print("接收到中断信号，停止服务器")
     finally:
-        server.stop()
-        print("服务器已停止") 
\ No newline at end of file
+        print("服务器已停止")
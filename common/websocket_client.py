@@ -6,7 +6,6 @@
 """
 
 import asyncio
-import json
 import logging
 import time
 import random
@@ -18,6 +17,12 @@ import websockets
 from websockets.client import WebSocketClientProtocol
 from websockets.exceptions import ConnectionClosed, ConnectionClosedError, ConnectionClosedOK
 
+try:
+    import json_codec
+except ImportError:
+    # 作为common包的子模块导入
+    from common import json_codec
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -308,25 +313,20 @@ class WebSocketClient:
             return False
         
         try:
-            # 处理消息大小限制
-            if isinstance(message, dict):
-                json_message = json.dumps(message)
-                message_size = len(json_message.encode('utf-8'))  # 获取实际字节大小
-                if message_size > self.max_message_size:
-                    logger.error(f"消息大小超出限制: {message_size} > {self.max_message_size}")
-                    return False
-            elif isinstance(message, str):
-                message_size = len(message.encode('utf-8'))  # 获取实际字节大小
-                if message_size > self.max_message_size:
-                    logger.error(f"消息大小超出限制: {message_size} > {self.max_message_size}")
-                    return False
-                
-            # 准备发送的消息
+            # 字典只序列化一次，同时用于大小检查和发送
             if isinstance(message, dict):
-                send_message = json.dumps(message)
+                payload = json_codec.dumpb(message)
+                send_message = payload.decode('utf-8')
             else:
+                payload = message.encode('utf-8') if isinstance(message, str) else message
                 send_message = message
             
+            # 处理消息大小限制(实际字节大小)
+            message_size = len(payload)
+            if message_size > self.max_message_size:
+                logger.error(f"消息大小超出限制: {message_size} > {self.max_message_size}")
+                return False
+            
             # 设置发送超时
             try:
                 await asyncio.wait_for(self.ws.send(send_message), timeout=self.send_timeout)
@@ -519,7 +519,7 @@ class WebSocketClient:
                     # 处理接收到的消息
                     await self._process_message(message)
                         
-                except json.JSONDecodeError:
+                except json_codec.JSONDecodeError:
                     logger.error(f"无效的JSON消息: {message[:200]}...")
                 except Exception as e:
                     logger.error(f"处理消息时出错: {e}")
@@ -546,7 +546,7 @@ class WebSocketClient:
             message: 接收到的消息
         """
         try:
-            data = json.loads(message)
+            data = json_codec.loads(message)
             
             # 处理心跳响应
             if data.get('type') == 'heartbeat':
@@ -590,7 +590,7 @@ class WebSocketClient:
                     logger.warning(f"未处理的消息类型: {msg_type}")
             else:
                 logger.warning(f"消息缺少类型字段: {data}")
-        except json.JSONDecodeError:
+        except json_codec.JSONDecodeError:
             # 尝试处理非JSON格式的消息
             logger.warning(f"收到非JSON格式消息: {message[:100]}...")
             
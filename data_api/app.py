@@ -5,11 +5,16 @@
 正山堂茶业消费者行为分析系统 - API服务
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request, send_file
+from flask.json.provider import DefaultJSONProvider
 import sqlite3
 import os
 import sys
-import json
+import time
+import logging
+import base64
+import shutil
+import tempfile
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -34,19 +39,141 @@ except ImportError as e:
         CORS(app)
         return {"host": "127.0.0.1", "port": 5000, "debug": False}
 
+# 导入公共模块中的数据库连接池
+common_path = current_dir.parent / 'common'
+if str(common_path) not in sys.path:
+    sys.path.insert(0, str(common_path))
+import json_codec
+from db_pool import get_pool
+from response_cache import ResponseCache
+from batch_query import BatchError, SnapshotConnections, execute_batch, parse_batch_request
+from data_export import EXPORT_TABLES, export_database
+from run_registry import UnknownRunError, list_runs, resolve_run
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify使用项目统一的JSON编解码(安装orjson时使用orjson)，中文不转义
+    
+    sort_keys/indent与DefaultJSONProvider一致；datetime始终交给default，
+    两种后端都输出HTTP日期格式
+    """
+    
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj, default=kwargs.get("default", self.default),
+                                indent=kwargs.get("indent"),
+                                sort_keys=kwargs.get("sort_keys", self.sort_keys),
+                                native_datetime=False)
+    
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 
 # 使用配置集成模块配置应用
 app_config = configure_app(app)
 
-# 获取数据库路径
+# 运行日志和访问日志，由启动入口(serve.py)配置输出
+logger = logging.getLogger('data_api')
+access_logger = logging.getLogger('data_api.access')
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间，用于访问日志中的耗时"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def log_access(response):
+    """记录结构化访问日志，每个请求一行JSON"""
+    if access_logger.isEnabledFor(logging.INFO):
+        started = g.get('request_started')
+        access_logger.info(json_codec.dumps({
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'remote_addr': request.remote_addr,
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('utf-8', 'replace'),
+            'status': response.status_code,
+            'bytes': response.content_length,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2) if started is not None else None,
+            'user_agent': request.user_agent.string
+        }))
+    return response
+
+# 获取数据库连接
+def connect_db(db_path):
+    """获取数据库连接，调用close()时归还
+    
+    批量查询期间返回本次批量查询共享的快照连接，保证各子查询看到同一份数据。
+    """
+    snapshot = g.get('batch_snapshot')
+    if snapshot is not None:
+        return snapshot.connect(db_path)
+    return get_pool(db_path).connect()
+
 def get_db_connection():
-    """获取数据库连接"""
-    db_path = get_db_path()
-    print(f"连接到数据库: {db_path}")
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """从共享连接池获取主数据库连接，调用close()时归还"""
+    return connect_db(get_db_path())
+
+def get_run_connection():
+    """按请求中的run参数获取(运行ID, 数据库连接)
+    
+    未指定run时使用最近有数据写入的运行；按运行分库时连接该运行的数据库文件。
+    运行不存在时抛出UnknownRunError，由错误处理返回404。
+    """
+    run_id, db_path = resolve_run(get_db_path(), request.args.get('run'))
+    return run_id, connect_db(db_path)
+
+@app.errorhandler(UnknownRunError)
+def handle_unknown_run(error):
+    """请求的模拟运行不存在"""
+    return jsonify({'error': f'模拟运行不存在: {error.args[0]}'}), 404
+
+class InvalidArgumentError(ValueError):
+    """请求参数格式错误"""
+
+@app.errorhandler(InvalidArgumentError)
+def handle_invalid_argument(error):
+    """请求参数格式错误，返回400"""
+    return jsonify({'error': str(error)}), 400
+
+def get_int_arg(name, default=None):
+    """读取整数查询参数，未提供时返回默认值
+    
+    格式错误时抛出InvalidArgumentError，由错误处理返回400。
+    各接口应在获取数据库连接之前解析参数。
+    """
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidArgumentError(f'参数{name}必须是整数: {value}')
+
+def query_rollup(cursor, query, params=()):
+    """查询汇总表，汇总表不存在(旧数据库尚未升级)时返回空列表"""
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"查询汇总表出错: {e}，请运行 python erniebot/db_maintenance.py rebuild-rollups")
+        return []
+
+def get_data_version():
+    """读取DBManager写入时递增的数据版本号，旧数据库没有版本表时返回None(不缓存)"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM data_version WHERE id = 1")
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+# 按数据版本失效的响应缓存，数据未更新时仪表盘的重复请求不再查询数据库
+response_cache = ResponseCache(get_data_version)
 
 @app.route('/')
 def index():
@@ -63,38 +190,41 @@ def index():
             '/api/consumer/region',
             '/api/consumer/psychology',
             '/api/system/status',
-            '/api/system/refresh'
+            '/api/system/refresh',
+            '/api/runs',
+            '/api/batch',
+            '/api/export/<table>'
         ]
     })
 
 @app.route('/api/dashboard/metrics', methods=['GET'])
+@response_cache.cached
 def get_dashboard_metrics():
     """获取仪表盘主要指标"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # 获取日期范围
-    days = request.args.get('days', '7')
+    days = get_int_arg('days', 7)
     time_range = request.args.get('timeRange', 'all')
-    days = int(days)
     
-    # 直接从consumer_actions表查询统计数据
-    print("从consumer_actions直接统计数据")
-    
-    cursor.execute('''
-    SELECT 
-        COUNT(CASE WHEN purchase = 1 THEN 1 ELSE NULL END) as total_orders,
-        SUM(CASE WHEN purchase = 1 THEN amount ELSE 0 END) as total_gmv,
-        COUNT(DISTINCT customer_id) as total_users,
-        COUNT(DISTINCT CASE WHEN is_new_visit = 1 THEN customer_id END) as new_users,
-        COUNT(DISTINCT CASE WHEN is_new_visit = 0 THEN customer_id END) as returning_users,
-        AVG(CASE WHEN purchase = 1 THEN amount ELSE NULL END) as avg_order
-    FROM consumer_actions
-    ''')
+    run_id, conn = get_run_connection()
+    try:
+        # 从入库时增量维护的总计表读取，不再扫描consumer_actions
+        rows = query_rollup(conn.cursor(), '''
+        SELECT 
+            total_orders,
+            total_gmv,
+            total_users,
+            new_users,
+            returning_users,
+            CASE WHEN total_orders > 0 THEN total_gmv * 1.0 / total_orders END as avg_order
+        FROM rollup_totals
+        WHERE run_id = ?
+        ''', (run_id,))
+    finally:
+        conn.close()
     
-    direct_stats = cursor.fetchone()
+    direct_stats = rows[0] if rows else None
     
-    # 使用直接统计的数据
+    # 使用汇总的数据
     if direct_stats:
         current_stats = {
             'total_orders': direct_stats['total_orders'] or 0,
@@ -135,23 +265,19 @@ def get_dashboard_metrics():
         'total_returns': current_stats['total_returns'] or 0,
         'yoy_orders': round(yoy_orders, 2),
         'yoy_gmv': round(yoy_gmv, 2),
-        'yoy_users': round(yoy_users, 2)
+        'yoy_users': round(yoy_users, 2),
+        'run_id': run_id
     }
     
-    conn.close()
-    
     return jsonify(metrics)
 
 @app.route('/api/dashboard/trend', methods=['GET'])
+@response_cache.cached
 def get_dashboard_trend():
     """获取趋势数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # 获取日期范围
-    days = request.args.get('days', '30')
+    days = get_int_arg('days', 30)
     time_range = request.args.get('timeRange', 'all')
-    days = int(days)
     
     # 初始化结果变量
     result = {
@@ -162,28 +288,27 @@ def get_dashboard_trend():
     }
     
     # 打印请求信息，帮助调试
-    print(f"获取趋势数据请求：days={days}, timeRange={time_range}")
+    logger.debug(f"获取趋势数据请求：days={days}, timeRange={time_range}")
     
-    # 直接查询所有consumer_actions数据，按日期分组
+    # 从按天汇总表读取，按模拟天数排序
     query = '''
     SELECT 
-        timestamp as date,
-        COUNT(DISTINCT customer_id) as users,
-        COUNT(CASE WHEN purchase = 1 THEN 1 END) as orders,
-        SUM(CASE WHEN purchase = 1 THEN amount ELSE 0 END) as gmv
-    FROM consumer_actions
-    GROUP BY timestamp
-    ORDER BY 
-        CASE 
-            WHEN timestamp LIKE 'Day%' THEN CAST(REPLACE(timestamp, 'Day', '') AS INTEGER)
-            ELSE timestamp 
-        END
+        'Day' || day_of_simulation as date,
+        users,
+        purchases as orders,
+        gmv
+    FROM rollup_daily
+    WHERE run_id = ?
+    ORDER BY day_of_simulation
     '''
     
-    cursor.execute(query)
-    trend_data = cursor.fetchall()
+    run_id, conn = get_run_connection()
+    try:
+        trend_data = query_rollup(conn.cursor(), query, (run_id,))
+    finally:
+        conn.close()
     
-    print(f"查询到的原始数据: {[dict(row) for row in trend_data]}")
+    logger.debug(f"查询到的原始数据: {[dict(row) for row in trend_data]}")
     
     # 检查是否有数据
     if trend_data and len(trend_data) > 0:
@@ -195,115 +320,64 @@ def get_dashboard_trend():
             'users': [row['users'] or 0 for row in trend_data]
         }
         
-        print(f"查询到{len(trend_data)}天的销售趋势数据")
+        logger.debug(f"查询到{len(trend_data)}天的销售趋势数据")
     
     # 如果数据少于2天，生成模拟数据补充
     if len(result['dates']) < 2:
-        print(f"数据不足，当前只有{len(result['dates'])}天，生成模拟数据补充")
+        logger.info(f"数据不足，当前只有{len(result['dates'])}天，生成模拟数据补充")
         
         import random
         
-        # 保留现有数据
-        existing_dates = result['dates']
-        existing_orders = result['orders']
-        existing_gmv = result['gmv']
-        existing_users = result['users']
-        
-        # 生成30天的模拟数据
-        simulated_dates = []
-        simulated_orders = []
-        simulated_gmv = []
-        simulated_users = []
-        
-        # 如果已有数据是日期格式，则按照日期格式生成；否则使用Day1-Day30格式
-        if existing_dates and existing_dates[0].startswith('202'):
-            # 使用日期格式
-            from datetime import datetime, timedelta
-            
-            # 如果有现有数据，从现有数据的日期开始；否则从当前日期开始
-            if existing_dates:
-                try:
-                    start_date = datetime.strptime(existing_dates[0], "%Y-%m-%d")
-                except:
-                    start_date = datetime.now()
+        # 保留现有数据，其余天数使用Day1-Day30格式的模拟数据，按天数顺序生成，无需再排序
+        existing = {
+            int(date[3:]): (orders, gmv, users)
+            for date, orders, gmv, users in zip(result['dates'], result['orders'], result['gmv'], result['users'])
+        }
+        result = {'dates': [], 'orders': [], 'gmv': [], 'users': []}
+        for i in range(1, max([30] + list(existing)) + 1):
+            if i in existing:
+                order_count, gmv, users = existing[i]
             else:
-                start_date = datetime.now()
-            
-            # 生成前15天和后15天的数据
-            for i in range(-15, 15):
-                date = start_date + timedelta(days=i)
-                date_str = date.strftime("%Y-%m-%d")
-                
-                # 如果这一天已经有数据，跳过
-                if date_str in existing_dates:
-                    continue
-                    
-                # 生成随机数据
-                order_count = random.randint(30, 70)
-                simulated_dates.append(date_str)
-                simulated_orders.append(order_count)
-                simulated_gmv.append(order_count * random.randint(200, 500))
-                simulated_users.append(order_count + random.randint(10, 30))
-        else:
-            # 使用Day1-Day30格式
-            for i in range(1, 31):
-                day_str = f"Day{i}"
-                
-                # 如果这一天已经有数据，跳过
-                if day_str in existing_dates:
-                    continue
-                    
                 # 生成随机数据
                 order_count = random.randint(30, 70)
-                simulated_dates.append(day_str)
-                simulated_orders.append(order_count)
-                simulated_gmv.append(order_count * random.randint(200, 500))
-                simulated_users.append(order_count + random.randint(10, 30))
-        
-        # 合并现有数据和模拟数据
-        result['dates'] = existing_dates + simulated_dates
-        result['orders'] = existing_orders + simulated_orders
-        result['gmv'] = existing_gmv + simulated_gmv
-        result['users'] = existing_users + simulated_users
-        
-        # 排序数据
-        if result['dates'] and result['dates'][0].startswith('202'):
-            # 如果是日期格式，按日期排序
-            sorted_data = sorted(zip(result['dates'], result['orders'], result['gmv'], result['users']))
-            result['dates'] = [item[0] for item in sorted_data]
-            result['orders'] = [item[1] for item in sorted_data]
-            result['gmv'] = [item[2] for item in sorted_data]
-            result['users'] = [item[3] for item in sorted_data]
-        else:
-            # 如果是Day格式，按Day后面的数字排序
-            def day_key(day_str):
-                if day_str.startswith('Day'):
-                    try:
-                        return int(day_str[3:])
-                    except:
-                        return 0
-                return 0
-                
-            sorted_data = sorted(zip(result['dates'], result['orders'], result['gmv'], result['users']), 
-                                key=lambda x: day_key(x[0]))
-            result['dates'] = [item[0] for item in sorted_data]
-            result['orders'] = [item[1] for item in sorted_data]
-            result['gmv'] = [item[2] for item in sorted_data]
-            result['users'] = [item[3] for item in sorted_data]
+                gmv = order_count * random.randint(200, 500)
+                users = order_count + random.randint(10, 30)
+            result['dates'].append(f"Day{i}")
+            result['orders'].append(order_count)
+            result['gmv'].append(gmv)
+            result['users'].append(users)
     
     # 打印最终结果
-    print(f"最终返回的趋势数据: 共{len(result['dates'])}天")
-    
-    conn.close()
+    logger.debug(f"最终返回的趋势数据: 共{len(result['dates'])}天")
     
     return jsonify(result)
 
 # --- ADDED START ---
 @app.route('/api/dashboard/hot-products', methods=['GET'])
+@response_cache.cached
 def get_hot_products():
-    """获取热销产品数据 (占位符)"""
-    # TODO: 实现数据库查询逻辑
-    # 示例数据
+    """获取热销产品数据"""
+    run_id, conn = get_run_connection()
+    try:
+        # 从按产品汇总表读取销售额前5的产品
+        rows = query_rollup(conn.cursor(), '''
+        SELECT product_name, gmv, purchases
+        FROM rollup_product
+        WHERE run_id = ? AND product_name != ''
+        ORDER BY gmv DESC
+        LIMIT 5
+        ''', (run_id,))
+    finally:
+        conn.close()
+    
+    if rows:
+        hot_products = [
+            {'name': row['product_name'], 'sales': row['gmv'] or 0, 'orders': row['purchases'], 'rank': rank}
+            for rank, row in enumerate(rows, start=1)
+        ]
+        return jsonify(hot_products)
+    
+    # 没有销售数据时返回示例数据
     hot_products = [
         {'name': '金骏眉', 'sales': 15000, 'rank': 1},
         {'name': '正山小种', 'sales': 12000, 'rank': 2},
@@ -314,6 +388,7 @@ def get_hot_products():
     return jsonify(hot_products)
 
 @app.route('/api/dashboard/visitor-trend', methods=['GET'])
+@response_cache.cached
 def get_visitor_trend():
     """获取访客趋势数据 (占位符)"""
     # TODO: 实现数据库查询逻辑
@@ -325,71 +400,178 @@ def get_visitor_trend():
     return jsonify(visitor_trend)
 # --- ADDED END ---
 
+def encode_cursor(last_id, sort_order):
+    """将分页位置编码为不透明的游标字符串"""
+    payload = json_codec.dumps({'id': last_id, 'order': sort_order})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor_str):
+    """解析游标字符串，返回(最后一条记录的id, 排序方向)，无效时抛出ValueError"""
+    try:
+        padded = cursor_str + '=' * (-len(cursor_str) % 4)
+        payload = json_codec.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return int(payload['id']), payload['order']
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor_str}")
+
+def count_consumer_behavior(cursor, run_id, filters, where_sql, params):
+    """获取符合筛选条件的记录总数
+    
+    单一筛选条件(或无筛选)时直接读取入库时维护的汇总表，为O(1)查询；
+    组合筛选时使用COUNT(*)，由复合索引支持。
+    """
+    keys = set(filters)
+    if not keys:
+        rows = query_rollup(cursor, 'SELECT total_actions FROM rollup_totals WHERE run_id = ?', [run_id])
+        return rows[0][0] if rows else 0
+    if keys == {'consumer_type'}:
+        rows = query_rollup(cursor, 'SELECT total_actions FROM rollup_consumer_type WHERE run_id = ? AND consumer_type = ?',
+                            [run_id, filters['consumer_type']])
+        return rows[0][0] if rows else 0
+    if keys <= {'day_from', 'day_to'}:
+        rows = query_rollup(cursor, 'SELECT SUM(total_actions) FROM rollup_daily WHERE run_id = ? AND day_of_simulation BETWEEN ? AND ?',
+                            [run_id, filters.get('day_from', 0), filters.get('day_to', 2 ** 31)])
+        return (rows[0][0] or 0) if rows else 0
+    if keys == {'purchase'}:
+        rows = query_rollup(cursor, 'SELECT total_actions, total_orders FROM rollup_totals WHERE run_id = ?', [run_id])
+        if not rows:
+            return 0
+        return rows[0]['total_orders'] if filters['purchase'] else rows[0]['total_actions'] - rows[0]['total_orders']
+    
+    cursor.execute(f'SELECT COUNT(*) FROM consumer_actions {where_sql}', params)
+    return cursor.fetchone()[0]
+
 @app.route('/api/consumer/behavior', methods=['GET'])
+@response_cache.cached
 def get_consumer_behavior():
-    """获取消费者行为数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """获取消费者行为数据
+    
+    按id做游标(keyset)分页，翻到任意深度的代价都与第一页相同。
+    参数: run(运行ID，默认最近的运行), limit, cursor(上一页返回的nextCursor), sortOrder(asc/desc),
+    筛选: consumerType, region(地区或"地区-省份"), dayFrom, dayTo, purchase(0/1)。
+    未提供cursor时仍兼容旧的page参数(OFFSET分页)。
+    """
+    # 获取参数，全部在获取数据库连接之前解析
+    limit = max(1, min(get_int_arg('limit', 100), 1000))
+    page = get_int_arg('page', 1)
+    sort_order = 'asc' if request.args.get('sortOrder', 'desc').lower() == 'asc' else 'desc'
+    cursor_str = request.args.get('cursor')
+    last_id = None
+    if cursor_str:
+        try:
+            last_id, sort_order = decode_cursor(cursor_str)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    # 筛选条件
+    filters = {}
+    if request.args.get('consumerType'):
+        filters['consumer_type'] = request.args.get('consumerType')
+    if request.args.get('region'):
+        filters['region'] = request.args.get('region')
+    filters['day_from'] = get_int_arg('dayFrom')
+    filters['day_to'] = get_int_arg('dayTo')
+    if request.args.get('purchase') is not None:
+        filters['purchase'] = 1 if request.args.get('purchase') in ('1', 'true', 'True') else 0
+    filters = {key: value for key, value in filters.items() if value is not None}
+    
+    run_id, db_path = resolve_run(get_db_path(), request.args.get('run'))
     
-    # 获取参数
-    limit = request.args.get('limit', 100, type=int)
-    page = request.args.get('page', 1, type=int)
-    sort_by = request.args.get('sortBy', 'timestamp')
-    sort_order = request.args.get('sortOrder', 'desc')
+    # 所有条件都限定在一次运行内，由run_id开头的复合索引支持
+    conditions = ['run_id = ?']
+    params = [run_id]
+    if 'consumer_type' in filters:
+        conditions.append('consumer_type = ?')
+        params.append(filters['consumer_type'])
+    if 'region' in filters:
+        # region存储为"地区-省份"，只传地区时按前缀范围匹配该地区下的所有省份
+        if '-' in filters['region']:
+            conditions.append('region = ?')
+            params.append(filters['region'])
+        else:
+            conditions.append('region >= ? AND region < ?')
+            params.extend([filters['region'] + '-', filters['region'] + '.'])
+    if 'day_from' in filters:
+        conditions.append('day_of_simulation >= ?')
+        params.append(filters['day_from'])
+    if 'day_to' in filters:
+        conditions.append('day_of_simulation <= ?')
+        params.append(filters['day_to'])
+    if 'purchase' in filters:
+        conditions.append('purchase = ?')
+        params.append(filters['purchase'])
+    filter_sql = 'WHERE ' + ' AND '.join(conditions)
     
-    offset = (page - 1) * limit
+    page_conditions = list(conditions)
+    page_params = list(params)
+    offset = 0
+    if cursor_str:
+        page_conditions.append('id > ?' if sort_order == 'asc' else 'id < ?')
+        page_params.append(last_id)
+    elif page > 1:
+        # 兼容旧客户端的页码分页
+        offset = (page - 1) * limit
+    page_sql = 'WHERE ' + ' AND '.join(page_conditions)
     
-    # 修复查询 - 移除不存在的action列，添加consumer_type列
+    # 多取一条用于判断是否还有下一页
     query = f'''
     SELECT 
         id, customer_id, timestamp, consumer_type, product_name, 
-        amount, purchase, is_new_visit, region, city_type
+        amount, purchase, is_new_visit, region, city_type, day_of_simulation
     FROM consumer_actions
-    ORDER BY {sort_by} {sort_order}
+    {page_sql}
+    ORDER BY id {sort_order}
     LIMIT ? OFFSET ?
     '''
     
-    cursor.execute(query, [limit, offset])
-    behaviors = [dict(row) for row in cursor.fetchall()]
-    
-    # 获取总数
-    cursor.execute('SELECT COUNT(*) FROM consumer_actions')
-    total = cursor.fetchone()[0]
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, page_params + [limit + 1, offset])
+        behaviors = [dict(row) for row in cursor.fetchall()]
+        
+        # 总数只在第一页计算，后续页由客户端沿用
+        total = None if cursor_str else count_consumer_behavior(cursor, run_id, filters, filter_sql, params)
+    finally:
+        conn.close()
     
-    conn.close()
+    has_more = len(behaviors) > limit
+    behaviors = behaviors[:limit]
     
     return jsonify({
         'data': behaviors,
         'total': total,
         'page': page,
-        'limit': limit
+        'limit': limit,
+        'hasMore': has_more,
+        'nextCursor': encode_cursor(behaviors[-1]['id'], sort_order) if has_more else None,
+        'run_id': run_id
     })
 
 @app.route('/api/consumer/region', methods=['GET'])
+@response_cache.cached
 def get_consumer_region():
     """获取消费者区域分布数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 查询区域分布
+    # 从按地区汇总表查询区域分布
     query = '''
-    SELECT region, COUNT(DISTINCT customer_id) as user_count, 
-           SUM(CASE WHEN purchase = 1 THEN amount ELSE 0 END) as total_amount
-    FROM consumer_actions
-    WHERE region IS NOT NULL AND region != ''
-    GROUP BY region
+    SELECT region, users as user_count, gmv as total_amount
+    FROM rollup_region
+    WHERE run_id = ? AND region IS NOT NULL AND region != ''
     ORDER BY user_count DESC
     '''
     
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    run_id, conn = get_run_connection()
+    try:
+        rows = query_rollup(conn.cursor(), query, (run_id,))
+    finally:
+        conn.close()
     
     # 处理结果，提取省份信息
     region_data = []
     
     # 如果没有查询到数据，生成默认数据
     if not rows:
-        print("未查询到区域分布数据，生成默认数据")
+        logger.info("未查询到区域分布数据，生成默认数据")
         
         # 默认区域数据
         default_regions = [
@@ -437,8 +619,6 @@ def get_consumer_region():
                 'total_amount': row['total_amount'] or 0
             })
     
-    conn.close()
-    
     return jsonify(region_data)
 
 from collections import defaultdict
@@ -446,21 +626,12 @@ from collections import defaultdict
 from collections import defaultdict
 
 @app.route('/api/consumer/psychology', methods=['GET'])
+@response_cache.cached
 def get_consumer_psychology():
     """获取消费者心理特征分布数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    run_id, conn = get_run_connection()
     try:
-        # 尝试从数据库中读取psychological_trait数据
-        cursor.execute('''
-        SELECT psychological_trait FROM consumer_actions 
-        WHERE psychological_trait IS NOT NULL AND psychological_trait != '{}' AND psychological_trait != ''
-        LIMIT 1000
-        ''')
-        
-        traits_data = cursor.fetchall()
-        print(f"从数据库查询到 {len(traits_data)} 条心理特征数据")
+        cursor = conn.cursor()
         
         # 初始化心理特征统计
         psychology_stats = {
@@ -471,76 +642,33 @@ def get_consumer_psychology():
             '时尚意识': {'高': 0, '中': 0, '低': 0}
         }
         
-        # 如果有数据，解析并统计
+        # 入库时已将心理特征拆分并标准化为(维度, 等级)，直接对本次运行的数据分组统计
+        cursor.execute('''
+        SELECT dimension, trait_level, COUNT(*) as trait_count
+        FROM consumer_traits
+        WHERE run_id = ? AND dimension IS NOT NULL AND trait_level IS NOT NULL
+        GROUP BY dimension, trait_level
+        ''', (run_id,))
+        
         processed_count = 0
-        if traits_data:
-            for trait_row in traits_data:
-                try:
-                    trait_json = trait_row[0]
-                    print(f"处理trait数据: {trait_json[:100]}...")  # 只打印前100个字符避免日志过长
-                    
-                    if trait_json:
-                        trait_dict = json.loads(trait_json) if isinstance(trait_json, str) else trait_json
-                        
-                        # 处理不同格式的心理特征数据
-                        if isinstance(trait_dict, dict):
-                            for trait_key, trait_value in trait_dict.items():
-                                print(f"特征: {trait_key}={trait_value}")
-                                
-                                # 标准化特征键名
-                                normalized_key = trait_key
-                                if '敏感' in trait_key or '价格' in trait_key:
-                                    normalized_key = '价格敏感度'
-                                elif '忠诚' in trait_key or '品牌' in trait_key:
-                                    normalized_key = '品牌忠诚度'
-                                elif '冲动' in trait_key or '购物冲动' in trait_key:
-                                    normalized_key = '购物冲动性'
-                                elif '品质' in trait_key or '质量' in trait_key:
-                                    normalized_key = '品质追求'
-                                elif '时尚' in trait_key or '潮流' in trait_key:
-                                    normalized_key = '时尚意识'
-                                else:
-                                    print(f"无法匹配特征: {trait_key}")
-                                    continue
-                                
-                                # 标准化特征值
-                                normalized_value = trait_value
-                                if isinstance(trait_value, str):
-                                    if '高' in trait_value or '强' in trait_value:
-                                        normalized_value = '高'
-                                    elif '中' in trait_value:
-                                        normalized_value = '中'
-                                    elif '低' in trait_value or '弱' in trait_value:
-                                        normalized_value = '低'
-                                    else:
-                                        print(f"无法匹配特征值: {trait_value}")
-                                        continue
-                                else:
-                                    print(f"特征值不是字符串: {trait_value}")
-                                    continue
-                                
-                                # 增加计数
-                                if normalized_key in psychology_stats and normalized_value in psychology_stats[normalized_key]:
-                                    psychology_stats[normalized_key][normalized_value] += 1
-                                    processed_count += 1
-                                    print(f"增加统计: {normalized_key}-{normalized_value}")
-                except Exception as e:
-                    print(f"解析心理特征数据出错: {e}")
-                    continue
+        for row in cursor.fetchall():
+            if row['dimension'] in psychology_stats and row['trait_level'] in psychology_stats[row['dimension']]:
+                psychology_stats[row['dimension']][row['trait_level']] = row['trait_count']
+                processed_count += row['trait_count']
         
-        print(f"成功处理 {processed_count} 条有效特征数据")
+        logger.debug(f"成功处理 {processed_count} 条有效特征数据")
         
         # 检查是否有足够的数据
         has_data = False
         for trait_key, levels in psychology_stats.items():
             trait_sum = sum(levels.values())
-            print(f"特征 {trait_key} 统计: {levels}, 总计: {trait_sum}")
+            logger.debug(f"特征 {trait_key} 统计: {levels}, 总计: {trait_sum}")
             if trait_sum > 0:
                 has_data = True
                 
         # 如果数据不足，使用模拟数据
         if not has_data:
-            print("实际数据不足，使用模拟数据")
+            logger.info("实际数据不足，使用模拟数据")
             psychology_stats = {
                 '价格敏感度': {'高': 120, '中': 200, '低': 50},
                 '品牌忠诚度': {'高': 150, '中': 160, '低': 60},
@@ -549,7 +677,7 @@ def get_consumer_psychology():
                 '时尚意识': {'高': 110, '中': 190, '低': 70}
             }
     except Exception as e:
-        print(f"查询消费者心理特征数据出错: {e}")
+        logger.error(f"查询消费者心理特征数据出错: {e}")
         # 使用模拟数据作为备份
         psychology_stats = {
             '价格敏感度': {'高': 120, '中': 200, '低': 50},
@@ -585,20 +713,18 @@ def get_consumer_psychology():
         'series_data': series_data
     }
     
-    print(f"API输出: indicators长度: {len(indicators)}, series_data长度: {len(series_data)}")
-    print(f"indicators示例: {indicators[0] if indicators else '空'}")
-    print(f"series_data示例: {series_data[0] if series_data else '空'}")
+    logger.debug(f"API输出: indicators长度: {len(indicators)}, series_data长度: {len(series_data)}")
+    logger.debug(f"indicators示例: {indicators[0] if indicators else '空'}")
+    logger.debug(f"series_data示例: {series_data[0] if series_data else '空'}")
     
     # 确保返回的是正确格式的JSON
     return jsonify(result)
 
 # --- ADDED START ---
 @app.route('/api/visitor/analysis', methods=['GET'])
+@response_cache.cached
 def get_visitor_analysis():
     """获取访客分析数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # 获取时间范围参数
     time_range = request.args.get('timeRange', 'all')
     
@@ -609,40 +735,45 @@ def get_visitor_analysis():
         COUNT(DISTINCT CASE WHEN is_new_visit = 1 THEN customer_id END) as new_visitors,
         COUNT(DISTINCT CASE WHEN is_new_visit = 0 THEN customer_id END) as returning_visitors
     FROM consumer_actions
+    WHERE run_id = ?
     '''
     
-    cursor.execute(query)
-    visitor_stats = cursor.fetchone()
-    
     # 查询访问时长、跳出率等指标
     # 这里简化处理，使用模拟数据
     avg_browse_time = 0
     bounce_rate = 0
     
-    # 查询平均浏览时间
+    run_id, conn = get_run_connection()
     try:
-        cursor.execute('SELECT AVG(browse_time) FROM consumer_actions WHERE browse_time > 0')
-        avg_browse_time_result = cursor.fetchone()[0]
-        if avg_browse_time_result:
-            avg_browse_time = int(avg_browse_time_result)
-    except Exception as e:
-        print(f"查询平均浏览时间出错: {e}")
-    
-    # 计算跳出率（没有购买行为的访客比例）
-    try:
-        cursor.execute('''
-        SELECT 
-            COUNT(DISTINCT CASE WHEN purchase = 0 THEN customer_id END) * 100.0 / 
-            NULLIF(COUNT(DISTINCT customer_id), 0) as bounce_rate
-        FROM consumer_actions
-        ''')
-        bounce_rate_result = cursor.fetchone()[0]
-        if bounce_rate_result:
-            bounce_rate = float(bounce_rate_result)
-    except Exception as e:
-        print(f"计算跳出率出错: {e}")
-    
-    conn.close()
+        cursor = conn.cursor()
+        cursor.execute(query, (run_id,))
+        visitor_stats = cursor.fetchone()
+        
+        # 查询平均浏览时间
+        try:
+            cursor.execute('SELECT AVG(browse_time) FROM consumer_actions WHERE run_id = ? AND browse_time > 0', (run_id,))
+            avg_browse_time_result = cursor.fetchone()[0]
+            if avg_browse_time_result:
+                avg_browse_time = int(avg_browse_time_result)
+        except Exception as e:
+            logger.warning(f"查询平均浏览时间出错: {e}")
+        
+        # 计算跳出率（没有购买行为的访客比例）
+        try:
+            cursor.execute('''
+            SELECT 
+                COUNT(DISTINCT CASE WHEN purchase = 0 THEN customer_id END) * 100.0 / 
+                NULLIF(COUNT(DISTINCT customer_id), 0) as bounce_rate
+            FROM consumer_actions
+            WHERE run_id = ?
+            ''', (run_id,))
+            bounce_rate_result = cursor.fetchone()[0]
+            if bounce_rate_result:
+                bounce_rate = float(bounce_rate_result)
+        except Exception as e:
+            logger.warning(f"计算跳出率出错: {e}")
+    finally:
+        conn.close()
     
     # 如果数据库中没有数据，提供模拟数据
     total_visitors = visitor_stats['total_visitors'] if visitor_stats and visitor_stats['total_visitors'] else 500
@@ -687,6 +818,7 @@ def get_visitor_analysis():
     return jsonify(visitor_analysis)
 
 @app.route('/api/visitor/conversion', methods=['GET'])
+@response_cache.cached
 def get_visitor_conversion():
     """获取访客转化率数据 (占位符)"""
     # TODO: 实现数据库查询逻辑
@@ -700,25 +832,32 @@ def get_visitor_conversion():
 # --- ADDED END ---
 
 @app.route('/api/system/status', methods=['GET'])
+@response_cache.cached
 def get_system_status():
     """获取系统状态"""
     # TODO: 实现更详细的状态检查，例如数据库连接、模拟器状态等
     status = {
         'api_status': 'running',
         'database_connection': 'connected', # 假设连接正常
-        'last_simulation_time': None # TODO: 从数据库或日志获取
+        'last_simulation_time': None, # TODO: 从数据库或日志获取
+        'run_id': None
     }
     # 尝试获取最后模拟时间
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT MAX(timestamp) FROM consumer_actions")
-        last_time = cursor.fetchone()[0]
+        run_id, conn = get_run_connection()
+        status['run_id'] = run_id
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 'Day' || MAX(day_of_simulation) FROM consumer_actions WHERE run_id = ?", (run_id,))
+            last_time = cursor.fetchone()[0]
+        finally:
+            conn.close()
         if last_time:
             status['last_simulation_time'] = last_time
-        conn.close()
+    except UnknownRunError:
+        raise
     except Exception as e:
-        print(f"获取最后模拟时间失败: {e}")
+        logger.warning(f"获取最后模拟时间失败: {e}")
         status['database_connection'] = 'error'
         
     return jsonify(status)
@@ -727,19 +866,22 @@ def get_system_status():
 def refresh_system_data():
     """强制刷新数据缓存"""
     try:
-        # 这里可以添加清除缓存的逻辑，如果有的话
+        # 清除响应缓存，下次请求重新查询数据库
+        cache_stats = response_cache.get_stats()
+        response_cache.clear()
         
         # 返回成功消息和数据库状态
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM consumer_actions")
-        consumer_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM daily_stats")
-        stats_count = cursor.fetchone()[0]
-        
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT COUNT(*) FROM consumer_actions")
+            consumer_count = cursor.fetchone()[0]
+            
+            cursor.execute("SELECT COUNT(*) FROM daily_stats")
+            stats_count = cursor.fetchone()[0]
+        finally:
+            conn.close()
         
         return jsonify({
             'success': True,
@@ -748,6 +890,7 @@ def refresh_system_data():
                 'consumer_actions': consumer_count,
                 'daily_stats': stats_count
             },
+            'response_cache': cache_stats,
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -758,11 +901,9 @@ def refresh_system_data():
         }), 500
 
 @app.route('/api/consumer/behavior/trend', methods=['GET'])
+@response_cache.cached
 def get_consumer_behavior_trend():
     """获取消费者行为趋势数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # 获取时间范围参数
     time_range = request.args.get('timeRange', 'today')
     
@@ -782,36 +923,26 @@ def get_consumer_behavior_trend():
         start_date = end_date - timedelta(days=7)
         group_by = '%Y-%m-%d'
     
-    # 首先检查表结构，确定是否存在visit_store列
-    cursor.execute("PRAGMA table_info(consumer_actions)")
-    columns = [col[1] for col in cursor.fetchall()]
-    
-    # 准备查询，根据表结构调整
-    if 'visit_store' in columns:
-        visit_store_expr = "SUM(visit_store)"
-    else:
-        # 假设任何动作都是访问，此处可根据实际情况调整
-        visit_store_expr = "COUNT(*)"
-    
-    query = f'''
+    # 从按天汇总表读取行为趋势
+    query = '''
     SELECT 
-        timestamp as time_period,
-        COUNT(*) as total_actions,
-        {visit_store_expr} as store_visits,
-        COUNT(CASE WHEN purchase = 1 THEN 1 END) as purchases
-    FROM consumer_actions
-    GROUP BY timestamp
-    ORDER BY 
-        CASE 
-            WHEN timestamp LIKE 'Day%' THEN CAST(REPLACE(timestamp, 'Day', '') AS INTEGER)
-            ELSE timestamp 
-        END
+        'Day' || day_of_simulation as time_period,
+        total_actions,
+        store_visits,
+        purchases
+    FROM rollup_daily
+    WHERE run_id = ?
+    ORDER BY day_of_simulation
     '''
     
-    cursor.execute(query)
+    run_id, conn = get_run_connection()
+    try:
+        rows = query_rollup(conn.cursor(), query, (run_id,))
+    finally:
+        conn.close()
     
     trend_data = []
-    for row in cursor.fetchall():
+    for row in rows:
         # 计算转化率
         if row['store_visits'] > 0:
             visit_to_purchase = (row['purchases'] or 0) / row['store_visits'] * 100
@@ -826,12 +957,87 @@ def get_consumer_behavior_trend():
             'conversion_rate': round(visit_to_purchase, 2)
         })
     
-    conn.close()
-    
     return jsonify({
         'behavior_trend': trend_data
     })
 
+@app.route('/api/runs', methods=['GET'])
+@response_cache.cached
+def get_simulation_runs():
+    """获取模拟运行列表，按最近写入时间倒序，第一个即各接口默认查询的运行"""
+    return jsonify({'runs': list_runs(get_db_path())})
+
+# 不能在批量查询中调用的接口(批量查询自身和文件下载)
+BATCH_EXCLUDED_ENDPOINTS = ('batch_query', 'export_table_data')
+
+@app.route('/api/batch', methods=['POST'])
+def batch_query():
+    """批量查询：一次请求执行多个GET接口，所有子查询基于同一个数据快照
+    
+    请求体: {"run": 可选的运行ID, "queries": [{"name": "metrics", "path": "/api/dashboard/metrics", "params": {}}]}
+    返回: {"run_id", "version", "results": {名称: {"status", "data"}}}
+    """
+    try:
+        common_params, queries = parse_batch_request(request.get_json(silent=True))
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 所有子查询使用同一个运行(子查询可在params中单独指定run)
+    run_id, run_db_path = resolve_run(get_db_path(), common_params.get('run'))
+    common_params['run'] = run_id
+    
+    snapshot = SnapshotConnections(get_pool)
+    g.batch_snapshot = snapshot
+    try:
+        # 主数据库和运行数据库的快照在开始时一起固定
+        version = get_data_version()
+        snapshot.connect(run_db_path)
+        results = execute_batch(queries, common_params, BATCH_EXCLUDED_ENDPOINTS)
+    finally:
+        g.pop('batch_snapshot', None)
+        snapshot.close()
+    
+    return jsonify({
+        'run_id': run_id,
+        'version': version,
+        'results': results
+    })
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table_data(table):
+    """将模拟数据表导出为列式文件下载
+    
+    参数: run(运行ID，默认最近的运行), format(auto/parquet/npz，默认auto，优先Parquet)。
+    数据分块写入临时文件后以文件流返回，导出大表时内存占用保持稳定。
+    """
+    if table not in EXPORT_TABLES:
+        return jsonify({'error': f'不支持导出的表: {table}', 'tables': list(EXPORT_TABLES)}), 404
+    
+    run_id, db_path = resolve_run(get_db_path(), request.args.get('run'))
+    export_dir = tempfile.mkdtemp(prefix='export_')
+    try:
+        result = export_database(db_path, export_dir, tables=[table],
+                                 fmt=request.args.get('format', 'auto'), run_id=run_id)
+    except ValueError as e:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        logger.error(f"导出数据时出错: {e}")
+        return jsonify({'error': f'导出数据时出错: {str(e)}'}), 500
+    
+    info = result[table]
+    response = send_file(
+        info['path'],
+        mimetype='application/vnd.apache.parquet' if info['format'] == 'parquet' else 'application/octet-stream',
+        as_attachment=True,
+        download_name=os.path.basename(info['path'])
+    )
+    response.headers['X-Export-Rows'] = str(info['rows'])
+    # 响应发送完毕后删除临时文件
+    response.call_on_close(lambda: shutil.rmtree(export_dir, ignore_errors=True))
+    return response
+
 @app.route('/api/system/config', methods=['GET'])
 def get_system_config():
     """获取系统配置"""
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+data_api批量查询模块
+
+一次请求执行多个命名子查询：所有子查询复用同一个数据库连接上的同一个读事务，
+看到的是同一个数据快照(同一数据版本)，页面上的各个组件不会出现新旧数据混杂。
+子查询直接调用现有GET接口的视图函数，参数与单独请求时相同。
+"""
+
+import os
+import sqlite3
+
+from flask import current_app
+from werkzeug.exceptions import HTTPException
+
+# 单次批量请求最多包含的子查询数，可通过环境变量覆盖
+MAX_BATCH_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "20"))
+
+
+class BatchError(ValueError):
+    """批量请求格式错误"""
+
+
+class _SnapshotConnection:
+    """快照连接的代理，视图函数调用close()时不归还连接，由批量查询结束时统一归还"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        pass
+
+
+class SnapshotConnections:
+    """批量查询期间按数据库文件共享的只读快照连接"""
+
+    def __init__(self, pool_getter):
+        """初始化
+
+        Args:
+            pool_getter: 根据数据库路径返回连接池的函数
+        """
+        self.pool_getter = pool_getter
+        self._connections = {}
+
+    def connect(self, db_path):
+        """获取数据库文件的快照连接，首次使用时开启读事务并固定快照"""
+        key = os.path.abspath(db_path)
+        conn = self._connections.get(key)
+        if conn is None:
+            conn = self.pool_getter(db_path).connect()
+            conn.execute("BEGIN")
+            # BEGIN是延迟事务，第一次读取时才真正获得快照
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            self._connections[key] = conn
+        return _SnapshotConnection(conn)
+
+    def close(self):
+        """结束读事务并归还所有连接"""
+        for conn in self._connections.values():
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            conn.close()
+        self._connections.clear()
+
+
+def parse_batch_request(payload):
+    """校验批量请求
+
+    Args:
+        payload: 请求体，格式为
+            {"run": 可选的运行ID, "queries": [{"name": 名称, "path": 接口路径, "params": {参数}}]}
+
+    Returns:
+        tuple: (公共参数dict, 子查询列表)
+
+    Raises:
+        BatchError: 请求格式错误
+    """
+    if not isinstance(payload, dict):
+        raise BatchError("请求体必须是JSON对象")
+
+    queries = payload.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise BatchError("queries必须是非空列表")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise BatchError(f"子查询过多: {len(queries)}，最多 {MAX_BATCH_QUERIES} 个")
+
+    common_params = {}
+    if payload.get("run"):
+        common_params["run"] = str(payload["run"])
+
+    parsed = []
+    names = set()
+    for index, query in enumerate(queries):
+        if not isinstance(query, dict):
+            raise BatchError(f"第{index + 1}个子查询必须是JSON对象")
+        name = str(query.get("name") or "")
+        path = query.get("path")
+        params = query.get("params") or {}
+        if not name:
+            raise BatchError(f"第{index + 1}个子查询缺少name")
+        if name in names:
+            raise BatchError(f"子查询名称重复: {name}")
+        if not isinstance(path, str) or not path.startswith("/api/"):
+            raise BatchError(f"子查询 {name} 的path无效: {path}")
+        if not isinstance(params, dict):
+            raise BatchError(f"子查询 {name} 的params必须是JSON对象")
+        names.add(name)
+        parsed.append({
+            "name": name,
+            "path": path,
+            "params": {key: "" if value is None else str(value) for key, value in params.items()}
+        })
+    return common_params, parsed
+
+
+def execute_batch(queries, common_params, excluded_endpoints=()):
+    """在同一个快照上依次执行子查询
+
+    子查询不经过响应缓存和访问日志，直接调用视图函数。调用方需先将SnapshotConnections
+    设置到g.batch_snapshot，视图获取连接时使用其中的快照连接。
+    SQLite单个连接上的语句本就串行执行，因此子查询按顺序执行。
+
+    Args:
+        queries: parse_batch_request返回的子查询列表
+        common_params: 所有子查询共用的参数(如run)，子查询自身的参数优先
+        excluded_endpoints: 不允许在批量查询中调用的端点名
+
+    Returns:
+        dict: {名称: {"status": HTTP状态码, "data": 响应JSON}}
+    """
+    app = current_app._get_current_object()
+    adapter = app.url_map.bind("localhost")
+    results = {}
+
+    for query in queries:
+        name = query["name"]
+        try:
+            endpoint, view_args = adapter.match(query["path"], method="GET")
+        except HTTPException as e:
+            results[name] = {"status": e.code, "data": {"error": f"接口不存在或不支持GET: {query['path']}"}}
+            continue
+        if endpoint in excluded_endpoints:
+            results[name] = {"status": 400, "data": {"error": f"该接口不支持批量查询: {query['path']}"}}
+            continue
+
+        view = app.view_functions[endpoint]
+        # 跳过响应缓存，保证结果来自本次快照
+        view = getattr(view, "__wrapped__", view)
+        params = dict(common_params)
+        params.update(query["params"])
+
+        with app.test_request_context(query["path"], method="GET", query_string=params):
+            try:
+                response = app.make_response(view(**view_args))
+            except Exception as e:
+                # 交给应用注册的错误处理(如运行不存在返回404)，未处理的异常记为500
+                try:
+                    response = app.make_response(app.handle_user_exception(e))
+                except Exception as unhandled:
+                    response = app.make_response(({"error": f"子查询出错: {unhandled}"}, 500))
+            results[name] = {"status": response.status_code, "data": response.get_json(silent=True)}
+    return results
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+data_api响应缓存模块
+
+按 (接口路径, 查询参数, 数据版本) 缓存gzip压缩后的JSON响应体，并为响应附加ETag。
+数据版本由erniebot的DBManager在每次写入时递增，版本不变时仪表盘的重复请求
+直接返回缓存的压缩字节，带If-None-Match的条件请求返回304，不再查询SQLite。
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+# 默认参数，可通过环境变量覆盖
+DEFAULT_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+DEFAULT_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))  # 压缩后总大小上限
+DEFAULT_VERSION_CHECK_INTERVAL = float(os.environ.get("RESPONSE_CACHE_VERSION_CHECK_INTERVAL", "1.0"))  # 秒
+DEFAULT_COMPRESS_LEVEL = int(os.environ.get("RESPONSE_CACHE_COMPRESS_LEVEL", "6"))
+
+
+class ResponseCache:
+    """基于数据版本失效的JSON响应缓存，线程安全"""
+
+    def __init__(self, version_getter, max_bytes=DEFAULT_MAX_BYTES, enabled=DEFAULT_ENABLED,
+                 version_check_interval=DEFAULT_VERSION_CHECK_INTERVAL, compress_level=DEFAULT_COMPRESS_LEVEL):
+        """初始化响应缓存
+
+        Args:
+            version_getter: 返回当前数据版本号的函数，返回None表示无法获取(此时不缓存)
+            max_bytes: 缓存的压缩响应体总大小上限，超出时淘汰最久未使用的条目
+            enabled: 是否启用缓存
+            version_check_interval: 两次读取数据版本号之间的最小间隔(秒)
+            compress_level: gzip压缩级别
+        """
+        self.version_getter = version_getter
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.version_check_interval = version_check_interval
+        self.compress_level = compress_level
+
+        self._entries = OrderedDict()  # key -> (etag, gzip压缩的响应体, mimetype)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def current_version(self):
+        """获取当前数据版本号，在检查间隔内复用上次读取的结果；版本变化时清空旧条目"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked_at < self.version_check_interval:
+                return self._version
+
+        try:
+            version = self.version_getter()
+        except Exception as e:
+            print(f"读取数据版本号失败: {e}")
+            version = None
+
+        with self._lock:
+            if version != self._version:
+                # 旧版本的条目不会再被命中，直接释放
+                self._entries.clear()
+                self._bytes = 0
+            self._version = version
+            self._version_checked_at = now
+        return version
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def _put(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1])
+
+    def _build_entry(self, response, version):
+        body = response.get_data()
+        etag = f"{version}-{hashlib.md5(body).hexdigest()[:16]}"
+        return etag, gzip.compress(body, compresslevel=self.compress_level, mtime=0), response.mimetype
+
+    def _respond(self, entry):
+        """根据条件请求头和Accept-Encoding构造响应"""
+        etag, body_gz, mimetype = entry
+        if request.if_none_match.contains(etag):
+            with self._lock:
+                self.not_modified += 1
+            response = Response(status=304)
+        elif 'gzip' in request.accept_encodings:
+            response = Response(body_gz, status=200, mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(gzip.decompress(body_gz), status=200, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # 允许浏览器缓存，但每次使用前都需用ETag重新验证
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def cached(self, view):
+        """视图装饰器：缓存GET接口的200响应"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            version = self.current_version()
+            if version is None:
+                return view(*args, **kwargs)
+
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), version)
+            entry = self._get(key)
+            if entry is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                entry = self._build_entry(response, version)
+                self._put(key, entry)
+            return self._respond(entry)
+        return wrapper
+
+    def clear(self):
+        """清空缓存，下次请求时重新读取数据版本号"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = None
+            self._version_checked_at = 0.0
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'version': self._version,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
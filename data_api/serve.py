@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+正山堂茶业消费者行为分析系统 - API服务生产入口
+
+用waitress多线程服务器运行app.py中的全部接口，替代单线程的Flask开发服务器：
+- 工作线程数等参数读取config/server_settings.yaml的data_api部分，可用命令行参数覆盖
+- 数据库以只读方式打开，启动时为每个工作线程预先建立一个池化连接
+- 访问日志为每个请求一行JSON，输出到日志文件或控制台
+
+用法:
+    python serve.py [--host HOST] [--port PORT] [--workers N]
+"""
+
+import os
+import sys
+import argparse
+import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import yaml
+
+# 确保优先导入当前目录和common目录下的模块
+current_dir = Path(__file__).parent.absolute()
+project_root = current_dir.parent
+for module_dir in (current_dir, project_root / 'common'):
+    if str(module_dir) not in sys.path:
+        sys.path.insert(0, str(module_dir))
+
+from db_pool import get_pool, set_pool_defaults
+from run_registry import resolve_run
+
+SETTINGS_FILE = project_root / 'config' / 'server_settings.yaml'
+
+# server_settings.yaml中未配置时使用的默认值
+DEFAULT_SETTINGS = {
+    'host': os.environ.get("DATA_API_HOST", "127.0.0.1"),
+    'port': int(os.environ.get("DATA_API_PORT", "5000")),
+    'workers': 8,
+    'connection_limit': 100,
+    'channel_timeout': 120,
+    'db_pool_size': 0,
+    'access_log': True,
+    'access_log_file': "",
+    'log_level': "INFO",
+    'log_max_size': 10 * 1024 * 1024,
+    'log_backup_count': 5
+}
+
+logger = logging.getLogger('data_api')
+
+
+def load_settings(settings_file=SETTINGS_FILE):
+    """读取服务配置
+
+    Args:
+        settings_file: server_settings.yaml路径
+
+    Returns:
+        dict: data_api部分的配置，缺失的项使用默认值
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(settings_file, 'r', encoding='utf-8') as f:
+            settings.update((yaml.safe_load(f) or {}).get('data_api') or {})
+    except Exception as e:
+        print(f"读取服务配置失败，使用默认配置: {e}")
+    return settings
+
+
+def setup_logging(settings):
+    """配置运行日志和访问日志
+
+    运行日志输出到控制台；访问日志已是JSON，只输出消息本身，
+    配置了access_log_file时写入按大小轮转的日志文件。
+    """
+    level = getattr(logging, str(settings['log_level']).upper(), logging.INFO)
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    access_logger = logging.getLogger('data_api.access')
+    access_logger.propagate = False
+    if not settings['access_log']:
+        access_logger.setLevel(logging.WARNING)
+        return
+
+    access_logger.setLevel(logging.INFO)
+    if settings['access_log_file']:
+        log_file = Path(settings['access_log_file'])
+        if not log_file.is_absolute():
+            log_file = project_root / log_file
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        handler = RotatingFileHandler(
+            log_file,
+            maxBytes=int(settings['log_max_size']),
+            backupCount=int(settings['log_backup_count']),
+            encoding='utf-8'
+        )
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    access_logger.addHandler(handler)
+
+
+def prewarm_connections(db_path):
+    """为主数据库和最近一次运行的数据库预先建立只读连接"""
+    if not os.path.exists(db_path):
+        logger.warning(f"数据库文件不存在: {db_path}，将在首次请求时再连接")
+        return
+
+    db_paths = [db_path]
+    try:
+        _, run_path = resolve_run(db_path)
+        if run_path != db_path:
+            db_paths.append(run_path)
+    except Exception as e:
+        logger.warning(f"获取最近的模拟运行失败: {e}")
+
+    for path in db_paths:
+        try:
+            created = get_pool(path).prewarm()
+            logger.info(f"已预先建立 {created} 个只读连接: {path}")
+        except Exception as e:
+            logger.warning(f"预先建立数据库连接失败: {path}, 错误: {e}")
+
+
+def main():
+    """解析参数并启动生产服务"""
+    parser = argparse.ArgumentParser(description="数据API生产服务")
+    parser.add_argument("--host", help="监听地址，默认读取server_settings.yaml")
+    parser.add_argument("--port", type=int, help="监听端口")
+    parser.add_argument("--workers", type=int, help="工作线程数")
+    args = parser.parse_args()
+
+    settings = load_settings()
+    for key in ('host', 'port', 'workers'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    setup_logging(settings)
+
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.error("生产模式需要安装waitress: pip install waitress")
+        sys.exit(1)
+
+    workers = max(1, int(settings['workers']))
+    pool_size = int(settings['db_pool_size']) or workers
+
+    # 需在导入app之前设置，之后创建的所有连接池都是只读的
+    set_pool_defaults(read_only=True, pool_size=pool_size)
+
+    from app import app, get_db_path
+    prewarm_connections(get_db_path())
+
+    logger.info(f"数据API生产服务启动: http://{settings['host']}:{settings['port']} "
+                f"(工作线程: {workers}, 每个数据库只读连接: {pool_size})")
+    serve(
+        app,
+        host=settings['host'],
+        port=int(settings['port']),
+        threads=workers,
+        connection_limit=int(settings['connection_limit']),
+        channel_timeout=int(settings['channel_timeout']),
+        ident="tea-data-api"
+    )
+
+
+if __name__ == '__main__':
+    main()
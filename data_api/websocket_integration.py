@@ -6,15 +6,14 @@
 """
 
 import asyncio
-import json
 import logging
 import os
 import sys
 import sqlite3
 import time
+from contextlib import suppress
 from typing import Dict, List, Any, Optional, Callable
 from pathlib import Path
-from datetime import datetime, timedelta
 
 # 确保优先导入当前目录下的模块
 current_dir = Path(__file__).parent.absolute()
@@ -29,6 +28,9 @@ try:
         sys.path.insert(0, str(common_path))
     from tcp_server import TCPServer as WebSocketServer
     from config_loader import config # 使用 common 中的 config_loader
+    from db_pool import get_pool
+    from run_registry import resolve_run
+    import json_codec
     print(f"成功从 {common_path} 导入 tcp_server 和 config_loader")
 except ImportError as e:
     logging.basicConfig(
@@ -61,8 +63,12 @@ class DataApiWebSocket:
         if not os.path.isabs(self.db_path):
             self.db_path = str(Path(__file__).parent.parent / self.db_path)
 
-        # 创建WebSocket服务器
-        self.ws_server = WebSocketServer(self.host, self.port)
+        # 创建WebSocket服务器，推送的都是最新数据快照，队列满时同类型消息只保留最新一条
+        self.ws_server = WebSocketServer(
+            self.host, self.port,
+            send_queue_size=config.get('services', 'data_api', 'websocket', 'send_queue_size', default=64),
+            overflow_policy=config.get('services', 'data_api', 'websocket', 'overflow_policy', default='coalesce')
+        )
 
         # 存储连接的客户端信息
         self.clients = set() # Store client_id
@@ -72,20 +78,53 @@ class DataApiWebSocket:
         self.update_interval = config.get('services', 'dashboard', 'refresh_interval', default=30000) / 1000 # seconds
         self.update_task = None
 
+        # 推送缓存: data_type -> {"version": 数据版本, "data": 数据, "payload": 序列化后的消息字节}
+        self.payload_cache = {}
+        # 每个类型最近一次推送给全部订阅者的数据: data_type -> {"version": 数据版本, "data": 数据}
+        # 只在定期推送时更新，新订阅时的查询只写入payload_cache
+        self.pushed_state = {}
+        # 上一次定期推送时的数据版本，未变化时跳过查询
+        self.last_pushed_version = None
+
         # 初始化完成
         logger.info(f"数据API WebSocket初始化完成，服务器将运行在 ws://{self.host}:{self.port}")
         logger.info(f"数据库路径: {self.db_path}")
         logger.info(f"数据更新间隔: {self.update_interval} 秒")
 
     def get_db_connection(self):
-        """获取数据库连接"""
+        """从共享连接池获取最近一次模拟运行所在数据库的连接
+
+        Returns:
+            tuple: (运行ID, 数据库连接)，连接失败时为(None, None)
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
+            run_id, db_path = resolve_run(self.db_path)
+            return run_id, get_pool(db_path).connect()
         except Exception as e:
             logger.error(f"连接数据库失败: {self.db_path}, 错误: {e}")
+            return None, None
+
+    def get_data_version(self):
+        """获取当前(运行ID, 数据版本号)
+
+        数据版本号由erniebot的DBManager在每次写入时递增。
+
+        Returns:
+            tuple: (运行ID, 数据版本号)，旧数据库没有版本表或读取失败时返回None(不做变化检测)
+        """
+        try:
+            run_id, _ = resolve_run(self.db_path)
+            conn = get_pool(self.db_path).connect()
+        except Exception as e:
+            logger.error(f"读取数据版本失败: {e}")
             return None
+        try:
+            row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+            return (run_id, row[0]) if row else None
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            conn.close()
 
     def setup_handlers(self):
         """设置消息处理器"""
@@ -149,9 +188,14 @@ class DataApiWebSocket:
                 "data_types": list(self.client_subscriptions[client_id])
             })
 
-    async def fetch_data(self, data_type: str) -> Optional[Dict]:
-        """从数据库获取指定类型的数据"""
-        conn = self.get_db_connection()
+    async def fetch_data(self, data_type: str, db: Optional[tuple] = None) -> Optional[Dict]:
+        """从数据库获取指定类型的数据
+
+        Args:
+            data_type: 数据类型
+            db: 可选的(运行ID, 数据库连接)，由调用方负责关闭；未提供时自行获取连接
+        """
+        run_id, conn = db if db else self.get_db_connection()
         if not conn:
             return None
         cursor = conn.cursor()
@@ -168,7 +212,8 @@ class DataApiWebSocket:
                     SUM(returning_user_count) as returning_users,
                     AVG(avg_order_value) as avg_order
                 FROM daily_stats
-                ''')
+                WHERE run_id = ?
+                ''', (run_id,))
                 stats = cursor.fetchone()
                 if stats and stats['total_orders'] is not None:
                     data = dict(stats)
@@ -182,110 +227,182 @@ class DataApiWebSocket:
                         COUNT(DISTINCT CASE WHEN is_new_visit = 0 THEN customer_id END) as returning_users,
                         AVG(CASE WHEN purchase = 1 THEN amount ELSE NULL END) as avg_order
                     FROM consumer_actions
-                    ''')
+                    WHERE run_id = ?
+                    ''', (run_id,))
                     stats_ca = cursor.fetchone()
                     if stats_ca:
                         data = dict(stats_ca)
 
-            # --- 获取趋势数据 --- (简化示例，获取最近7天)
+            # --- 获取趋势数据 --- (本次运行最近7个模拟日)
             elif data_type == 'trend':
-                end_date = datetime.now().date()
-                start_date = end_date - timedelta(days=7)
                 cursor.execute('''
-                SELECT date, gmv, user_count
+                SELECT day_of_simulation, gmv, user_count
                 FROM daily_stats
-                WHERE date BETWEEN ? AND ?
-                ORDER BY date ASC
-                ''', [start_date.isoformat(), end_date.isoformat()])
-                rows = cursor.fetchall()
+                WHERE run_id = ?
+                ORDER BY day_of_simulation DESC
+                LIMIT 7
+                ''', (run_id,))
+                rows = list(reversed(cursor.fetchall()))
                 data = {'dates': [], 'gmv': [], 'users': []}
                 for row in rows:
-                    data['dates'].append(row['date'])
+                    data['dates'].append(f"Day{row['day_of_simulation']}")
                     data['gmv'].append(row['gmv'] or 0)
                     data['users'].append(row['user_count'] or 0)
 
             # --- 获取消费者行为数据 (示例：按类型统计购买次数) ---
             elif data_type == 'consumer_behavior':
                 cursor.execute('''
-                SELECT consumer_type, COUNT(*) as purchase_count
-                FROM consumer_actions
-                WHERE purchase = 1
-                GROUP BY consumer_type
+                SELECT consumer_type, purchases as purchase_count
+                FROM rollup_consumer_type
+                WHERE run_id = ? AND purchases > 0
                 ORDER BY purchase_count DESC
-                ''')
+                ''', (run_id,))
                 rows = cursor.fetchall()
                 data = {row['consumer_type']: row['purchase_count'] for row in rows}
 
             # --- 获取消费者地域数据 (示例：按区域统计用户数) ---
             elif data_type == 'consumer_region':
                  cursor.execute('''
-                 SELECT region, COUNT(DISTINCT customer_id) as user_count
-                 FROM consumer_actions
-                 WHERE region IS NOT NULL AND region != '未知'
-                 GROUP BY region
+                 SELECT region, users as user_count
+                 FROM rollup_region
+                 WHERE run_id = ? AND region IS NOT NULL AND region != '未知'
                  ORDER BY user_count DESC
-                 ''')
+                 ''', (run_id,))
                  rows = cursor.fetchall()
                  data = {row['region']: row['user_count'] for row in rows}
 
             # --- 获取消费者心理数据 (示例：统计主要特征) ---
             elif data_type == 'consumer_psychology':
+                # 取出现次数最多的前5个特征
                 cursor.execute('''
-                SELECT psychological_trait FROM consumer_actions WHERE psychological_trait IS NOT NULL
-                ''')
+                SELECT trait_key, COUNT(*) as trait_count
+                FROM consumer_traits
+                WHERE run_id = ?
+                GROUP BY trait_key
+                ORDER BY trait_count DESC
+                LIMIT 5
+                ''', (run_id,))
                 rows = cursor.fetchall()
-                traits_summary = {}
-                for row in rows:
-                    try:
-                        traits = json.loads(row['psychological_trait'])
-                        if isinstance(traits, dict):
-                            for key, value in traits.items():
-                                if key not in traits_summary:
-                                    traits_summary[key] = 0
-                                traits_summary[key] += 1
-                    except:
-                        pass # Ignore parsing errors
-                # 取前5个特征
-                sorted_traits = sorted(traits_summary.items(), key=lambda item: item[1], reverse=True)
-                data = dict(sorted_traits[:5])
+                data = {row['trait_key']: row['trait_count'] for row in rows}
 
         except Exception as e:
             logger.error(f"获取数据类型 '{data_type}' 时出错: {e}")
             data = None
         finally:
-            conn.close()
+            if not db:
+                conn.close()
 
         # 清理 None 值
         if isinstance(data, dict):
             return {k: (v if v is not None else 0) for k, v in data.items()}
         return data
 
-    async def send_updates(self, client_id: Optional[str] = None, data_types: Optional[List[str]] = None):
-        """发送数据更新给客户端"""
-        target_clients = [client_id] if client_id else list(self.clients)
-
+    def _collect_subscribers(self, target_clients: List[str], data_types: Optional[List[str]]) -> Dict[str, List[str]]:
+        """按数据类型汇总订阅的客户端: data_type -> [client_id]"""
+        subscribers = {}
         for cid in target_clients:
-            if cid not in self.client_subscriptions:
+            subscribed_types = self.client_subscriptions.get(cid)
+            if not subscribed_types:
                 continue
-
-            subscribed_types = self.client_subscriptions[cid]
             types_to_send = subscribed_types
             if data_types:
                 # 如果指定了类型，只发送订阅了的指定类型
                 types_to_send = subscribed_types.intersection(data_types)
-
             for data_type in types_to_send:
-                fetched_data = await self.fetch_data(data_type)
-                if fetched_data is not None:
-                    message = {
-                        "type": f"{data_type}_data", # e.g., metrics_data, trend_data
-                        "timestamp": time.time(),
-                        "data": fetched_data
-                    }
-                    await self.ws_server.send_to_client(cid, message)
-                    # logger.debug(f"已发送 {data_type} 数据给客户端 {cid}")
-                else:
-                    logger.warning(f"无法获取数据类型 '{data_type}' 的数据")
+                subscribers.setdefault(data_type, []).append(cid)
+        return subscribers
+
+    async def build_payloads(self, data_types: List[str], version, only_changed: bool = False) -> Dict[str, bytes]:
+        """获取各数据类型的推送消息，每个类型只查询和序列化一次
+
+        Args:
+            data_types: 数据类型列表
+            version: 当前数据版本，与缓存的版本相同时直接复用缓存的消息
+            only_changed: 定期推送：只返回数据与上次推送给全部订阅者时不同的类型，
+                并记录为已推送(调用方随后发给该类型的所有订阅者)
+
+        Returns:
+            dict: data_type -> 序列化后的消息字节；获取失败的类型不包含在内
+        """
+        current = {}
+        to_fetch = []
+        for data_type in data_types:
+            if only_changed and version is not None and self.pushed_state.get(data_type, {}).get("version") == version:
+                # 该版本已推送给全部订阅者
+                continue
+            cached = self.payload_cache.get(data_type)
+            if version is not None and cached and cached["version"] == version:
+                current[data_type] = cached
+            else:
+                to_fetch.append(data_type)
+
+        if to_fetch:
+            # 本次需要查询的类型共用一个连接
+            run_id, conn = self.get_db_connection()
+            if conn:
+                try:
+                    for data_type in to_fetch:
+                        fetched_data = await self.fetch_data(data_type, db=(run_id, conn))
+                        if fetched_data is None:
+                            logger.warning(f"无法获取数据类型 '{data_type}' 的数据")
+                            continue
+
+                        cached = self.payload_cache.get(data_type)
+                        if cached and cached["data"] == fetched_data:
+                            # 数据没有变化，复用已序列化的消息
+                            cached["version"] = version
+                        else:
+                            message = {
+                                "type": f"{data_type}_data", # e.g., metrics_data, trend_data
+                                "timestamp": time.time(),
+                                "data": fetched_data
+                            }
+                            cached = {"version": version, "data": fetched_data, "payload": json_codec.dumpb(message)}
+                            self.payload_cache[data_type] = cached
+                        current[data_type] = cached
+                finally:
+                    conn.close()
+
+        payloads = {}
+        for data_type, cached in current.items():
+            if only_changed:
+                pushed = self.pushed_state.get(data_type)
+                self.pushed_state[data_type] = {"version": version, "data": cached["data"]}
+                if pushed and pushed["data"] == cached["data"]:
+                    # 数据版本前进了但该类型的数据没有变化，不重复推送
+                    continue
+            payloads[data_type] = cached["payload"]
+        return payloads
+
+    async def send_updates(self, client_id: Optional[str] = None, data_types: Optional[List[str]] = None):
+        """发送数据更新给客户端
+
+        未指定client_id时为定期推送：数据版本与上次推送相同则不查询数据库；
+        否则每个订阅的数据类型只查询、序列化一次，同一份字节发给所有订阅者，
+        数据没有变化的类型不推送。指定client_id时(新订阅)总是发送当前数据。
+        """
+        target_clients = [client_id] if client_id else list(self.clients)
+        subscribers = self._collect_subscribers(target_clients, data_types)
+        if not subscribers:
+            return
+
+        version = self.get_data_version()
+        periodic = client_id is None
+        if periodic and version is not None and version == self.last_pushed_version:
+            logger.debug(f"数据版本 {version} 未变化，跳过本次推送")
+            return
+
+        payloads = await self.build_payloads(list(subscribers), version, only_changed=periodic)
+        for data_type, payload in payloads.items():
+            for cid in subscribers[data_type]:
+                await self.ws_server.send_to_client(cid, payload, msg_type=f"{data_type}_data")
+
+        if periodic and all(
+            self.pushed_state.get(data_type, {}).get("version") == version for data_type in subscribers
+        ):
+            # 所有订阅的类型都已是当前版本，下次版本不变时可以跳过
+            self.last_pushed_version = version
+        logger.debug(f"已推送 {len(payloads)} 种数据，订阅类型 {len(subscribers)} 种")
 
     async def periodic_update_loop(self):
         """定期获取并广播数据更新"""
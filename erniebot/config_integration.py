@@ -35,6 +35,7 @@ READ_TIMEOUT = int(os.environ.get("API_READ_TIMEOUT", "120"))  # 从90秒增加
 WRITE_TIMEOUT = int(os.environ.get("API_WRITE_TIMEOUT", "30"))
 MAX_RETRY_INTERVAL = int(os.environ.get("API_MAX_RETRY_INTERVAL", "120"))  # 从60秒增加到120秒
 RETRY_CODES = [408, 429, 500, 502, 503, 504]
+STREAM_RESPONSES = os.environ.get("API_STREAM_RESPONSES", "False").lower() == "true"  # 流式接收模拟结果，逐条推送消费者
 
 # 缓存配置
 CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "True").lower() == "true"
@@ -42,6 +43,15 @@ CACHE_TIME = int(os.environ.get("CACHE_TIME", "3600"))
 
 # 数据库配置
 DB_PATH = os.environ.get("DB_PATH", "simulation_data.db")
+DB_PER_RUN_FILES = os.environ.get("DB_PER_RUN_FILES", "False").lower() == "true"  # 每次模拟运行写入独立的数据库文件(runs/<run_id>.db)
+
+# 实时日志配置 - fsync策略: always(每条记录落盘) / interval(按间隔落盘) / never(仅关闭时落盘)
+REALTIME_LOG_FSYNC = os.environ.get("REALTIME_LOG_FSYNC", "interval")
+REALTIME_LOG_FSYNC_INTERVAL = float(os.environ.get("REALTIME_LOG_FSYNC_INTERVAL", "5.0"))
+
+# 并发模拟配置
+SIMULATION_MAX_JOBS = int(os.environ.get("SIMULATION_MAX_JOBS", "4"))  # 同时运行的模拟任务数
+LLM_MAX_INFLIGHT = int(os.environ.get("LLM_MAX_INFLIGHT", "4"))  # 所有任务共享的同时进行中的LLM请求数
 
 # 模拟参数
 BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "3"))
@@ -12,7 +12,7 @@ from datetime import datetime, timedelta
 import random
 import uuid
 
-from modules.db_manager import DBManager
+from modules.db_manager import DBManager, DEFAULT_RUN_ID
 
 # DBManager 将处理数据库初始化和连接
 db_manager = DBManager()
@@ -24,9 +24,11 @@ def clear_existing_data():
     
     try:
         cursor.execute("DELETE FROM consumer_actions")
+        cursor.execute("DELETE FROM consumer_traits")
         cursor.execute("DELETE FROM daily_stats")
         cursor.execute("DELETE FROM consumers")
         cursor.execute("DELETE FROM sqlite_sequence WHERE name='consumer_actions'")
+        db_manager.clear_rollups(cursor)
         conn.commit()
         print("已清除现有数据")
     except Exception as e:
@@ -232,7 +234,9 @@ def save_test_data(customers, consumer_actions):
         # 按日期统计并保存每日数据
         cursor.execute('''
         SELECT 
-            date(timestamp) as date,
+            run_id,
+            day_of_simulation,
+            MIN(date(timestamp)) as date,
             COUNT(CASE WHEN purchase = 1 THEN 1 END) as order_count,
             SUM(CASE WHEN purchase = 1 THEN amount ELSE 0 END) as gmv,
             COUNT(DISTINCT customer_id) as user_count,
@@ -242,7 +246,7 @@ def save_test_data(customers, consumer_actions):
             0 as cancelled_order_count,
             0 as return_count
         FROM consumer_actions
-        GROUP BY date(timestamp)
+        GROUP BY run_id, day_of_simulation
         ''')
         
         daily_stats = cursor.fetchall()
@@ -250,10 +254,12 @@ def save_test_data(customers, consumer_actions):
         for stats in daily_stats:
             cursor.execute('''
             INSERT OR REPLACE INTO daily_stats (
-                date, order_count, gmv, user_count, new_user_count, returning_user_count,
+                run_id, day_of_simulation, date, order_count, gmv, user_count, new_user_count, returning_user_count,
                 avg_order_value, cancelled_order_count, return_count
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
+                stats["run_id"],
+                stats["day_of_simulation"],
                 stats["date"],
                 stats["order_count"],
                 stats["gmv"],
@@ -267,6 +273,13 @@ def save_test_data(customers, consumer_actions):
         
         conn.commit()
         print(f"成功保存 {len(customers)} 位消费者、{len(consumer_actions)} 条行为数据和 {len(daily_stats)} 条每日统计数据")
+        
+        # 测试数据直接写入consumer_actions，需要重建心理特征表和汇总表
+        db_manager.rebuild_traits()
+        db_manager.rebuild_rollups()
+        # 测试数据属于默认运行，登记后仪表盘默认显示这批数据
+        db_manager.start_run("测试数据", run_id=DEFAULT_RUN_ID)
+        db_manager.finish_run(DEFAULT_RUN_ID)
     except Exception as e:
         print(f"保存数据时出错: {str(e)}")
         conn.rollback()
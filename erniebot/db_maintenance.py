@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据库维护脚本
+用于升级已有数据库，例如重建仪表盘使用的汇总表，以及导出列式数据供离线分析
+"""
+
+import os
+import sys
+import argparse
+
+# 添加上级目录到路径，以便导入模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.db_manager import DBManager
+from common.data_export import EXPORT_TABLES, DEFAULT_CHUNK_SIZE, export_database
+from common.run_registry import UnknownRunError, resolve_run
+
+def rebuild_rollups(db_manager, args):
+    """根据consumer_actions全量重建汇总表"""
+    print("=== 开始重建汇总表 ===")
+    return db_manager.rebuild_rollups()
+
+def rebuild_traits(db_manager, args):
+    """根据psychological_trait中的JSON数据重建心理特征表"""
+    print("=== 开始重建心理特征表 ===")
+    return db_manager.rebuild_traits()
+
+def backfill_days(db_manager, args):
+    """根据timestamp回填旧记录的day_of_simulation"""
+    print("=== 开始回填模拟天数 ===")
+    return db_manager.backfill_day_of_simulation()
+
+def export_data(db_manager, args):
+    """将模拟数据分块导出为Parquet或.npz列式文件"""
+    print(f"=== 开始导出模拟数据到 {args.output} ===")
+    try:
+        db_path, run_id = db_manager.db_path, None
+        if args.run:
+            run_id, db_path = resolve_run(db_manager.db_path, args.run)
+        result = export_database(db_path, args.output, tables=args.tables,
+                                 fmt=args.format, chunk_size=args.chunk_size, run_id=run_id)
+    except UnknownRunError:
+        print(f"导出失败: 运行 {args.run} 不存在")
+        return False
+    except (ValueError, RuntimeError) as e:
+        print(f"导出失败: {e}")
+        return False
+    for table, info in result.items():
+        print(f"{table}: {info['rows']} 行 -> {info['path']}")
+    return True
+
+def list_runs(db_manager, args):
+    """列出所有模拟运行"""
+    runs = db_manager.list_runs()
+    if not runs:
+        print("没有登记的模拟运行")
+    for run in runs:
+        location = run["db_file"] or "主数据库"
+        print(f"{run['run_id']}  {run['status']}  第{run['last_day'] or 0}天  {run['label'] or ''}  "
+              f"更新于 {run['updated_at']}  ({location})")
+    return True
+
+def drop_run(db_manager, args):
+    """删除指定模拟运行的全部数据"""
+    print(f"=== 删除模拟运行 {args.run_id} ===")
+    return db_manager.drop_run(args.run_id)
+
+def main():
+    """主函数，解析命令并执行对应的维护操作"""
+    parser = argparse.ArgumentParser(description="正山堂茶业模拟数据库维护工具")
+    parser.add_argument("--db", default=None, help="数据库文件路径(默认: erniebot/simulation_data.db)")
+    subparsers = parser.add_subparsers(dest="command", help="可用命令")
+
+    subparsers.add_parser("rebuild-rollups", help="根据consumer_actions重建仪表盘汇总表")
+    subparsers.add_parser("rebuild-traits", help="将psychological_trait拆分到consumer_traits表")
+    subparsers.add_parser("backfill-days", help="根据timestamp回填旧记录的day_of_simulation")
+    export_parser = subparsers.add_parser("export", help="导出模拟数据为Parquet(需pyarrow)或.npz(需numpy)")
+    export_parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"),
+                               help="输出目录(默认: erniebot/exports)")
+    export_parser.add_argument("--format", default="auto", choices=["auto", "parquet", "npz"],
+                               help="导出格式，auto优先使用Parquet")
+    export_parser.add_argument("--tables", nargs="+", default=list(EXPORT_TABLES), choices=EXPORT_TABLES,
+                               help="要导出的表")
+    export_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每次读取的行数")
+    export_parser.add_argument("--run", default=None, help="只导出指定运行的数据(默认导出全部)")
+    subparsers.add_parser("list-runs", help="列出所有模拟运行")
+    drop_parser = subparsers.add_parser("drop-run", help="删除指定模拟运行的全部数据")
+    drop_parser.add_argument("run_id", help="运行ID")
+
+    args = parser.parse_args()
+    commands = {
+        "rebuild-rollups": rebuild_rollups,
+        "rebuild-traits": rebuild_traits,
+        "backfill-days": backfill_days,
+        "export": export_data,
+        "list-runs": list_runs,
+        "drop-run": drop_run,
+    }
+    if args.command not in commands:
+        parser.print_help()
+        return 1
+
+    db_manager = DBManager(args.db)
+    print(f"数据库路径: {db_manager.db_path}")
+    return 0 if commands[args.command](db_manager, args) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
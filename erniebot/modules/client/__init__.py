@@ -1,7 +1,7 @@
 # client包 - 包含API客户端模块化组件
 
 from .api_client import ApiClient
-from .cache import LRUCache
+from .cache import LRUCache, PersistentCache, TieredCache
 from .message_processor import MessageProcessor
 from .api_connector import ApiConnector
 from .simulation_handler import SimulationHandler
@@ -10,6 +10,8 @@ from .utils import extract_json, get_cache_key
 __all__ = [
     'ApiClient',
     'LRUCache',
+    'PersistentCache',
+    'TieredCache',
     'MessageProcessor',
     'ApiConnector',
     'SimulationHandler',
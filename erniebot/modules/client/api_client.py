@@ -20,15 +20,15 @@ from openai import OpenAI
 #                      SIMPLIFIED_PROMPT)
 # Assuming the config values are in erniebot/config_integration.py
 from config_integration import (MODEL_API_KEY as API_KEY, BASE_URL, MODEL_NAME, SYSTEM_PROMPT, # Changed API_KEY to MODEL_API_KEY and aliased it
-                                         REQUEST_TIMEOUT, REQUEST_INTERVAL, MAX_RETRIES, RETRY_INTERVAL,
+                                         REQUEST_TIMEOUT, MAX_RETRIES, RETRY_INTERVAL,
                                          CONNECT_TIMEOUT, READ_TIMEOUT, WRITE_TIMEOUT, MAX_RETRY_INTERVAL,
                                          RETRY_CODES, CACHE_ENABLED, CACHE_TIME, BATCH_SIZE, BATCH_COUNT,
-                                         SIMPLIFIED_PROMPT)
+                                         SIMPLIFIED_PROMPT, STREAM_RESPONSES)
 # --- END MODIFIED ---
 import requests
 
 # 导入本地模块 (These relative imports should be fine)
-from .cache import LRUCache
+from .cache import TieredCache, get_persistent_cache
 from .message_processor import MessageProcessor
 from .api_connector import ApiConnector
 from .simulation_handler import SimulationHandler
@@ -37,10 +37,15 @@ from .utils import extract_json, get_cache_key
 class ApiClient:
     """API客户端类，负责与AI服务通信"""
     
-    def __init__(self):
-        """初始化API客户端"""
+    def __init__(self, connector=None):
+        """初始化API客户端
+        
+        Args:
+            connector: 共享的ApiConnector，为None时创建新的连接器。
+                       并发模拟时多个客户端共享同一个连接器，但各自保存对话历史。
+        """
         # 初始化连接器
-        self.connector = ApiConnector(API_KEY, BASE_URL, MODEL_NAME)
+        self.connector = connector if connector is not None else ApiConnector(API_KEY, BASE_URL, MODEL_NAME)
         
         # 初始化对话历史
         self.messages = [
@@ -68,11 +73,19 @@ class ApiClient:
             "avg_response_time": 0
         }
         
-        # 初始化缓存
-        self.cache = LRUCache(100)
+        # 初始化缓存：内存LRU在前，进程内共享的持久化缓存在后，重启后相同请求仍可命中
+        self.cache = TieredCache(100, get_persistent_cache() if CACHE_ENABLED else None)
     
-    def chat(self, message):
-        """发送消息到AI API并获取响应"""
+    def chat(self, message, on_interaction=None, on_abort=None):
+        """发送消息到AI API并获取响应
+        
+        Args:
+            message: 消息文本或消息字典
+            on_interaction: 可选回调 on_interaction(条目字典, 序号)。开启流式响应时，
+                            每解析出一条消费者交互就调用一次
+            on_abort: 可选回调 on_abort(已推送条目数)。流式中途失败、改用非流式结果时调用，
+                      之前推送的条目应作废
+        """
         if isinstance(message, str):
             message = {"role": "user", "content": message}
         self.messages.append(message)
@@ -81,9 +94,6 @@ class ApiClient:
         if len(self.messages) > 40:
             self.message_processor.trim_message_history(self.messages)
         
-        # 确保请求间隔
-        self._ensure_request_interval()
-        
         # 处理消息格式，文心一言不支持system角色
         processed_messages = self.message_processor.process_messages_for_erniebot(self.messages)
         
@@ -102,12 +112,22 @@ class ApiClient:
                 return cached_result
         
         # 调用API获取结果
-        result = self.connector.call_api(
-            processed_messages, 
-            self.cache if CACHE_ENABLED else None,
-            cache_key,
-            self._update_stats
-        )
+        if STREAM_RESPONSES and on_interaction is not None:
+            result = self.connector.call_api_stream(
+                processed_messages,
+                on_interaction,
+                self.cache if CACHE_ENABLED else None,
+                cache_key,
+                self._update_stats,
+                on_abort
+            )
+        else:
+            result = self.connector.call_api(
+                processed_messages, 
+                self.cache if CACHE_ENABLED else None,
+                cache_key,
+                self._update_stats
+            )
         
         # 更新消息历史
         if result and not result.startswith("调用AI服务时出错"):
@@ -120,11 +140,15 @@ class ApiClient:
             
         return result
             
-    def chat_with_messages(self, messages):
-        """使用提供的完整消息列表调用API，不修改内部历史"""
-        # 确保请求间隔
-        self._ensure_request_interval()
+    def chat_with_messages(self, messages, on_interaction=None, on_abort=None):
+        """使用提供的完整消息列表调用API，不修改内部历史
         
+        Args:
+            messages: 完整的消息列表
+            on_interaction: 可选回调 on_interaction(条目字典, 序号)。开启流式响应且未走分批处理时，
+                            每解析出一条消费者交互就调用一次
+            on_abort: 可选回调 on_abort(已推送条目数)，同chat
+        """
         # 处理消息格式，文心一言不支持system角色
         processed_messages = self.message_processor.process_messages_for_erniebot(messages)
         
@@ -159,6 +183,15 @@ class ApiClient:
                 self.cache if CACHE_ENABLED else None,
                 self._update_stats
             )
+        elif STREAM_RESPONSES and on_interaction is not None:
+            result = self.connector.call_api_stream(
+                processed_messages,
+                on_interaction,
+                self.cache if CACHE_ENABLED else None,
+                cache_key,
+                self._update_stats,
+                on_abort
+            )
         else:
             # 调用API获取结果
             result = self.connector.call_api(
@@ -186,32 +219,6 @@ class ApiClient:
             
         return result
 
-    def _ensure_request_interval(self):
-        """确保请求之间有足够的间隔时间"""
-        if self.last_request_time > 0:
-            elapsed = time.time() - self.last_request_time
-            
-            # 根据消息数量动态调整请求间隔
-            base_interval = REQUEST_INTERVAL
-            if len(self.messages) > 30:
-                # 消息量大时增加等待时间
-                messages_factor = min(len(self.messages) / 10, 3)  # 最多增加3倍
-                dynamic_interval = base_interval * (1 + messages_factor * 0.5)
-                required_interval = max(base_interval, dynamic_interval)
-            else:
-                required_interval = base_interval
-                
-            if elapsed < required_interval:
-                wait_time = required_interval - elapsed
-                print(f"等待 {wait_time:.2f} 秒以避免请求过于频繁...")
-                time.sleep(wait_time)
-                
-            # 如果已经收到过频率限制错误，增加额外等待时间
-            if self.request_stats.get("rate_limits", 0) > 0:
-                extra_wait = min(self.request_stats.get("rate_limits", 0) * 2, 30)
-                print(f"由于之前的频率限制，额外等待 {extra_wait} 秒...")
-                time.sleep(extra_wait)
-    
     def _update_stats(self, success, duration, error_type=None):
         """更新请求统计信息"""
         self.request_stats["total"] += 1
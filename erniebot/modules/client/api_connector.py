@@ -8,7 +8,8 @@ import hashlib
 import json
 import datetime
 import math
-import requests  # 添加到顶层导入
+import threading
+from contextlib import contextmanager
 from openai import OpenAI
 import logging
 import sys # Import sys for logging configuration
@@ -16,22 +17,38 @@ from ..config import (
     CACHE_TIME, MAX_RETRIES, RETRY_INTERVAL, 
     MAX_RETRY_INTERVAL, RETRY_CODES
 )
+from .rate_limiter import get_request_limiter, parse_retry_after, RateLimitError
+from .http_session import get_http_session
+from .stream_parser import StreamingJsonParser
 
 class ApiConnector:
     """API连接器类，处理与API的基本通信"""
     
-    def __init__(self, api_key, base_url, model_name):
+    def __init__(self, api_key, base_url, model_name, max_concurrent_requests=None, rate_limiter=None,
+                 session=None):
         """初始化API连接器
         
         Args:
             api_key: API密钥
             base_url: API基础URL
             model_name: 模型名称
+            max_concurrent_requests: 同时进行中的请求数上限，None表示不限制
+            rate_limiter: RPM/TPM限流器，默认使用进程内共享的限流器
+            session: requests会话，默认使用进程内共享的连接池会话
         """
         self.api_key = api_key
         self.base_url = base_url
         self.model_name = model_name
         
+        # 所有连接器共享同一个限流器，按服务端的RPM/TPM额度放行请求
+        self.rate_limiter = rate_limiter or get_request_limiter()
+        
+        # 共享连接池会话，复用keep-alive连接
+        self.session = session or get_http_session()
+        
+        # 多个模拟任务共享同一个连接器时，限制同时进行中的请求数
+        self.request_slots = threading.BoundedSemaphore(max_concurrent_requests) if max_concurrent_requests else None
+        
         # 配置自定义请求头
         self.headers = {
             "Content-Type": "application/json",
@@ -48,6 +65,18 @@ class ApiConnector:
             default_headers=self.headers
         )
     
+    @contextmanager
+    def _request_slot(self):
+        """占用一个请求名额，名额用完时阻塞等待"""
+        if self.request_slots is None:
+            yield
+            return
+        self.request_slots.acquire()
+        try:
+            yield
+        finally:
+            self.request_slots.release()
+    
     def _get_gmt_time(self):
         """生成GMT格式的时间字符串，用于请求头"""
         return datetime.datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
@@ -55,7 +84,7 @@ class ApiConnector:
     # Configure basic logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
     
-    def call_api(self, messages, cache=None, cache_key=None, stats_callback=None):
+    def call_api(self, messages, cache=None, cache_key=None, stats_callback=None, reserved=False):
         """调用API，处理错误和重试
         
         Args:
@@ -63,6 +92,7 @@ class ApiConnector:
             cache: 缓存对象，如果需要缓存
             cache_key: 缓存键
             stats_callback: 用于更新统计信息的回调函数
+            reserved: 调用方已为本次请求获取过限流额度(流式回退时)，首次尝试不再重复获取
             
         Returns:
             API响应结果
@@ -70,9 +100,14 @@ class ApiConnector:
         start_time = time.time()
         success = False
         error_type = None
+        estimated_tokens = self.rate_limiter.estimate_tokens(messages)
         
         for retry in range(MAX_RETRIES):
             try:
+                # 等待限流器放行(包括收到429后的冷却时间)
+                if retry > 0 or not reserved:
+                    self.rate_limiter.acquire(estimated_tokens)
+                
                 # 更新时间头，确保每次请求都有最新的时间
                 self.headers["Date"] = self._get_gmt_time()
                 
@@ -98,13 +133,14 @@ class ApiConnector:
                     
                     call_start_time = time.time()
                     # 修改超时设置：连接超时20秒，读取超时120秒
-                    response = requests.post(
-                        endpoint,
-                        json=request_data, 
-                        headers=headers,
-                        allow_redirects=True,
-                        timeout=(20, 300)  # 增加超时时间：(连接超时, 读取超时 300s)
-                    )
+                    with self._request_slot():
+                        response = self.session.post(
+                            endpoint,
+                            json=request_data, 
+                            headers=headers,
+                            allow_redirects=True,
+                            timeout=(20, 300)  # 增加超时时间：(连接超时, 读取超时 300s)
+                        )
                     call_duration = time.time() - call_start_time
                     logging.info(f"API call completed in {call_duration:.2f} seconds with status code: {response.status_code}")
                     
@@ -112,23 +148,35 @@ class ApiConnector:
                     if response.status_code != 200:
                         # Log detailed error before raising exception
                         logging.error(f"API Error: Status Code {response.status_code}, Response: {response.text}")
-                        raise Exception(f"API返回非200状态码: {response.status_code}, 响应: {response.text}")
+                        message = f"API返回非200状态码: {response.status_code}, 响应: {response.text}"
+                        if response.status_code == 429 or self._is_tpm_error(response.text):
+                            raise RateLimitError(
+                                message,
+                                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                                tpm=self._is_tpm_error(response.text)
+                            )
+                        raise Exception(message)
                     
                     # 解析JSON响应
                     response_data = response.json()
                     result = response_data['choices'][0]['message']['content']
+                    
+                    # 按实际用量修正TPM额度
+                    usage = response_data.get('usage') or {}
+                    self.rate_limiter.record_usage(estimated_tokens, usage.get('total_tokens'))
                 else:
                     # 使用OpenAI客户端 - 增加超时设置
                     logging.info(f"Attempting API call via OpenAI client (Retry {retry+1}/{MAX_RETRIES})")
                     logging.debug(f"Request Headers (OpenAI): {self.headers}")
                     call_start_time = time.time()
-                    response = self.client.chat.completions.create(
-                        model=self.model_name,
-                        messages=messages,
-                        top_p=0.01,
-                        extra_headers=self.headers,
-                        timeout=300  # 增加超时时间到300秒
-                    )
+                    with self._request_slot():
+                        response = self.client.chat.completions.create(
+                            model=self.model_name,
+                            messages=messages,
+                            top_p=0.01,
+                            extra_headers=self.headers,
+                            timeout=300  # 增加超时时间到300秒
+                        )
                     call_duration = time.time() - call_start_time
                     logging.info(f"OpenAI API call completed in {call_duration:.2f} seconds.")
                     result = response.choices[0].message.content
@@ -141,9 +189,17 @@ class ApiConnector:
                 return result
             except Exception as e:
                 error_str = str(e)
+                result = f"调用AI服务时出错: {error_str}"
                 # print(f"API调用错误 (重试 {retry+1}/{MAX_RETRIES}): {error_str}") # Replaced by logging
                 logging.warning(f"API call failed (Retry {retry+1}/{MAX_RETRIES}): {error_str}", exc_info=True) # Log exception info
                 
+                # 限流错误交给限流器处理：暂停放行并降低速率，下次acquire时自动等待
+                rate_limit = self._as_rate_limit_error(e)
+                if rate_limit is not None:
+                    error_type = "tpm_limit" if rate_limit.tpm else "rate_limit"
+                    self.rate_limiter.on_rate_limited(rate_limit.retry_after, tpm=rate_limit.tpm)
+                    continue
+                
                 # 如果是OpenAI客户端模式失败，尝试切换到requests直接请求模式
                 if not self.use_direct_requests and "302" in error_str or "redirect" in error_str.lower():
                     print("检测到重定向错误，切换到直接请求模式...")
@@ -172,14 +228,8 @@ class ApiConnector:
                 jitter = 0.1 * base_wait_time * (0.5 - 0.5 * math.cos(retry))
                 wait_time = min(base_wait_time + jitter, MAX_RETRY_INTERVAL)
                 
-                # 特殊处理TPM速率限制
-                if "tpm_rate_limit_exceeded" in error_str or "Rate limit reached for TPM" in error_str:
-                    error_type = "tpm_limit"
-                    wait_time = max(wait_time, 30 + retry * 30)
-                    # print(f"⚠️ TPM速率限制，需要等待 {wait_time:.2f} 秒后重试...") # Replaced by logging
-                    logging.warning(f"TPM rate limit exceeded. Waiting {wait_time:.2f} seconds before retry...")
                 # 对连接错误进行特殊处理
-                elif "Connection error" in error_str or "ConnectionError" in error_str:
+                if "Connection error" in error_str or "ConnectionError" in error_str:
                     error_type = "connection"
                     # print(f"网络连接错误，等待 {wait_time:.2f} 秒后重试...") # Replaced by logging
                     logging.warning(f"Connection error detected. Waiting {wait_time:.2f} seconds before retry...")
@@ -192,12 +242,10 @@ class ApiConnector:
                             base_url=self.base_url,
                             default_headers=self.headers
                         )
-                # 如果是访问频率错误或服务器错误
-                elif "429" in error_str or "too many requests" in error_str.lower() or any(str(code) in error_str for code in RETRY_CODES):
-                    error_type = "rate_limit"
-                    wait_time = max(wait_time, 15 + retry * 15)
-                    # print(f"⚠️ 请求频率限制，等待 {wait_time:.2f} 秒...") # Replaced by logging
-                    logging.warning(f"Rate limit or server error detected. Waiting {wait_time:.2f} seconds before retry...")
+                # 如果是服务器错误
+                elif any(str(code) in error_str for code in RETRY_CODES):
+                    error_type = "server_error"
+                    logging.warning(f"Server error detected. Waiting {wait_time:.2f} seconds before retry...")
                 elif "timeout" in error_str.lower():
                     error_type = "timeout"
                     # Increase wait time specifically for timeouts
@@ -208,13 +256,12 @@ class ApiConnector:
                     # print(f"其他API错误，等待 {wait_time:.2f} 秒后重试...") # Replaced by logging
                     logging.warning(f"Other API error occurred. Waiting {wait_time:.2f} seconds before retry...")
                 
-                # 执行等待
-                time.sleep(wait_time)
-                
                 # 最后一次重试
                 if retry == MAX_RETRIES - 1:
                     error_type = "other" if error_type is None else error_type
-                    result = f"调用AI服务时出错: {error_str}"
+                else:
+                    # 执行等待
+                    time.sleep(wait_time)
         
         # 更新统计信息
         logging.info(f"API call sequence finished. Success: {success}, Total time: {time.time() - start_time:.2f}s, Error Type: {error_type}")
@@ -223,6 +270,158 @@ class ApiConnector:
         
         return result
     
+    def call_api_stream(self, messages, on_interaction=None, cache=None, cache_key=None, stats_callback=None,
+                        on_abort=None):
+        """以流式(SSE)方式调用API，边接收边解析消费者交互条目
+        
+        每解析出一条完整的customer_interactions条目就调用一次on_interaction，
+        不必等待整个回复生成完毕。流式请求失败时回退到call_api，回退得到的是另一份回复，
+        因此已推送过条目时先调用on_abort作废它们，再按回退结果重新推送全部条目。
+        
+        Args:
+            messages: 处理后的消息列表
+            on_interaction: 回调函数 on_interaction(条目字典, 序号)
+            cache: 缓存对象，如果需要缓存
+            cache_key: 缓存键
+            stats_callback: 用于更新统计信息的回调函数
+            on_abort: 回调函数 on_abort(已推送条目数)，流式中途失败且已推送过条目时调用
+            
+        Returns:
+            完整的API响应结果
+        """
+        start_time = time.time()
+        estimated_tokens = self.rate_limiter.estimate_tokens(messages)
+        parser = StreamingJsonParser()
+        dispatched = 0
+        reserved = False
+        
+        try:
+            self.rate_limiter.acquire(estimated_tokens)
+            reserved = True
+            
+            headers = self.headers.copy()
+            headers["Date"] = self._get_gmt_time()
+            headers["Authorization"] = f"Bearer {self.api_key}"
+            headers["Accept"] = "text/event-stream"
+            request_data = {
+                "model": self.model_name,
+                "messages": messages,
+                "top_p": 0.01,
+                "stream": True,
+            }
+            endpoint = f"{self.base_url}/chat/completions"
+            logging.info(f"Attempting streaming API call to endpoint: {endpoint}")
+            
+            first_item_time = None
+            usage = {}
+            with self._request_slot():
+                response = self.session.post(
+                    endpoint,
+                    json=request_data,
+                    headers=headers,
+                    stream=True,
+                    timeout=(20, 120)  # 流式响应的读取超时为两段数据之间的间隔
+                )
+                try:
+                    if response.status_code != 200:
+                        message = f"API返回非200状态码: {response.status_code}, 响应: {response.text}"
+                        if response.status_code == 429 or self._is_tpm_error(response.text):
+                            raise RateLimitError(
+                                message,
+                                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                                tpm=self._is_tpm_error(response.text)
+                            )
+                        raise Exception(message)
+                    
+                    for line in response.iter_lines(decode_unicode=False):
+                        # SSE格式: "data: {...}"，以"data: [DONE]"结束
+                        if not line or not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        usage = chunk.get('usage') or usage
+                        choices = chunk.get('choices') or []
+                        if not choices:
+                            continue
+                        content = (choices[0].get('delta') or {}).get('content')
+                        if not content:
+                            continue
+                        
+                        for item in parser.feed(content):
+                            if first_item_time is None:
+                                first_item_time = time.time() - start_time
+                                logging.info(f"First streamed interaction received after {first_item_time:.2f} seconds")
+                            if on_interaction:
+                                try:
+                                    on_interaction(item, dispatched)
+                                except Exception as e:
+                                    logging.warning(f"流式条目回调出错: {e}")
+                            dispatched += 1
+                finally:
+                    response.close()
+            
+            result = parser.get_text()
+            if not result:
+                raise Exception("流式响应内容为空")
+            self.rate_limiter.record_usage(estimated_tokens, usage.get('total_tokens'))
+            logging.info(f"Streaming API call completed in {time.time() - start_time:.2f} seconds, "
+                         f"{dispatched} interactions dispatched")
+            
+            if cache and cache_key:
+                cache.put(cache_key, result, CACHE_TIME)
+            if stats_callback:
+                stats_callback(True, time.time() - start_time, None)
+            return result
+        
+        except Exception as e:
+            logging.warning(f"Streaming API call failed, falling back to non-streaming call: {e}")
+            rate_limit = self._as_rate_limit_error(e)
+            if rate_limit is not None:
+                # 被限流的请求没有真正执行，回退请求需要重新排队
+                self.rate_limiter.on_rate_limited(rate_limit.retry_after, tpm=rate_limit.tpm)
+                reserved = False
+            
+            if dispatched and on_abort:
+                # 已推送的条目来自被放弃的回复，通知前端作废
+                try:
+                    on_abort(dispatched)
+                except Exception as callback_error:
+                    logging.warning(f"流式作废回调出错: {callback_error}")
+            
+            result = self.call_api(messages, cache, cache_key, stats_callback, reserved=reserved)
+            if on_interaction and not result.startswith("调用AI服务时出错"):
+                # 用完整结果重新推送全部条目，保证前端与保存的当天数据一致
+                for index, item in enumerate(StreamingJsonParser().feed(result)):
+                    try:
+                        on_interaction(item, index)
+                    except Exception as callback_error:
+                        logging.warning(f"流式条目回调出错: {callback_error}")
+            return result
+    
+    @staticmethod
+    def _is_tpm_error(text):
+        """判断错误信息是否为TPM(每分钟token数)超限"""
+        return "tpm_rate_limit_exceeded" in text or "Rate limit reached for TPM" in text
+    
+    def _as_rate_limit_error(self, error):
+        """将各种形式的限流异常统一为RateLimitError，非限流错误返回None"""
+        if isinstance(error, RateLimitError):
+            return error
+        
+        # OpenAI客户端抛出的异常带有status_code和response
+        error_str = str(error)
+        status_code = getattr(error, "status_code", None)
+        if status_code == 429 or self._is_tpm_error(error_str) or "too many requests" in error_str.lower():
+            headers = getattr(getattr(error, "response", None), "headers", None) or {}
+            return RateLimitError(
+                error_str,
+                retry_after=parse_retry_after(headers.get("Retry-After")),
+                tpm=self._is_tpm_error(error_str)
+            )
+        return None
+    
     def generate_tea_product(self, target_consumers=None, cache=None, stats_callback=None):
         """生成一个符合正山堂品牌调性的红茶产品建议
         
@@ -280,26 +479,39 @@ class ApiConnector:
         messages = [{"role": "user", "content": prompt}]
         return self.call_api(messages, cache, cache_key, stats_callback)
     
-    def check_api_connection(self):
+    def check_api_connection(self, deep=False):
         """检查API连接状态
         
+        默认只发送一个轻量的OPTIONS探测请求，复用连接池会话，
+        同时预热keep-alive连接；deep=True时额外发送一个最小的对话请求验证密钥和模型。
+        
+        Args:
+            deep: 是否发送真实的对话请求进行完整检查
+        
         Returns:
             tuple: (bool, str) 连接是否成功，以及可能的错误信息
         """
         try:
             # 构建一个简单的API请求
             headers = self.headers.copy()
+            headers["Date"] = self._get_gmt_time()
             headers["Authorization"] = f"Bearer {self.api_key}"
-            
-            # 发送一个OPTIONS请求检查连接状态
             endpoint = f"{self.base_url}/chat/completions"
-            response = requests.options(
-                endpoint,
-                headers=headers,
-                timeout=(10, 10)  # 较短的超时时间，只是检查连接
-            )
             
-            # 也可以发送一个最小的POST请求
+            if not deep:
+                # 发送一个OPTIONS请求检查连接状态，能收到HTTP响应即说明网络和TLS正常
+                response = self.session.options(
+                    endpoint,
+                    headers=headers,
+                    timeout=(10, 10)  # 较短的超时时间，只是检查连接
+                )
+                if response.status_code in (401, 403):
+                    return False, f"API认证失败: HTTP {response.status_code}"
+                if response.status_code >= 500:
+                    return False, f"API服务异常: HTTP {response.status_code}"
+                return True, "API连接正常"
+            
+            # 发送一个最小的POST请求
             simple_message = [{"role": "user", "content": "Hello"}]
             test_request = {
                 "model": self.model_name,
@@ -307,7 +519,8 @@ class ApiConnector:
                 "max_tokens": 5  # 限制token数以加快响应
             }
             
-            response = requests.post(
+            self.rate_limiter.acquire(self.rate_limiter.estimate_tokens(simple_message))
+            response = self.session.post(
                 endpoint,
                 json=test_request,
                 headers=headers,
@@ -321,4 +534,4 @@ class ApiConnector:
                 return False, f"API连接状态异常: HTTP {response.status_code}, 响应: {response.text[:200]}"
                 
         except Exception as e:
-            return False, f"API连接检查出错: {str(e)}"
\ No newline at end of file
+            return False, f"API连接检查出错: {str(e)}"
@@ -1,71 +1,433 @@
-#coding=utf-8
-"""
-缓存模块 - 提供LRU缓存实现
-"""
-
-import time
-from collections import OrderedDict
-
-class LRUCache:
-    """LRU缓存实现，用于缓存API请求结果"""
-    
-    def __init__(self, capacity=100):
-        """初始化LRU缓存
-        
-        Args:
-            capacity (int): 缓存容量
-        """
-        self.cache = OrderedDict()
-        self.capacity = capacity
-        self.expiry = {}  # 存储缓存项的过期时间
-    
-    def get(self, key):
-        """获取缓存项
-        
-        Args:
-            key: 缓存键
-            
-        Returns:
-            缓存值，如果不存在或已过期则返回None
-        """
-        if key not in self.cache:
-            return None
-            
-        # 检查是否过期
-        if key in self.expiry and time.time() > self.expiry[key]:
-            self.cache.pop(key)
-            self.expiry.pop(key)
-            return None
-            
-        # 将访问的项移到末尾（最近使用）
-        self.cache.move_to_end(key)
-        return self.cache[key]
-    
-    def put(self, key, value, ttl=3600):
-        """添加缓存项
-        
-        Args:
-            key: 缓存键
-            value: 缓存值
-            ttl: 生存时间（秒）
-        """
-        # 如果键已存在，更新值并移到末尾
-        if key in self.cache:
-            self.cache[key] = value
-            self.cache.move_to_end(key)
-        else:
-            # 如果缓存已满，删除最早使用的项
-            if len(self.cache) >= self.capacity:
-                self.cache.popitem(last=False)
-                
-            # 添加新项
-            self.cache[key] = value
-        
-        # 设置过期时间
-        if ttl > 0:
-            self.expiry[key] = time.time() + ttl
-    
-    def clear(self):
-        """清空缓存"""
-        self.cache.clear()
-        self.expiry.clear() 
\ No newline at end of file
+#coding=utf-8
+"""
+缓存模块 - 提供LRU缓存实现
+
+LRUCache为进程内的内存缓存；PersistentCache将响应保存在SQLite文件中，
+重启后仍可命中；TieredCache组合两者，先查内存再查磁盘。
+"""
+
+import os
+import sys
+import time
+import zlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+try:
+    from common.db_pool import get_pool
+except ImportError:
+    # 直接导入本模块时，添加项目根目录到路径
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+    from common.db_pool import get_pool
+
+from ..config import (CACHE_PERSISTENT, CACHE_DB_PATH, CACHE_MAX_BYTES,
+                      CACHE_COMPRESS, CACHE_SWEEP_INTERVAL)
+
+# 小于该字节数的响应不压缩，压缩收益不足以抵消开销
+COMPRESS_MIN_BYTES = 256
+
+class LRUCache:
+    """LRU缓存实现，用于缓存API请求结果"""
+    
+    def __init__(self, capacity=100):
+        """初始化LRU缓存
+        
+        Args:
+            capacity (int): 缓存容量
+        """
+        self.cache = OrderedDict()
+        self.capacity = capacity
+        self.expiry = {}  # 存储缓存项的过期时间
+        self.lock = threading.Lock()  # 分批模拟时多个线程共享同一个缓存
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+    
+    def get(self, key):
+        """获取缓存项
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            缓存值，如果不存在或已过期则返回None
+        """
+        with self.lock:
+            if key not in self.cache:
+                self.stats["misses"] += 1
+                return None
+            
+            # 检查是否过期
+            if key in self.expiry and time.time() > self.expiry[key]:
+                self.cache.pop(key)
+                self.expiry.pop(key)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            
+            # 将访问的项移到末尾（最近使用）
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.cache[key]
+    
+    def put(self, key, value, ttl=3600):
+        """添加缓存项
+        
+        Args:
+            key: 缓存键
+            value: 缓存值
+            ttl: 生存时间（秒）
+        """
+        with self.lock:
+            # 如果键已存在，更新值并移到末尾
+            if key in self.cache:
+                self.cache[key] = value
+                self.cache.move_to_end(key)
+            else:
+                # 如果缓存已满，删除最早使用的项，同时删除其过期时间
+                if len(self.cache) >= self.capacity:
+                    evicted_key, _ = self.cache.popitem(last=False)
+                    self.expiry.pop(evicted_key, None)
+                    self.stats["evictions"] += 1
+                
+                # 添加新项
+                self.cache[key] = value
+            
+            # 设置过期时间，ttl<=0表示永不过期
+            if ttl > 0:
+                self.expiry[key] = time.time() + ttl
+            else:
+                self.expiry.pop(key, None)
+    
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.cache.clear()
+            self.expiry.clear()
+    
+    def get_stats(self):
+        """获取命中/未命中/淘汰统计"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.cache)
+        return stats
+
+
+class PersistentCache:
+    """基于SQLite的持久化LRU缓存
+
+    键为get_cache_key生成的哈希，值为模型返回的文本。
+    按总字节数限制大小，超出时淘汰最久未访问的条目，并定期清理过期条目。
+    读写出错时只记录日志并按未命中处理，不影响API调用。
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, max_bytes=CACHE_MAX_BYTES, compress=CACHE_COMPRESS,
+                 sweep_interval=CACHE_SWEEP_INTERVAL):
+        """初始化持久化缓存
+
+        Args:
+            db_path (str): 缓存数据库文件路径
+            max_bytes (int): 存储值的最大总字节数(压缩后)
+            compress (bool): 是否使用zlib压缩存储的值
+            sweep_interval (float): 清理过期条目的间隔(秒)
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.sweep_interval = sweep_interval
+        self.pool = get_pool(db_path, pool_size=2)
+
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "writes": 0}
+        self.last_sweep = 0.0
+
+        self._init_db()
+        self.sweep_expired()
+
+    def _init_db(self):
+        """创建缓存表并统计当前占用的字节数"""
+        conn = self.pool.connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                compressed INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_expires_at ON llm_cache (expires_at)')
+            conn.commit()
+            self.total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+        finally:
+            conn.close()
+
+    def _encode(self, value):
+        """将值编码为存储格式，返回(数据, 是否压缩)"""
+        data = value.encode('utf-8') if isinstance(value, str) else str(value).encode('utf-8')
+        if self.compress and len(data) >= COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(data, 6)
+            if len(compressed) < len(data):
+                return compressed, True
+        return data, False
+
+    @staticmethod
+    def _decode(data, compressed):
+        """将存储格式解码为文本"""
+        if compressed:
+            data = zlib.decompress(data)
+        return bytes(data).decode('utf-8')
+
+    def lookup(self, key):
+        """获取缓存项及其过期时间
+
+        Returns:
+            tuple: (缓存值, 过期时间)，不存在或已过期时为(None, None)
+        """
+        now = time.time()
+        conn = self.pool.connect()
+        try:
+            row = conn.execute(
+                'SELECT value, compressed, size, expires_at FROM llm_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                with self.lock:
+                    self.stats["misses"] += 1
+                return None, None
+
+            if row['expires_at'] is not None and row['expires_at'] < now:
+                cursor = conn.execute('DELETE FROM llm_cache WHERE key = ? AND expires_at < ?', (key, now))
+                conn.commit()
+                with self.lock:
+                    if cursor.rowcount:
+                        self.total_bytes -= row['size']
+                    self.stats["expired"] += 1
+                    self.stats["misses"] += 1
+                return None, None
+
+            # 更新访问时间，用于LRU淘汰
+            conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+            conn.commit()
+            with self.lock:
+                self.stats["hits"] += 1
+            return self._decode(row['value'], row['compressed']), row['expires_at']
+        except (sqlite3.Error, zlib.error, UnicodeDecodeError) as e:
+            logging.warning(f"读取持久化缓存出错: {e}")
+            with self.lock:
+                self.stats["misses"] += 1
+            return None, None
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """获取缓存项
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存值，如果不存在或已过期则返回None
+        """
+        return self.lookup(key)[0]
+
+    def put(self, key, value, ttl=3600):
+        """添加缓存项
+
+        Args:
+            key: 缓存键
+            value: 缓存值(文本)
+            ttl: 生存时间（秒），<=0表示永不过期
+        """
+        data, compressed = self._encode(value)
+        if len(data) > self.max_bytes:
+            return
+
+        now = time.time()
+        expires_at = now + ttl if ttl > 0 else None
+        conn = self.pool.connect()
+        try:
+            row = conn.execute('SELECT size FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            old_size = row['size'] if row else 0
+            conn.execute('''
+            INSERT INTO llm_cache (key, value, compressed, size, expires_at, last_access, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value,
+                compressed = excluded.compressed,
+                size = excluded.size,
+                expires_at = excluded.expires_at,
+                last_access = excluded.last_access
+            ''', (key, sqlite3.Binary(data), int(compressed), len(data), expires_at, now, now))
+            conn.commit()
+            with self.lock:
+                self.total_bytes += len(data) - old_size
+                self.stats["writes"] += 1
+                over_limit = self.total_bytes > self.max_bytes
+
+            if over_limit:
+                self._evict(conn)
+        except sqlite3.Error as e:
+            logging.warning(f"写入持久化缓存出错: {e}")
+        finally:
+            conn.close()
+
+        if now - self.last_sweep >= self.sweep_interval:
+            self.sweep_expired()
+
+    def _evict(self, conn):
+        """按最久未访问的顺序淘汰条目，直到总字节数降到上限的90%"""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        freed = 0
+        with self.lock:
+            excess = self.total_bytes - target
+
+        while freed < excess:
+            rows = conn.execute('SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 100').fetchall()
+            if not rows:
+                break
+            batch = []
+            for row in rows:
+                batch.append((row['key'],))
+                freed += row['size']
+                if freed >= excess:
+                    break
+            conn.executemany('DELETE FROM llm_cache WHERE key = ?', batch)
+            evicted += len(batch)
+        conn.commit()
+
+        with self.lock:
+            self.total_bytes -= freed
+            self.stats["evictions"] += evicted
+        logging.info(f"持久化缓存超出上限，淘汰 {evicted} 条，释放 {freed} 字节")
+
+    def sweep_expired(self):
+        """删除所有已过期的条目
+
+        Returns:
+            int: 删除的条目数
+        """
+        now = time.time()
+        self.last_sweep = now
+        conn = self.pool.connect()
+        try:
+            freed = conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM llm_cache WHERE expires_at < ?', (now,)
+            ).fetchone()[0]
+            cursor = conn.execute('DELETE FROM llm_cache WHERE expires_at < ?', (now,))
+            conn.commit()
+            with self.lock:
+                self.total_bytes -= freed
+                self.stats["expired"] += cursor.rowcount
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logging.warning(f"清理过期缓存出错: {e}")
+            return 0
+        finally:
+            conn.close()
+
+    def clear(self):
+        """清空缓存"""
+        conn = self.pool.connect()
+        try:
+            conn.execute('DELETE FROM llm_cache')
+            conn.commit()
+            with self.lock:
+                self.total_bytes = 0
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        """获取命中/未命中/淘汰统计及当前占用"""
+        conn = self.pool.connect()
+        try:
+            entries = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        finally:
+            conn.close()
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = entries
+            stats["bytes"] = self.total_bytes
+            stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class TieredCache:
+    """两级缓存：内存LRUCache在前，PersistentCache在后
+
+    接口与LRUCache相同，可直接传给ApiConnector等使用缓存的地方。
+    """
+
+    def __init__(self, capacity=100, persistent=None):
+        """初始化两级缓存
+
+        Args:
+            capacity (int): 内存缓存容量
+            persistent (PersistentCache): 持久化缓存，为None时只使用内存缓存
+        """
+        self.memory = LRUCache(capacity)
+        self.persistent = persistent
+
+    def get(self, key):
+        """先查内存，未命中时查持久化缓存并回填内存"""
+        value = self.memory.get(key)
+        if value is not None or self.persistent is None:
+            return value
+
+        value, expires_at = self.persistent.lookup(key)
+        if value is None:
+            return None
+        if expires_at is None:
+            # 持久化条目永不过期，内存中同样不设过期时间
+            self.memory.put(key, value, 0)
+            return value
+        # 回填时保留原来的剩余有效期；lookup之后恰好过期的按未命中处理，
+        # 否则ttl<=0会被LRUCache当作永不过期
+        ttl = expires_at - time.time()
+        if ttl <= 0:
+            return None
+        self.memory.put(key, value, ttl)
+        return value
+
+    def put(self, key, value, ttl=3600):
+        """同时写入内存和持久化缓存"""
+        self.memory.put(key, value, ttl)
+        if self.persistent is not None:
+            self.persistent.put(key, value, ttl)
+
+    def clear(self):
+        """只清空内存缓存，持久化缓存由所有客户端共享"""
+        self.memory.clear()
+
+    def get_stats(self):
+        """获取两级缓存的统计"""
+        return {
+            "memory": self.memory.get_stats(),
+            "persistent": self.persistent.get_stats() if self.persistent is not None else None,
+        }
+
+
+_persistent_cache = None
+_persistent_cache_lock = threading.Lock()
+
+
+def get_persistent_cache():
+    """获取进程内共享的持久化缓存，未启用或打开失败时返回None"""
+    global _persistent_cache
+    if not CACHE_PERSISTENT:
+        return None
+    with _persistent_cache_lock:
+        if _persistent_cache is None:
+            try:
+                _persistent_cache = PersistentCache()
+                logging.info(f"持久化缓存已打开: {CACHE_DB_PATH}, 当前占用 {_persistent_cache.total_bytes} 字节")
+            except sqlite3.Error as e:
+                logging.warning(f"无法打开持久化缓存 {CACHE_DB_PATH}，仅使用内存缓存: {e}")
+                return None
+        return _persistent_cache
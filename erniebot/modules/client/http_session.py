@@ -0,0 +1,69 @@
+#coding=utf-8
+"""
+HTTP会话模块 - 进程内共享的requests连接池
+
+复用TCP+TLS连接(keep-alive)，避免每次调用LLM接口都重新握手。
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..config import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_CONNECT_RETRIES
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_http_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                        connect_retries=HTTP_CONNECT_RETRIES):
+    """创建带连接池和重试适配器的会话
+
+    Args:
+        pool_connections (int): 缓存的主机连接池数量
+        pool_maxsize (int): 每个主机的最大连接数，占满时等待空闲连接
+        connect_retries (int): 建立连接失败时的重试次数(状态码重试由ApiConnector处理)
+
+    Returns:
+        requests.Session: 配置好的会话
+    """
+    retry = Retry(
+        total=connect_retries,
+        connect=connect_retries,
+        read=0,
+        status=0,
+        backoff_factor=0.5,
+        allowed_methods=None  # 只重试连接阶段的失败，请求尚未发出，POST也可安全重试
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+        pool_block=True  # 限制每个主机的并发连接数
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_http_session():
+    """获取进程内共享的会话，ApiClient、SimulationHandler和WebSocket任务处理共用"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_http_session()
+        return _session
+
+
+def close_http_session():
+    """关闭共享会话，释放连接池"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,296 @@
+#coding=utf-8
+"""
+限流模块 - 基于令牌桶的请求限流，多个线程共享同一个限流器
+
+RateLimiter同时按每分钟请求数(RPM)和每分钟token数(TPM)限流，
+收到429/TPM超限或Retry-After时暂停放行并降低速率，惩罚随时间衰减。
+"""
+
+import re
+import time
+import asyncio
+import logging
+import threading
+
+from ..config import (REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                      RATE_LIMIT_PENALTY_HALF_LIFE)
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        """初始化令牌桶
+
+        Args:
+            rate_per_minute (float): 每分钟补充的令牌数
+            capacity (float): 桶容量(允许的突发量)，默认等于每分钟令牌数
+        """
+        self.rate = rate_per_minute / 60.0  # 每秒补充的令牌数
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        """按经过的时间补充令牌(调用方需持有锁)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self, tokens=1):
+        """尝试立即获取令牌
+
+        Returns:
+            float: 0表示获取成功，否则为还需等待的秒数
+        """
+        with self.lock:
+            wait_time = self._wait_time(tokens)
+            if wait_time == 0:
+                self.tokens -= tokens
+            return wait_time
+
+    def _wait_time(self, tokens):
+        """补充令牌并计算获取所需等待的秒数(调用方需持有锁)"""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def adjust(self, tokens):
+        """归还(负数为扣除)令牌，用于按实际用量修正预估值"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def drain(self):
+        """清空令牌桶，收到限流响应时使用"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0)
+
+    def acquire(self, tokens=1, timeout=None):
+        """阻塞直到获取到令牌
+
+        Args:
+            tokens (float): 需要的令牌数，超过桶容量时按桶容量计算
+            timeout (float): 最长等待秒数，None表示一直等待
+
+        Returns:
+            bool: 是否获取成功
+        """
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            time.sleep(wait_time)
+
+
+class RateLimiter:
+    """按RPM和TPM双令牌桶限流的共享限流器，可根据限流响应自适应"""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 penalty_half_life=RATE_LIMIT_PENALTY_HALF_LIFE):
+        """初始化限流器
+
+        Args:
+            requests_per_minute (float): 每分钟请求数上限
+            tokens_per_minute (float): 每分钟token数上限，0或None表示不限制
+            penalty_half_life (float): 限流惩罚的半衰期(秒)
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.penalty_half_life = penalty_half_life
+
+        self.lock = threading.Lock()
+        self.penalty = 0.0          # 0~0.9，按比例降低放行速率
+        self.penalty_time = time.monotonic()
+        self.blocked_until = 0.0    # Retry-After冷却截止时间(monotonic)
+        self.stats = {"acquired": 0, "rate_limited": 0, "waited_seconds": 0.0}
+
+    @staticmethod
+    def estimate_tokens(messages):
+        """粗略估算消息的token数：中日韩字符约1个token，其他字符约4个字符1个token
+
+        Args:
+            messages (list|str): 处理后的消息列表或文本
+
+        Returns:
+            int: 估算的token数
+        """
+        if isinstance(messages, str):
+            text = messages
+        else:
+            text = "".join(str(msg.get("content", "")) for msg in messages if isinstance(msg, dict))
+        cjk_count = len(re.findall(r"[\u3000-\u9fff\uff00-\uffef]", text))
+        return cjk_count + (len(text) - cjk_count) // 4 + 4 * (1 if isinstance(messages, str) else len(messages))
+
+    def _current_penalty(self):
+        """按半衰期衰减后的惩罚系数(调用方需持有锁)"""
+        now = time.monotonic()
+        if self.penalty > 0 and self.penalty_half_life > 0:
+            self.penalty *= 0.5 ** ((now - self.penalty_time) / self.penalty_half_life)
+            if self.penalty < 0.01:
+                self.penalty = 0.0
+        self.penalty_time = now
+        return self.penalty
+
+    def reserve(self, tokens=0):
+        """尝试立即获取一次请求的额度
+
+        Args:
+            tokens (int): 本次请求预估的token数
+
+        Returns:
+            float: 0表示获取成功，否则为建议等待的秒数
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+
+            # 惩罚期间每次请求按 1/(1-penalty) 倍消耗令牌，相当于按比例降低速率
+            slowdown = 1.0 / (1.0 - self._current_penalty())
+            request_cost = min(slowdown, self.request_bucket.capacity)
+            token_cost = min(tokens * slowdown, self.token_bucket.capacity) if self.token_bucket and tokens else 0
+
+            with self.request_bucket.lock:
+                request_wait = self.request_bucket._wait_time(request_cost)
+            token_wait = 0
+            if token_cost:
+                with self.token_bucket.lock:
+                    token_wait = self.token_bucket._wait_time(token_cost)
+
+            wait_time = max(request_wait, token_wait)
+            if wait_time > 0:
+                return wait_time
+
+            # 两个桶都有余量时才同时扣除，避免只扣一半
+            self.request_bucket.adjust(-request_cost)
+            if token_cost:
+                self.token_bucket.adjust(-token_cost)
+            self.stats["acquired"] += 1
+            return 0
+
+    def acquire(self, tokens=0, timeout=None):
+        """阻塞直到获取到额度
+
+        Args:
+            tokens (int): 本次请求预估的token数
+            timeout (float): 最长等待秒数，None表示一直等待
+
+        Returns:
+            bool: 是否获取成功
+        """
+        start = time.monotonic()
+        while True:
+            wait_time = self.reserve(tokens)
+            if wait_time == 0:
+                self._record_wait(time.monotonic() - start)
+                return True
+            if timeout is not None:
+                remaining = start + timeout - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            time.sleep(wait_time)
+
+    async def acquire_async(self, tokens=0, timeout=None):
+        """acquire的异步版本，等待时不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while True:
+            wait_time = self.reserve(tokens)
+            if wait_time == 0:
+                self._record_wait(loop.time() - start)
+                return True
+            if timeout is not None:
+                remaining = start + timeout - loop.time()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            await asyncio.sleep(wait_time)
+
+    def _record_wait(self, waited):
+        """记录排队等待时间"""
+        if waited > 0.01:
+            with self.lock:
+                self.stats["waited_seconds"] += waited
+            logging.info(f"限流等待 {waited:.2f} 秒")
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """按响应中的实际token用量修正TPM桶"""
+        if self.token_bucket and actual_tokens:
+            self.token_bucket.adjust(estimated_tokens - actual_tokens)
+
+    def on_rate_limited(self, retry_after=None, tpm=False):
+        """收到限流响应后暂停放行并增加惩罚
+
+        Args:
+            retry_after (float): 服务端返回的Retry-After秒数
+            tpm (bool): 是否为TPM超限
+        """
+        with self.lock:
+            penalty = self._current_penalty()
+            self.penalty = min(0.9, penalty + 0.25)
+            self.stats["rate_limited"] += 1
+
+            if retry_after is None:
+                # 没有Retry-After时按当前惩罚估算冷却时间
+                retry_after = 60.0 / max(self.requests_per_minute, 1) * (1 + 4 * self.penalty)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+        if tpm and self.token_bucket:
+            self.token_bucket.drain()
+        else:
+            self.request_bucket.drain()
+        logging.warning(f"触发限流，暂停 {retry_after:.1f} 秒，当前惩罚系数 {self.penalty:.2f}")
+
+    def get_stats(self):
+        """获取限流统计"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["penalty"] = round(self._current_penalty(), 3)
+            stats["blocked_seconds"] = round(max(0.0, self.blocked_until - time.monotonic()), 2)
+        return stats
+
+
+class RateLimitError(Exception):
+    """服务端限流错误(HTTP 429或TPM超限)"""
+
+    def __init__(self, message, retry_after=None, tpm=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.tpm = tpm
+
+
+def parse_retry_after(value):
+    """解析Retry-After响应头(秒数格式)，无法解析时返回None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+_request_limiter = None
+_request_limiter_lock = threading.Lock()
+
+
+def get_request_limiter():
+    """获取进程内共享的LLM请求限流器"""
+    global _request_limiter
+    with _request_limiter_lock:
+        if _request_limiter is None:
+            _request_limiter = RateLimiter()
+        return _request_limiter
@@ -4,11 +4,10 @@
 """
 
 import re
-import time
 import json
-import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ..config import (BATCH_SIZE, BATCH_COUNT, SIMPLIFIED_PROMPT, 
-                     REQUEST_INTERVAL, RETRY_INTERVAL)
+                     BATCH_CONCURRENCY)
 from .utils import extract_json
 
 class SimulationHandler:
@@ -57,44 +56,72 @@ class SimulationHandler:
             modified_prompt = system_content.replace("每一天至少要展现7-10位不同消费者的行为", f"每次请只模拟{BATCH_SIZE}位不同消费者的行为")
         
         # 分批处理的结果
-        all_batches = []
         batch_count = BATCH_COUNT  # 使用配置中的批次数量
+        batch_results = {}
+        failed_batches = []
         
-        for batch in range(batch_count):
-            print(f"处理第 {batch+1}/{batch_count} 批消费者...")
-            
-            # 更新提示词，指定当前批次
-            batch_prompt = f"{modified_prompt}\n\n注意：这是分批模拟的第{batch+1}批，请模拟{BATCH_SIZE}位不同类型的消费者，确保批次间消费者类型有多样性。"
-            
-            # 构建适用于文心一言API的消息格式
-            batch_messages = [
-                {"role": "user", "content": batch_prompt + "\n\n" + user_msg.get("content", "")}
-            ]
-            
-            # 随机延迟0-2秒，错开请求
-            time.sleep(random.uniform(0, 2))
-            
-            # 调用API
-            batch_result = self.api_connector.call_api(batch_messages, None, None, stats_callback)
-            
-            # 提取JSON
-            batch_json = extract_json(batch_result)
-            if batch_json:
-                all_batches.append(batch_json)
-                print(f"批次 {batch+1} 成功获取JSON数据")
-            else:
-                print(f"批次 {batch+1} 未能提取有效JSON")
-            
-            # 成功后休息一下，避免频率限制
-            time.sleep(REQUEST_INTERVAL)
+        # 各批次提示词互相独立，并发发送，由连接器的共享限流器控制整体请求速率
+        max_workers = max(1, min(BATCH_CONCURRENCY, batch_count))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="simulation-batch") as executor:
+            futures = {
+                executor.submit(self._process_batch, batch, batch_count, modified_prompt, user_msg, stats_callback): batch
+                for batch in range(batch_count)
+            }
+            
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    batch_json = future.result()
+                except Exception as e:
+                    print(f"批次 {batch+1} 处理出错: {e}")
+                    batch_json = None
+                
+                if batch_json:
+                    batch_results[batch] = batch_json
+                    print(f"批次 {batch+1} 成功获取JSON数据 ({len(batch_results)}/{batch_count})")
+                else:
+                    failed_batches.append(batch + 1)
+                    print(f"批次 {batch+1} 未能提取有效JSON")
         
-        # 合并所有批次结果
-        if all_batches:
+        # 合并所有成功批次的结果，按批次顺序保证结果稳定
+        if batch_results:
+            if failed_batches:
+                print(f"部分批次失败 {sorted(failed_batches)}，使用 {len(batch_results)}/{batch_count} 个批次的结果")
+            all_batches = [batch_results[batch] for batch in sorted(batch_results)]
             combined_result = self._combine_simulation_batches(all_batches)
             return combined_result
         else:
             return "所有批次处理均失败，请重试或减少模拟复杂度。"
     
+    def _process_batch(self, batch, batch_count, modified_prompt, user_msg, stats_callback=None):
+        """处理单个批次
+        
+        Args:
+            batch: 批次序号(从0开始)
+            batch_count: 批次总数
+            modified_prompt: 修改后的模拟提示词
+            user_msg: 用户消息
+            stats_callback: 用于更新统计信息的回调函数
+            
+        Returns:
+            提取出的JSON文本，失败时为None
+        """
+        print(f"处理第 {batch+1}/{batch_count} 批消费者...")
+        
+        # 更新提示词，指定当前批次
+        batch_prompt = f"{modified_prompt}\n\n注意：这是分批模拟的第{batch+1}批，请模拟{BATCH_SIZE}位不同类型的消费者，确保批次间消费者类型有多样性。"
+        
+        # 构建适用于文心一言API的消息格式
+        batch_messages = [
+            {"role": "user", "content": batch_prompt + "\n\n" + user_msg.get("content", "")}
+        ]
+        
+        # 调用API，由连接器共享的RPM/TPM限流器控制请求速率
+        batch_result = self.api_connector.call_api(batch_messages, None, None, stats_callback)
+        
+        # 提取JSON
+        return extract_json(batch_result)
+    
     def _combine_simulation_batches(self, json_batches):
         """合并多个批次的模拟结果
         
@@ -0,0 +1,128 @@
+#coding=utf-8
+"""
+流式解析模块 - 在流式响应到达过程中增量识别JSON代码块和消费者交互条目
+"""
+
+import re
+import ast
+import json
+
+# customer_interactions 数组的开始位置：键名后跟冒号和左方括号
+_INTERACTIONS_KEY_REGEX = re.compile(r"[\"']customer_interactions[\"']\s*:\s*$")
+
+
+class StreamingJsonParser:
+    """增量解析器
+
+    每次feed一段文本，返回本次新完成的customer_interactions条目。
+    只扫描新到达的字符，整体开销与响应长度成正比。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0               # 下一个待扫描字符的位置
+        self.block_start = None    # JSON内容开始位置(代码块标记行之后或第一个{)
+        self.block_end = None      # 代码块结束位置
+        self.in_string = False
+        self.quote_char = None
+        self.escape = False
+        self.depth = 0
+        self.array_depth = None    # customer_interactions数组所在的深度
+        self.item_start = None     # 当前条目的开始位置
+        self.interactions = []
+
+    def feed(self, text):
+        """追加一段文本并解析
+
+        Args:
+            text (str): 新到达的文本片段
+
+        Returns:
+            list: 本次新解析出的消费者交互条目(dict)
+        """
+        if not text:
+            return []
+        self.buffer += text
+        new_items = []
+
+        if self.block_start is None and not self._find_block_start():
+            return new_items
+
+        buffer = self.buffer
+        length = len(buffer)
+        while self.pos < length and self.block_end is None:
+            char = buffer[self.pos]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == self.quote_char:
+                    self.in_string = False
+            elif char in "\"'":
+                self.in_string = True
+                self.quote_char = char
+            elif char in "{[":
+                if char == "[" and self.array_depth is None and \
+                        _INTERACTIONS_KEY_REGEX.search(buffer[max(self.block_start, self.pos - 64):self.pos]):
+                    self.array_depth = self.depth + 1
+                elif char == "{" and self.array_depth is not None and self.depth == self.array_depth:
+                    self.item_start = self.pos
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if char == "}" and self.item_start is not None and self.depth == self.array_depth:
+                    item = self._parse_item(buffer[self.item_start:self.pos + 1])
+                    self.item_start = None
+                    if item is not None:
+                        self.interactions.append(item)
+                        new_items.append(item)
+                elif char == "]" and self.array_depth is not None and self.depth == self.array_depth - 1:
+                    # 数组结束，之后不再有条目
+                    self.array_depth = -1
+            elif char == "`" and self.depth == 0:
+                if length - self.pos < 3:
+                    # 结束标记可能尚未完整到达，等待更多文本
+                    break
+                if buffer.startswith("```", self.pos):
+                    self.block_end = self.pos
+                    break
+
+            self.pos += 1
+
+        return new_items
+
+    def _find_block_start(self):
+        """查找```json代码块(或任意```代码块)的内容开始位置，没有代码块时使用第一个左大括号"""
+        fence = self.buffer.find("```")
+        if fence != -1:
+            newline = self.buffer.find("\n", fence)
+            if newline == -1:
+                # 代码块标记行尚未完整到达
+                return False
+            self.block_start = newline + 1
+        else:
+            brace = self.buffer.find("{")
+            if brace == -1:
+                return False
+            self.block_start = brace
+        self.pos = self.block_start
+        return True
+
+    @staticmethod
+    def _parse_item(text):
+        """解析单个条目，兼容单引号写法"""
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+        try:
+            item = ast.literal_eval(text.replace("true", "True").replace("false", "False").replace("null", "None"))
+            return item if isinstance(item, dict) else None
+        except (ValueError, SyntaxError):
+            return None
+
+    def get_text(self):
+        """获取目前收到的完整文本"""
+        return self.buffer
@@ -136,6 +136,19 @@ MAX_RETRY_INTERVAL = constants_config.get('api', {}).get('max_retry_interval', 6
 RETRY_CODES = constants_config.get('api', {}).get('retry_codes', [408, 429, 500, 502, 503, 504])  # 重试状态码
 CACHE_ENABLED = constants_config.get('api', {}).get('cache_enabled', True)  # 是否启用缓存
 CACHE_TIME = constants_config.get('api', {}).get('cache_time', 3600)  # 缓存有效期
+REQUESTS_PER_MINUTE = constants_config.get('api', {}).get('requests_per_minute', 20)  # 所有请求共享的每分钟请求数上限
+TOKENS_PER_MINUTE = constants_config.get('api', {}).get('tokens_per_minute', 40000)  # 每分钟token数上限(TPM)
+RATE_LIMIT_PENALTY_HALF_LIFE = constants_config.get('api', {}).get('rate_limit_penalty_half_life', 60)  # 限流惩罚半衰期，单位秒
+HTTP_POOL_CONNECTIONS = constants_config.get('api', {}).get('http_pool_connections', 4)  # 缓存的主机连接池数量
+HTTP_POOL_MAXSIZE = constants_config.get('api', {}).get('http_pool_maxsize', 10)  # 每个主机的最大连接数
+HTTP_CONNECT_RETRIES = constants_config.get('api', {}).get('http_connect_retries', 3)  # 建立连接失败时的重试次数
+CACHE_PERSISTENT = constants_config.get('api', {}).get('cache_persistent', True)  # 是否启用持久化缓存(重启后仍可命中)
+CACHE_DB_PATH = constants_config.get('api', {}).get('cache_db_path', 'llm_cache.db')  # 持久化缓存文件，相对路径相对于erniebot目录
+if not os.path.isabs(CACHE_DB_PATH):
+    CACHE_DB_PATH = str(Path(__file__).parent.parent / CACHE_DB_PATH)
+CACHE_MAX_BYTES = constants_config.get('api', {}).get('cache_max_bytes', 64 * 1024 * 1024)  # 持久化缓存的最大字节数
+CACHE_COMPRESS = constants_config.get('api', {}).get('cache_compress', True)  # 是否压缩存储的响应
+CACHE_SWEEP_INTERVAL = constants_config.get('api', {}).get('cache_sweep_interval', 300)  # 清理过期缓存的间隔，单位秒
 
 # 系统提示词
 SYSTEM_PROMPT = """你是一个专为正山堂茶业打造的消费者行为模拟系统，需要模拟不同类型的茶叶消费者对正山堂推出的红茶新品的消费行为，包括是否进店、是否购买、消费金额等。\
@@ -309,4 +322,5 @@ CONSUMER_SEASONAL_PREFERENCES = seasonal_preferences_config.get('consumer_season
 # 模拟参数
 BATCH_SIZE = constants_config.get('simulation', {}).get('batch_size', 3)  # 每批模拟的消费者数量
 BATCH_COUNT = constants_config.get('simulation', {}).get('batch_count', 3)  # 分批数量
-SIMPLIFIED_PROMPT = constants_config.get('simulation', {}).get('simplified_prompt', True)  # 使用简化提示词
\ No newline at end of file
+SIMPLIFIED_PROMPT = constants_config.get('simulation', {}).get('simplified_prompt', True)  # 使用简化提示词
+BATCH_CONCURRENCY = constants_config.get('simulation', {}).get('batch_concurrency', 3)  # 同时进行的批次数
\ No newline at end of file
@@ -1,16 +1,58 @@
-import sqlite3
 import os
-import json
+import sys
+import uuid
+import threading
 from datetime import datetime, date
 
+try:
+    from common import json_codec
+    from common.db_pool import get_pool
+    from common.run_registry import DEFAULT_RUN_ID, RUNS_DIR_NAME, list_runs, run_db_path
+except ImportError:
+    # 直接导入本模块时，添加项目根目录到路径
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from common import json_codec
+    from common.db_pool import get_pool
+    from common.run_registry import DEFAULT_RUN_ID, RUNS_DIR_NAME, list_runs, run_db_path
+
+# 汇总表：(表名, 维度列, 维度列类型, 重建时从consumer_actions取维度值的表达式)
+# 每个汇总表对应一个 {表名}_customers 成员表，用于增量维护去重的消费者数
+ROLLUP_DIMENSIONS = (
+    ("rollup_daily", "day_of_simulation", "INTEGER", "day_of_simulation"),
+    ("rollup_region", "region", "VARCHAR(50)", "region"),
+    ("rollup_consumer_type", "consumer_type", "VARCHAR(50)", "consumer_type"),
+)
+
+# 心理特征标准化规则：按顺序匹配关键词，与分析接口使用的维度和等级一致
+TRAIT_DIMENSIONS = (
+    ("价格敏感度", ("敏感", "价格")),
+    ("品牌忠诚度", ("忠诚", "品牌")),
+    ("购物冲动性", ("冲动",)),
+    ("品质追求", ("品质", "质量")),
+    ("时尚意识", ("时尚", "潮流")),
+)
+TRAIT_LEVELS = (
+    ("高", ("高", "强")),
+    ("中", ("中",)),
+    ("低", ("低", "弱")),
+)
+
+# 运行登记表中的时间戳精确到毫秒，同一秒内写入的运行也能按更新时间排序
+RUN_TIMESTAMP_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# 带有run_id列、删除运行时需要清理的明细表
+RUN_SCOPED_TABLES = ("consumer_traits", "consumer_actions", "consumers", "daily_stats")
+
 class DBManager:
     """数据库管理类，处理与数据库的所有交互"""
     
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, pool_size=None, per_run_files=False):
         """初始化数据库管理器
         
         Args:
             db_path: 数据库文件路径，如果为None则使用默认路径
+            pool_size: 连接池大小，如果为None则使用默认值(DB_POOL_SIZE)
+            per_run_files: 新的模拟运行是否写入独立的数据库文件(runs/<run_id>.db)
         """
         if db_path is None:
             # 使用与脚本同目录的默认路径
@@ -18,10 +60,18 @@ class DBManager:
             db_path = os.path.join(base_dir, 'simulation_data.db')
         
         self.db_path = db_path
+        self.per_run_files = per_run_files
+        
+        # 运行ID -> 写入该运行数据的DBManager(数据在主数据库中时为self)
+        self._run_targets = {}
+        self._run_targets_lock = threading.Lock()
         
         # 确保数据库文件所在目录存在
         os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
         
+        # 共享连接池(WAL模式)，与data_api的读取端可并发访问
+        self.pool = get_pool(db_path) if pool_size is None else get_pool(db_path, pool_size=pool_size)
+        
         # 初始化数据库
         self.init_database()
         
@@ -29,33 +79,52 @@ class DBManager:
         self.ensure_table_compatibility()
     
     def get_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """从连接池获取数据库连接，调用close()时归还"""
+        return self.pool.connect()
     
     def init_database(self):
         """初始化数据库表结构"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # 创建消费者表
+        # 旧数据库先升级为按运行划分的表结构
+        legacy_tables = self._prepare_run_scope_migration(cursor)
+        
+        # 创建模拟运行登记表，每次运行一行；db_file不为空时运行数据在独立的数据库文件中
         cursor.execute('''
+        CREATE TABLE IF NOT EXISTS simulation_runs (
+            run_id VARCHAR(64) PRIMARY KEY,
+            label TEXT,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            db_file TEXT,
+            last_day INTEGER,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_simulation_runs_updated_at ON simulation_runs (updated_at)')
+        
+        # 创建消费者表，同一消费者ID在不同运行中是不同的消费者
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS consumers (
-            customer_id VARCHAR(50) PRIMARY KEY,
+            run_id VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_RUN_ID}',
+            customer_id VARCHAR(50) NOT NULL,
             first_visit_date DATE NOT NULL,
             customer_type VARCHAR(50) NOT NULL,
             is_new_customer BOOLEAN DEFAULT 1,
             visit_count INTEGER DEFAULT 1,
             last_visit_date DATE,
-            total_amount DECIMAL(10,2) DEFAULT 0
+            total_amount DECIMAL(10,2) DEFAULT 0,
+            PRIMARY KEY (run_id, customer_id)
         )
         ''')
         
         # 创建消费者行为表
-        cursor.execute('''
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS consumer_actions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_RUN_ID}',
             customer_id VARCHAR(50),
             timestamp TEXT NOT NULL,
             consumer_type VARCHAR(50) NOT NULL,
@@ -80,10 +149,45 @@ class DBManager:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_consumer_type ON consumer_actions (consumer_type)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_product_name ON consumer_actions (product_name)')
         
-        # 创建每日统计数据表
+        # 查询都限定在一次运行内，复合索引以run_id开头，历史运行再多也只扫描本运行的索引范围
+        # 以模拟天数(整数)作为时间轴，按天的趋势查询走索引范围扫描，无需解析timestamp字符串
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_day_purchase ON consumer_actions (run_id, day_of_simulation, purchase)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_day_customer ON consumer_actions (run_id, day_of_simulation, customer_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_customer ON consumer_actions (run_id, customer_id)')
+        # 单列run_id索引按(run_id, id)有序，行为明细在一次运行内按id分页时无需排序
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run ON consumer_actions (run_id)')
+        
+        # 行为明细按id游标分页时的筛选索引(SQLite索引末尾隐含rowid，等值筛选后可直接按id范围扫描)
+        # 单条件筛选使用两列索引，筛选列之后紧跟rowid，无需逐行过滤整个运行；
+        # 三列索引用于同时按购买筛选的组合条件
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_type ON consumer_actions (run_id, consumer_type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_region ON consumer_actions (run_id, region)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_purchase ON consumer_actions (run_id, purchase)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_day ON consumer_actions (run_id, day_of_simulation)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_type_purchase ON consumer_actions (run_id, consumer_type, purchase)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_actions_run_region_purchase ON consumer_actions (run_id, region, purchase)')
+        
+        # 创建心理特征表，入库时将psychological_trait拆分为每个特征一行，统计时直接GROUP BY
         cursor.execute('''
+        CREATE TABLE IF NOT EXISTS consumer_traits (
+            run_id VARCHAR(64) NOT NULL,
+            action_id INTEGER NOT NULL,
+            trait_key VARCHAR(50) NOT NULL,
+            trait_value TEXT,
+            dimension VARCHAR(20),
+            trait_level VARCHAR(10)
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_traits_run_dimension_level ON consumer_traits (run_id, dimension, trait_level)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_traits_run_trait_key ON consumer_traits (run_id, trait_key)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_consumer_traits_action_id ON consumer_traits (action_id)')
+        
+        # 创建每日统计数据表，按(运行, 模拟天数)存储，date为写入时的日期
+        cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS daily_stats (
-            date DATE PRIMARY KEY,
+            run_id VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_RUN_ID}',
+            day_of_simulation INTEGER,
+            date DATE,
             order_count INTEGER,
             gmv DECIMAL(12,2),
             user_count INTEGER,
@@ -91,13 +195,189 @@ class DBManager:
             returning_user_count INTEGER DEFAULT 0,
             avg_order_value DECIMAL(10,2),
             cancelled_order_count INTEGER,
-            return_count INTEGER
+            return_count INTEGER,
+            PRIMARY KEY (run_id, day_of_simulation)
         )
         ''')
         
+        # 创建汇总表，入库时在同一事务中增量更新，仪表盘接口直接读取
+        self.create_rollup_tables(cursor)
+        
+        # 数据版本号，每次写入后递增，data_api据此判断响应缓存是否失效
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO data_version (id, version, updated_at) VALUES (1, 0, CURRENT_TIMESTAMP)")
+        
+        self._finish_run_scope_migration(cursor, legacy_tables)
+        
         conn.commit()
         conn.close()
     
+    def _bump_data_version(self, cursor):
+        """递增数据版本号(调用方负责提交事务)，与数据写入在同一事务中生效"""
+        cursor.execute('''
+        INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(id) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        ''')
+    
+    def _backfill_day_of_simulation(self, cursor):
+        """为day_of_simulation为空的旧记录回填模拟天数(调用方负责提交事务)
+        
+        Returns:
+            int: 回填的记录数
+        """
+        cursor.execute('''
+        UPDATE consumer_actions
+        SET day_of_simulation = CAST(SUBSTR(timestamp, 4) AS INTEGER)
+        WHERE day_of_simulation IS NULL AND timestamp LIKE 'Day%'
+        ''')
+        return cursor.rowcount
+    
+    def backfill_day_of_simulation(self):
+        """回填旧记录的day_of_simulation，并重建依赖模拟天数的汇总表
+        
+        Returns:
+            bool: 是否执行成功
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            backfilled = self._backfill_day_of_simulation(cursor)
+            if backfilled:
+                self._rebuild_rollups(cursor)
+            conn.commit()
+            print(f"已回填 {backfilled} 条记录的day_of_simulation")
+            return True
+        except Exception as e:
+            print(f"回填day_of_simulation时出错: {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+    
+    def create_rollup_tables(self, cursor):
+        """创建按运行划分的汇总表(按天、地区、消费者类型、产品)及总计表"""
+        for table, column, column_type, _ in ROLLUP_DIMENSIONS:
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                run_id VARCHAR(64) NOT NULL,
+                {column} {column_type} NOT NULL,
+                total_actions INTEGER NOT NULL DEFAULT 0,
+                store_visits INTEGER NOT NULL DEFAULT 0,
+                purchases INTEGER NOT NULL DEFAULT 0,
+                gmv DECIMAL(12,2) NOT NULL DEFAULT 0,
+                users INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run_id, {column})
+            )
+            ''')
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table}_customers (
+                run_id VARCHAR(64) NOT NULL,
+                {column} {column_type} NOT NULL,
+                customer_id VARCHAR(50) NOT NULL,
+                PRIMARY KEY (run_id, {column}, customer_id)
+            ) WITHOUT ROWID
+            ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_product (
+            run_id VARCHAR(64) NOT NULL,
+            product_name VARCHAR(100) NOT NULL,
+            purchases INTEGER NOT NULL DEFAULT 0,
+            gmv DECIMAL(12,2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (run_id, product_name)
+        )
+        ''')
+        
+        # 每位消费者是否有过新访问/回访，用于总计中的去重用户数
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_customers (
+            run_id VARCHAR(64) NOT NULL,
+            customer_id VARCHAR(50) NOT NULL,
+            new_visit BOOLEAN NOT NULL DEFAULT 0,
+            returning_visit BOOLEAN NOT NULL DEFAULT 0,
+            PRIMARY KEY (run_id, customer_id)
+        ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_totals (
+            run_id VARCHAR(64) PRIMARY KEY,
+            total_actions INTEGER NOT NULL DEFAULT 0,
+            store_visits INTEGER NOT NULL DEFAULT 0,
+            total_orders INTEGER NOT NULL DEFAULT 0,
+            total_gmv DECIMAL(12,2) NOT NULL DEFAULT 0,
+            total_users INTEGER NOT NULL DEFAULT 0,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            returning_users INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+    
+    def _drop_rollup_tables(self, cursor):
+        """删除所有汇总表(调用方负责提交事务)，用于升级汇总表结构"""
+        for table, _, _, _ in ROLLUP_DIMENSIONS:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_customers")
+        for table in ("rollup_product", "rollup_customers", "rollup_totals"):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    
+    def _prepare_run_scope_migration(self, cursor):
+        """将旧数据库升级为按运行划分的表结构，在创建表之前调用(调用方负责提交事务)
+        
+        consumer_actions直接添加run_id列；consumers和daily_stats需要更换主键，
+        先重命名为 {表名}_legacy，新表创建后由_finish_run_scope_migration复制数据；
+        汇总表和心理特征表是派生数据，直接删除，随后由ensure_table_compatibility重建。
+        
+        Returns:
+            list: 已重命名、等待复制数据的表名
+        """
+        def columns_of(table):
+            cursor.execute(f"PRAGMA table_info({table})")
+            return [row[1] for row in cursor.fetchall()]
+        
+        action_columns = columns_of("consumer_actions")
+        if action_columns and "run_id" not in action_columns:
+            print("为consumer_actions表添加run_id列，已有数据归入默认运行")
+            cursor.execute(f"ALTER TABLE consumer_actions ADD COLUMN run_id VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_RUN_ID}'")
+            # 旧的复合索引不含run_id，由新的按运行索引取代
+            for index in ("day_purchase", "day_customer", "type_purchase", "region_purchase"):
+                cursor.execute(f"DROP INDEX IF EXISTS idx_consumer_actions_{index}")
+        
+        legacy_tables = []
+        for table in ("consumers", "daily_stats"):
+            table_columns = columns_of(table)
+            if table_columns and "run_id" not in table_columns:
+                print(f"升级{table}表为按运行划分的主键")
+                cursor.execute(f"DROP TABLE IF EXISTS {table}_legacy")
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+                legacy_tables.append(table)
+        
+        trait_columns = columns_of("consumer_traits")
+        if trait_columns and "run_id" not in trait_columns:
+            cursor.execute("DROP TABLE consumer_traits")
+        
+        totals_columns = columns_of("rollup_totals")
+        if totals_columns and "run_id" not in totals_columns:
+            print("汇总表升级为按运行划分，将根据现有数据重建")
+            self._drop_rollup_tables(cursor)
+        
+        return legacy_tables
+    
+    def _finish_run_scope_migration(self, cursor, legacy_tables):
+        """将 {表名}_legacy 中的旧数据复制到新表(run_id取默认值)并删除旧表"""
+        for table in legacy_tables:
+            cursor.execute(f"PRAGMA table_info({table}_legacy)")
+            legacy_columns = {row[1] for row in cursor.fetchall()}
+            cursor.execute(f"PRAGMA table_info({table})")
+            shared_columns = ", ".join(row[1] for row in cursor.fetchall() if row[1] in legacy_columns)
+            cursor.execute(f"INSERT OR IGNORE INTO {table} ({shared_columns}) SELECT {shared_columns} FROM {table}_legacy")
+            cursor.execute(f"DROP TABLE {table}_legacy")
+    
     def ensure_table_compatibility(self):
         """确保数据库表结构兼容性，添加缺失列"""
         conn = self.get_connection()
@@ -134,6 +414,36 @@ class DBManager:
                 print("为daily_stats表添加returning_user_count列")
                 cursor.execute("ALTER TABLE daily_stats ADD COLUMN returning_user_count INTEGER DEFAULT 0")
             
+            # 旧数据的day_of_simulation可能为空，根据"DayN"格式的timestamp回填
+            backfilled = self._backfill_day_of_simulation(cursor)
+            if backfilled:
+                print(f"已根据timestamp回填 {backfilled} 条记录的day_of_simulation")
+            
+            # 旧数据库中有JSON特征数据但特征表为空时，拆分一次已有数据
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM consumer_traits)")
+            has_traits = cursor.fetchone()[0]
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM consumer_actions WHERE psychological_trait NOT IN ('', '{}'))")
+            if not has_traits and cursor.fetchone()[0]:
+                print("心理特征表为空，根据现有消费者行为数据拆分特征")
+                self._rebuild_traits(cursor)
+            
+            # 升级前的历史数据归入默认运行，登记后可按运行查询
+            cursor.execute(f'''
+            INSERT OR IGNORE INTO simulation_runs (run_id, label, status, last_day, started_at, updated_at)
+            SELECT ?, '历史数据', 'completed',
+                (SELECT MAX(day_of_simulation) FROM consumer_actions WHERE run_id = ?),
+                {RUN_TIMESTAMP_SQL}, {RUN_TIMESTAMP_SQL}
+            WHERE EXISTS (SELECT 1 FROM consumer_actions WHERE run_id = ?)
+            ''', (DEFAULT_RUN_ID, DEFAULT_RUN_ID, DEFAULT_RUN_ID))
+            
+            # 旧数据库中已有行为数据但汇总表为空时，重建一次汇总表
+            cursor.execute("SELECT COUNT(*) FROM rollup_totals")
+            has_rollups = cursor.fetchone()[0] > 0
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM consumer_actions)")
+            if not has_rollups and cursor.fetchone()[0]:
+                print("汇总表为空，根据现有消费者行为数据重建")
+                self._rebuild_rollups(cursor)
+            
             conn.commit()
             print("数据库表结构兼容性检查完成")
         except Exception as e:
@@ -142,250 +452,792 @@ class DBManager:
         finally:
             conn.close()
     
-    def save_simulation_data(self, simulation_data, day):
+    def _touch_run(self, cursor, run_id, last_day=None):
+        """登记运行并更新其最近写入时间和天数(调用方负责提交事务)"""
+        cursor.execute(f'''
+        INSERT INTO simulation_runs (run_id, status, last_day, started_at, updated_at)
+        VALUES (?, 'running', ?, {RUN_TIMESTAMP_SQL}, {RUN_TIMESTAMP_SQL})
+        ON CONFLICT(run_id) DO UPDATE SET
+            last_day = MAX(COALESCE(last_day, 0), COALESCE(excluded.last_day, 0)),
+            updated_at = excluded.updated_at
+        ''', (run_id, last_day))
+    
+    def _run_target(self, run_id):
+        """返回负责写入指定运行数据的DBManager：运行有独立数据库文件时为该文件的管理器，否则为self"""
+        with self._run_targets_lock:
+            target = self._run_targets.get(run_id)
+        if target is not None:
+            return target
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT db_file FROM simulation_runs WHERE run_id = ?", (run_id,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        
+        db_file = row[0] if row else None
+        target = DBManager(run_db_path(self.db_path, db_file)) if db_file else self
+        with self._run_targets_lock:
+            return self._run_targets.setdefault(run_id, target)
+    
+    def start_run(self, label=None, run_id=None):
+        """登记一次新的模拟运行
+        
+        Args:
+            label: 运行说明，例如品牌名称
+            run_id: 指定运行ID，为None时自动生成
+        
+        Returns:
+            str: 运行ID，之后保存数据时传入
+        """
+        run_id = run_id or f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        db_file = os.path.join(RUNS_DIR_NAME, f"{run_id}.db") if self.per_run_files else None
+        
+        target = self
+        if db_file:
+            # 独立的运行数据库与主数据库表结构相同，可直接ATTACH做跨运行分析
+            target = DBManager(run_db_path(self.db_path, db_file))
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            INSERT INTO simulation_runs (run_id, label, status, db_file, started_at, updated_at)
+            VALUES (?, ?, 'running', ?, {RUN_TIMESTAMP_SQL}, {RUN_TIMESTAMP_SQL})
+            ON CONFLICT(run_id) DO UPDATE SET label = excluded.label, status = 'running', updated_at = excluded.updated_at
+            ''', (run_id, label, db_file))
+            self._bump_data_version(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+        
+        with self._run_targets_lock:
+            self._run_targets[run_id] = target
+        print(f"开始模拟运行: {run_id}" + (f" (数据文件: {db_file})" if db_file else ""))
+        return run_id
+    
+    def finish_run(self, run_id, status="completed"):
+        """标记模拟运行结束
+        
+        Args:
+            run_id: 运行ID
+            status: 结束状态，如completed/failed
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            UPDATE simulation_runs SET status = ?, finished_at = {RUN_TIMESTAMP_SQL}
+            WHERE run_id = ?
+            ''', (status, run_id))
+            self._bump_data_version(cursor)
+            conn.commit()
+        except Exception as e:
+            print(f"更新运行状态时出错: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+    
+    def list_runs(self):
+        """列出所有登记的运行，按最近写入时间倒序"""
+        return list_runs(self.db_path)
+    
+    def drop_run(self, run_id):
+        """删除一次运行的全部数据
+        
+        运行有独立数据库文件时直接删除文件，耗时与数据量无关；
+        否则按run_id开头的索引删除各表中该运行的行。
+        
+        Args:
+            run_id: 运行ID
+        
+        Returns:
+            bool: 是否删除成功
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT db_file FROM simulation_runs WHERE run_id = ?", (run_id,))
+            row = cursor.fetchone()
+            db_file = row[0] if row else None
+            
+            if not db_file:
+                for table in RUN_SCOPED_TABLES:
+                    cursor.execute(f"DELETE FROM {table} WHERE run_id = ?", (run_id,))
+                self.clear_rollups(cursor, run_id)
+            cursor.execute("DELETE FROM simulation_runs WHERE run_id = ?", (run_id,))
+            self._bump_data_version(cursor)
+            conn.commit()
+        except Exception as e:
+            print(f"删除运行 {run_id} 时出错: {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+        
+        with self._run_targets_lock:
+            self._run_targets.pop(run_id, None)
+        
+        if db_file:
+            path = run_db_path(self.db_path, db_file)
+            get_pool(path).close_all()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        print(f"已删除运行 {run_id}")
+        return True
+    
+    def save_simulation_data(self, simulation_data, day, run_id=None):
         """保存模拟数据到数据库
         
         Args:
             simulation_data: 模拟生成的消费者行为数据
             day: 模拟的天数
+            run_id: 所属的运行ID，为None时写入默认运行
         """
         if not simulation_data:
             print(f"警告: 第{day}天的模拟数据为空，跳过保存")
             return False
         
-        try:
+        return self.save_simulation_batch([(day, simulation_data)], run_id)
+    
+    def save_simulation_batch(self, days_data, run_id=None):
+        """在一个事务中批量保存多天的模拟数据
+        
+        先在内存中规范化所有消费者记录，再用 executemany 批量写入：
+        consumers 表使用 INSERT ... ON CONFLICT DO UPDATE 合并访问次数，
+        consumer_actions 表一次性批量插入。
+        
+        Args:
+            days_data: [(day, simulation_data), ...] 列表
+            run_id: 所属的运行ID，为None时写入默认运行
+        
+        Returns:
+            bool: 是否保存成功
+        """
+        days_data = [(day, data) for day, data in days_data if data]
+        if not days_data:
+            print("警告: 批量模拟数据为空，跳过保存")
+            return False
+        
+        run_id = run_id or DEFAULT_RUN_ID
+        target = self._run_target(run_id)
+        if target is not self:
+            # 运行数据写入独立的数据库文件，主数据库只更新登记信息和数据版本
+            if not target.save_simulation_batch(days_data, run_id):
+                return False
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            print(f"=== 开始保存第{day}天的模拟数据 ===")
-            print(f"数据库路径: {self.db_path}")
-            
-            # 提取当前日期
-            current_date = date.today().isoformat()
-            print(f"当前日期: {current_date}")
-            
-            # 统计变量
-            order_count = 0
-            total_gmv = 0
-            unique_users = set()
-            cancelled_orders = 0
-            return_count = 0
-            
-            # 获取消费者数据
+            try:
+                cursor = conn.cursor()
+                self._touch_run(cursor, run_id, max(day for day, _ in days_data))
+                self._bump_data_version(cursor)
+                conn.commit()
+            finally:
+                conn.close()
+            return True
+        
+        # 提取当前日期
+        current_date = date.today().isoformat()
+        
+        # 在内存中规范化所有记录
+        actions = []
+        for day, simulation_data in days_data:
             consumers = simulation_data.get("consumers", [])
             if not consumers and "customer_interactions" in simulation_data:
                 # 尝试从不同的键名获取数据
                 consumers = simulation_data.get("customer_interactions", [])
             
-            print(f"消费者记录数: {len(consumers)}")
-            
-            # 记录每条消费者行为
             for i, consumer in enumerate(consumers):
                 try:
-                    # 确保consumer_id存在
-                    customer_id = consumer.get("id", f"auto_id_{i}")
-                    
-                    consumer_type = consumer.get("consumer_type", consumer.get("type", "未知"))
-                    
-                    # 更新consumers表
-                    try:
-                        # 检查用户是否已存在
-                        cursor.execute("SELECT * FROM consumers WHERE customer_id = ?", (customer_id,))
-                        existing_user = cursor.fetchone()
-                        
-                        if existing_user:
-                            # 更新现有用户
-                            cursor.execute("""
-                            UPDATE consumers SET 
-                            last_visit_date = ?, 
-                            visit_count = visit_count + 1,
-                            is_new_customer = 0
-                            WHERE customer_id = ?
-                            """, (current_date, customer_id))
-                            is_new_visit = False
-                        else:
-                            # 创建新用户
-                            cursor.execute("""
-                            INSERT INTO consumers 
-                            (customer_id, first_visit_date, customer_type, is_new_customer, visit_count, last_visit_date)
-                            VALUES (?, ?, ?, 1, 1, ?)
-                            """, (customer_id, current_date, consumer_type, current_date))
-                            is_new_visit = True
-                    except Exception as e:
-                        print(f"更新customers表时出错: {e}")
-                        is_new_visit = False  # 默认为非新访问
-                    
-                    # 提取地域信息
-                    region_data = consumer.get("region", {})
-                    region = None
-                    city_type = None
-                    city = None  # 添加城市变量
-                    province = None  # 添加省份变量
-                    
-                    if isinstance(region_data, dict):
-                        region = region_data.get("area", region_data.get("地区", "未知"))
-                        city_type = region_data.get("city_type", region_data.get("城市类型", "未知"))
-                        city = region_data.get("city", region_data.get("城市", "未知"))  # 获取城市名称
-                        
-                        # 根据地区和城市映射省份（对应到中国地图）
-                        province = self.get_province_by_region_city(region, city)
-                    else:
-                        region = consumer.get("region", "未知")
-                        city_type = consumer.get("city_type", "未知")
-                        city = consumer.get("city", "未知")
-                        province = self.get_province_by_region_city(region, city)
-                    
-                    # 将省份信息添加到region字段，格式：原区域名称-省份，例如：华东-上海
-                    if province and province != "未知":
-                        region = f"{region}-{province}"
-                    
-                    # 首先优先从behavior字段获取访问和购买信息
-                    behavior = consumer.get("behavior", {})
-                    if isinstance(behavior, dict):
-                        visit_store = behavior.get("entered_store", False)
-                        browse_time = behavior.get("browsed_minutes", 0)
-                        purchase = behavior.get("made_purchase", False)
-                        
-                        # 获取购买产品和金额
-                        items_purchased = behavior.get("items_purchased", [])
-                        product_name = items_purchased[0] if items_purchased and len(items_purchased) > 0 else ""
-                        amount = behavior.get("amount_spent", 0.0)
-                    else:
-                        # 如果没有behavior字段，尝试从顶级字段获取
-                        visit_store = consumer.get("visit_store", False)
-                        browse_time = consumer.get("browse_time", 0)
-                        purchase = consumer.get("purchase", False)
-                        product_name = consumer.get("product_name", consumer.get("product", ""))
-                        amount = consumer.get("amount", 0.0)
-                    
-                    # 确保布尔值正确转换
-                    visit_store = bool(visit_store)
-                    purchase = bool(purchase)
-                    
-                    # 修复：强制将有金额的记录设为已购买和已访问
-                    if amount and float(amount) > 0:
-                        purchase = True
-                        visit_store = True
-                        
-                        # 如果产品名为空但有金额，设置一个默认产品
-                        if not product_name:
-                            product_name = "未指定产品"
-                    
-                    # 处理心理特征
-                    psych_traits = consumer.get("psychological_trait", {})
-                    if not psych_traits and "psychological_traits" in consumer:
-                        psych_traits = consumer.get("psychological_traits", {})
-                    elif not psych_traits and "consumer_traits" in consumer:
-                        psych_traits = consumer.get("consumer_traits", {})
-                    
-                    # 如果是字符串，尝试解析为字典
-                    if isinstance(psych_traits, str):
-                        try:
-                            psych_traits = json.loads(psych_traits)
-                        except:
-                            psych_traits = {"未解析特征": psych_traits}
-                    
-                    # 将心理特征转为JSON字符串
-                    psych_traits_json = json.dumps(psych_traits, ensure_ascii=False)
-                    
-                    # 获取timestamp，将day格式用作日期
-                    day_num = consumer.get("day", day) or day
-                    timestamp = f"Day{day_num}"
-                    
-                    print(f"处理第{i+1}条消费者记录: 类型={consumer_type}, 区域={region}, 城市类型={city_type}, 访问={visit_store}, 购买={purchase}, 产品={product_name}, 金额={amount}")
-                    
-                    # 插入消费者行为记录
-                    cursor.execute('''
-                    INSERT INTO consumer_actions 
-                    (customer_id, timestamp, consumer_type, region, city_type, visit_store, 
-                    browse_time, purchase, product_name, amount, psychological_trait, day_of_simulation, is_new_visit)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        customer_id,
-                        timestamp, 
-                        consumer_type, 
-                        region, 
-                        city_type, 
-                        1 if visit_store else 0, 
-                        browse_time, 
-                        1 if purchase else 0, 
-                        product_name, 
-                        float(amount) if amount is not None else 0.0, 
-                        psych_traits_json,
-                        day,
-                        1 if is_new_visit else 0
-                    ))
-                    
-                    # 更新统计数据
-                    if purchase:
-                        order_count += 1
-                        total_gmv += float(amount) if amount is not None else 0.0
-                        unique_users.add(customer_id)
-                    
-                    if consumer.get("cancelled", False):
-                        cancelled_orders += 1
-                    
-                    if consumer.get("return", False):
-                        return_count += 1
-                    
+                    actions.append(self._normalize_consumer(consumer, day, i))
                 except Exception as e:
-                    print(f"处理消费者记录时出错: {e}")
+                    print(f"处理第{day}天第{i+1}条消费者记录时出错: {e}")
                     continue  # 跳过此条记录，继续处理下一条
+        
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            # 一次性查询批次中已存在的消费者，用于判断是否为新访问
+            customer_ids = list({action["customer_id"] for action in actions})
+            existing_ids = set()
+            for chunk_start in range(0, len(customer_ids), 500):
+                chunk = customer_ids[chunk_start:chunk_start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"SELECT customer_id FROM consumers WHERE run_id = ? AND customer_id IN ({placeholders})",
+                               [run_id] + chunk)
+                existing_ids.update(row[0] for row in cursor.fetchall())
+            
+            # 按出现顺序计算is_new_visit，并汇总每位消费者在本批次中的访问次数
+            consumer_visits = {}
+            for action in actions:
+                customer_id = action["customer_id"]
+                action["is_new_visit"] = customer_id not in existing_ids and customer_id not in consumer_visits
+                if customer_id in consumer_visits:
+                    consumer_visits[customer_id]["visit_count"] += 1
+                else:
+                    consumer_visits[customer_id] = {
+                        "customer_type": action["consumer_type"],
+                        "visit_count": 1
+                    }
             
-            # 计算平均订单价值
-            avg_order_value = 0
-            if order_count > 0:
-                avg_order_value = total_gmv / order_count
+            # 批量合并consumers表
+            cursor.executemany("""
+            INSERT INTO consumers
+            (run_id, customer_id, first_visit_date, customer_type, is_new_customer, visit_count, last_visit_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(run_id, customer_id) DO UPDATE SET
+                last_visit_date = excluded.last_visit_date,
+                visit_count = consumers.visit_count + excluded.visit_count,
+                is_new_customer = 0
+            """, [
+                (
+                    run_id,
+                    customer_id,
+                    current_date,
+                    info["customer_type"],
+                    1 if info["visit_count"] == 1 else 0,
+                    info["visit_count"],
+                    current_date
+                )
+                for customer_id, info in consumer_visits.items()
+            ])
             
-            # 保存每日统计数据
-            print(f"统计结果: 订单数={order_count}, 总GMV={total_gmv}, 用户数={len(unique_users)}, 平均订单价值={avg_order_value}")
+            # 批量插入消费者行为记录
+            cursor.executemany('''
+            INSERT INTO consumer_actions
+            (run_id, customer_id, timestamp, consumer_type, region, city_type, visit_store,
+            browse_time, purchase, product_name, amount, psychological_trait, day_of_simulation, is_new_visit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (
+                    run_id,
+                    action["customer_id"],
+                    action["timestamp"],
+                    action["consumer_type"],
+                    action["region"],
+                    action["city_type"],
+                    1 if action["visit_store"] else 0,
+                    action["browse_time"],
+                    1 if action["purchase"] else 0,
+                    action["product_name"],
+                    action["amount"],
+                    action["psychological_trait"],
+                    action["day"],
+                    1 if action["is_new_visit"] else 0
+                )
+                for action in actions
+            ])
+            
+            # 同一事务内AUTOINCREMENT分配的id连续，据此关联本批次的心理特征
+            if actions:
+                cursor.execute("SELECT last_insert_rowid()")
+                self._insert_traits(cursor, run_id, cursor.fetchone()[0] - len(actions) + 1, actions)
+            
+            # 在同一事务中增量更新汇总表
+            self._update_rollups(cursor, run_id, actions)
             
             # 计算新用户和回访用户数量
             try:
-                cursor.execute("SELECT COUNT(*) FROM consumers WHERE is_new_customer = 1")
-                new_users = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM consumers WHERE is_new_customer = 0")
-                returning_users = cursor.fetchone()[0]
+                cursor.execute("""
+                SELECT
+                    SUM(CASE WHEN is_new_customer = 1 THEN 1 ELSE 0 END),
+                    SUM(CASE WHEN is_new_customer = 0 THEN 1 ELSE 0 END)
+                FROM consumers
+                WHERE run_id = ?
+                """, (run_id,))
+                new_users, returning_users = cursor.fetchone()
+                new_users = new_users or 0
+                returning_users = returning_users or 0
             except Exception as e:
                 print(f"获取新用户和回访用户数量时出错: {e}")
                 new_users = 0
                 returning_users = 0
             
-            # 插入或更新日常统计
-            try:
-                cursor.execute('''
-                INSERT OR REPLACE INTO daily_stats 
-                (date, order_count, gmv, user_count, new_user_count, returning_user_count, avg_order_value, cancelled_order_count, return_count)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    current_date, 
-                    order_count, 
-                    total_gmv, 
+            # 按天汇总每日统计
+            stats_rows = []
+            for day, _ in days_data:
+                day_actions = [action for action in actions if action["day"] == day]
+                purchases = [action for action in day_actions if action["purchase"]]
+                order_count = len(purchases)
+                total_gmv = sum(action["amount"] for action in purchases)
+                unique_users = {action["customer_id"] for action in purchases}
+                avg_order_value = total_gmv / order_count if order_count > 0 else 0
+                stats_rows.append((
+                    run_id,
+                    day,
+                    current_date,
+                    order_count,
+                    total_gmv,
                     len(unique_users),
                     new_users,
                     returning_users,
-                    avg_order_value, 
-                    cancelled_orders, 
-                    return_count
+                    avg_order_value,
+                    sum(1 for action in day_actions if action["cancelled"]),
+                    sum(1 for action in day_actions if action["returned"])
                 ))
+            
+            # 插入或更新日常统计
+            try:
+                cursor.executemany('''
+                INSERT OR REPLACE INTO daily_stats
+                (run_id, day_of_simulation, date, order_count, gmv, user_count, new_user_count, returning_user_count,
+                avg_order_value, cancelled_order_count, return_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', stats_rows)
             except Exception as e:
                 print(f"保存每日统计数据时出错: {e}")
             
+            # 更新运行登记信息；数据已变化，使data_api的响应缓存失效
+            self._touch_run(cursor, run_id, max(day for day, _ in days_data))
+            self._bump_data_version(cursor)
+            
             # 提交所有更改
             conn.commit()
-            print("数据已提交到数据库")
-            print(f"=== 成功保存第{day}天的模拟数据，共{len(consumers)}条消费者记录 ===")
-            
-            conn.close()
+            days_label = ",".join(str(day) for day, _ in days_data)
+            print(f"=== 成功保存运行 {run_id} 第{days_label}天的模拟数据，共{len(actions)}条消费者记录 ===")
             return True
-            
+        
         except Exception as e:
             print(f"保存数据时出错: {e}")
             if conn:
                 conn.rollback()
+            return False
+        finally:
+            if conn:
                 conn.close()
+    
+    def _update_rollups(self, cursor, run_id, actions):
+        """根据本批次的消费者行为增量更新汇总表(调用方负责提交事务)
+        
+        计数类字段直接累加；去重的消费者数通过成员表判断，
+        只有首次出现的 (维度值, 消费者) 才会使消费者数加一。
+        
+        Args:
+            cursor: 入库事务中的游标
+            run_id: 本批次所属的运行ID
+            actions: _normalize_consumer 规范化后并已计算 is_new_visit 的记录列表
+        """
+        if not actions:
+            return
+        
+        # 在内存中先按维度汇总本批次数据: [行为数, 进店数, 购买数, 销售额, 新增去重消费者数]
+        buckets = {table: {} for table, _, _, _ in ROLLUP_DIMENSIONS}
+        members = {table: set() for table, _, _, _ in ROLLUP_DIMENSIONS}
+        products = {}
+        customers = {}
+        for action in actions:
+            visit = 1 if action["visit_store"] else 0
+            purchase = 1 if action["purchase"] else 0
+            gmv = action["amount"] if purchase else 0
+            keys = {
+                "rollup_daily": action["day"],
+                "rollup_region": action["region"],
+                "rollup_consumer_type": action["consumer_type"],
+            }
+            for table, key in keys.items():
+                if key is None:
+                    continue
+                row = buckets[table].setdefault(key, [0, 0, 0, 0.0, 0])
+                row[0] += 1
+                row[1] += visit
+                row[2] += purchase
+                row[3] += gmv
+                members[table].add((key, action["customer_id"]))
+            
+            if purchase:
+                product = products.setdefault(action["product_name"] or "", [0, 0.0])
+                product[0] += 1
+                product[1] += gmv
+            
+            flags = customers.setdefault(action["customer_id"], [False, False])
+            if action["is_new_visit"]:
+                flags[0] = True
+            else:
+                flags[1] = True
+        
+        for table, column, _, _ in ROLLUP_DIMENSIONS:
+            for key, customer_id in members[table]:
+                cursor.execute(f"INSERT OR IGNORE INTO {table}_customers (run_id, {column}, customer_id) VALUES (?, ?, ?)",
+                               (run_id, key, customer_id))
+                if cursor.rowcount == 1:
+                    buckets[table][key][4] += 1
+            
+            cursor.executemany(f'''
+            INSERT INTO {table} (run_id, {column}, total_actions, store_visits, purchases, gmv, users)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(run_id, {column}) DO UPDATE SET
+                total_actions = total_actions + excluded.total_actions,
+                store_visits = store_visits + excluded.store_visits,
+                purchases = purchases + excluded.purchases,
+                gmv = gmv + excluded.gmv,
+                users = users + excluded.users
+            ''', [(run_id, key, *row) for key, row in buckets[table].items()])
+        
+        if products:
+            cursor.executemany('''
+            INSERT INTO rollup_product (run_id, product_name, purchases, gmv)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(run_id, product_name) DO UPDATE SET
+                purchases = purchases + excluded.purchases,
+                gmv = gmv + excluded.gmv
+            ''', [(run_id, name, *row) for name, row in products.items()])
+        
+        # 总计中的去重用户数：新消费者、首次出现新访问/回访的消费者各加一
+        total_users = new_users = returning_users = 0
+        for customer_id, (has_new_visit, has_returning_visit) in customers.items():
+            cursor.execute("INSERT OR IGNORE INTO rollup_customers (run_id, customer_id) VALUES (?, ?)",
+                           (run_id, customer_id))
+            total_users += cursor.rowcount
+            if has_new_visit:
+                cursor.execute('''
+                UPDATE rollup_customers SET new_visit = 1
+                WHERE run_id = ? AND customer_id = ? AND new_visit = 0
+                ''', (run_id, customer_id))
+                new_users += cursor.rowcount
+            if has_returning_visit:
+                cursor.execute('''
+                UPDATE rollup_customers SET returning_visit = 1
+                WHERE run_id = ? AND customer_id = ? AND returning_visit = 0
+                ''', (run_id, customer_id))
+                returning_users += cursor.rowcount
+        
+        cursor.execute('''
+        INSERT INTO rollup_totals
+        (run_id, total_actions, store_visits, total_orders, total_gmv, total_users, new_users, returning_users)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(run_id) DO UPDATE SET
+            total_actions = total_actions + excluded.total_actions,
+            store_visits = store_visits + excluded.store_visits,
+            total_orders = total_orders + excluded.total_orders,
+            total_gmv = total_gmv + excluded.total_gmv,
+            total_users = total_users + excluded.total_users,
+            new_users = new_users + excluded.new_users,
+            returning_users = returning_users + excluded.returning_users
+        ''', (
+            run_id,
+            len(actions),
+            sum(1 for action in actions if action["visit_store"]),
+            sum(1 for action in actions if action["purchase"]),
+            sum(action["amount"] for action in actions if action["purchase"]),
+            total_users,
+            new_users,
+            returning_users
+        ))
+    
+    def clear_rollups(self, cursor, run_id=None):
+        """清空汇总表(调用方负责提交事务)，用于清空行为数据时保持一致
+        
+        Args:
+            cursor: 事务中的游标
+            run_id: 只清空指定运行的汇总数据，为None时清空全部
+        """
+        where, params = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+        for table, _, _, _ in ROLLUP_DIMENSIONS:
+            cursor.execute(f"DELETE FROM {table} {where}", params)
+            cursor.execute(f"DELETE FROM {table}_customers {where}", params)
+        cursor.execute(f"DELETE FROM rollup_product {where}", params)
+        cursor.execute(f"DELETE FROM rollup_customers {where}", params)
+        cursor.execute(f"DELETE FROM rollup_totals {where}", params)
+        self._bump_data_version(cursor)
+    
+    def _rebuild_rollups(self, cursor):
+        """根据consumer_actions全量重建所有运行的汇总表(调用方负责提交事务)"""
+        self.clear_rollups(cursor)
+        
+        for table, column, _, expression in ROLLUP_DIMENSIONS:
+            cursor.execute(f'''
+            INSERT INTO {table}_customers (run_id, {column}, customer_id)
+            SELECT DISTINCT run_id, {expression}, customer_id
+            FROM consumer_actions
+            WHERE {expression} IS NOT NULL AND customer_id IS NOT NULL
+            ''')
+            cursor.execute(f'''
+            INSERT INTO {table} (run_id, {column}, total_actions, store_visits, purchases, gmv, users)
+            SELECT
+                run_id,
+                {expression},
+                COUNT(*),
+                SUM(CASE WHEN visit_store = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN purchase = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN purchase = 1 THEN COALESCE(amount, 0) ELSE 0 END),
+                COUNT(DISTINCT customer_id)
+            FROM consumer_actions
+            WHERE {expression} IS NOT NULL
+            GROUP BY run_id, {expression}
+            ''')
+        
+        cursor.execute('''
+        INSERT INTO rollup_product (run_id, product_name, purchases, gmv)
+        SELECT run_id, COALESCE(product_name, ''), COUNT(*), SUM(COALESCE(amount, 0))
+        FROM consumer_actions
+        WHERE purchase = 1
+        GROUP BY run_id, COALESCE(product_name, '')
+        ''')
+        
+        cursor.execute('''
+        INSERT INTO rollup_customers (run_id, customer_id, new_visit, returning_visit)
+        SELECT
+            run_id,
+            customer_id,
+            MAX(CASE WHEN is_new_visit = 1 THEN 1 ELSE 0 END),
+            MAX(CASE WHEN is_new_visit = 1 THEN 0 ELSE 1 END)
+        FROM consumer_actions
+        WHERE customer_id IS NOT NULL
+        GROUP BY run_id, customer_id
+        ''')
+        
+        cursor.execute('''
+        INSERT INTO rollup_totals
+        (run_id, total_actions, store_visits, total_orders, total_gmv, total_users, new_users, returning_users)
+        SELECT
+            actions.run_id,
+            COUNT(*),
+            COALESCE(SUM(CASE WHEN visit_store = 1 THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN purchase = 1 THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN purchase = 1 THEN COALESCE(amount, 0) ELSE 0 END), 0),
+            (SELECT COUNT(*) FROM rollup_customers c WHERE c.run_id = actions.run_id),
+            (SELECT COUNT(*) FROM rollup_customers c WHERE c.run_id = actions.run_id AND c.new_visit = 1),
+            (SELECT COUNT(*) FROM rollup_customers c WHERE c.run_id = actions.run_id AND c.returning_visit = 1)
+        FROM consumer_actions actions
+        GROUP BY actions.run_id
+        ''')
+    
+    def rebuild_rollups(self):
+        """在一个事务中全量重建汇总表，用于升级已有数据库或修复汇总数据
+        
+        Returns:
+            bool: 是否重建成功
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._rebuild_rollups(cursor)
+            conn.commit()
+            cursor.execute("SELECT COUNT(*), SUM(total_actions) FROM rollup_totals")
+            runs, total = cursor.fetchone()
+            print(f"汇总表重建完成，共汇总 {runs} 次运行的 {total or 0} 条消费者行为记录")
+            return True
+        except Exception as e:
+            print(f"重建汇总表时出错: {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def normalize_trait(trait_key, trait_value):
+        """将心理特征键值标准化为(维度, 等级)，无法匹配的部分为None
+        
+        Args:
+            trait_key: 原始特征名，如"价格敏感"
+            trait_value: 原始特征值，如"较高"
+        
+        Returns:
+            tuple: (标准维度名, 高/中/低)
+        """
+        dimension = next((name for name, keywords in TRAIT_DIMENSIONS
+                          if any(keyword in trait_key for keyword in keywords)), None)
+        level = None
+        if isinstance(trait_value, str):
+            level = next((name for name, keywords in TRAIT_LEVELS
+                          if any(keyword in trait_value for keyword in keywords)), None)
+        return dimension, level
+    
+    def _trait_rows(self, run_id, action_id, traits):
+        """将一条记录的心理特征拆分为consumer_traits表的多行"""
+        if not isinstance(traits, dict):
+            return []
+        rows = []
+        for trait_key, trait_value in traits.items():
+            trait_key = str(trait_key)
+            dimension, level = self.normalize_trait(trait_key, trait_value)
+            if not isinstance(trait_value, str):
+                trait_value = json_codec.dumps(trait_value)
+            rows.append((run_id, action_id, trait_key, trait_value, dimension, level))
+        return rows
+    
+    def _insert_traits(self, cursor, run_id, first_action_id, actions):
+        """写入本批次的心理特征行(调用方负责提交事务)
+        
+        Args:
+            cursor: 入库事务中的游标
+            run_id: 本批次所属的运行ID
+            first_action_id: 本批次第一条consumer_actions记录的id
+            actions: 与插入顺序一致的规范化记录列表
+        """
+        rows = []
+        for offset, action in enumerate(actions):
+            rows.extend(self._trait_rows(run_id, first_action_id + offset, action["traits"]))
+        if rows:
+            cursor.executemany('''
+            INSERT INTO consumer_traits (run_id, action_id, trait_key, trait_value, dimension, trait_level)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+    
+    def _rebuild_traits(self, cursor, chunk_size=5000):
+        """根据consumer_actions.psychological_trait全量重建consumer_traits(调用方负责提交事务)
+        
+        Returns:
+            int: 写入的特征行数
+        """
+        cursor.execute("DELETE FROM consumer_traits")
+        self._bump_data_version(cursor)
+        total = 0
+        last_id = 0
+        while True:
+            cursor.execute('''
+            SELECT id, run_id, psychological_trait FROM consumer_actions
+            WHERE id > ? AND psychological_trait IS NOT NULL AND psychological_trait != ''
+            ORDER BY id
+            LIMIT ?
+            ''', (last_id, chunk_size))
+            batch = cursor.fetchall()
+            if not batch:
+                break
+            rows = []
+            for action_id, run_id, trait_json in batch:
+                try:
+                    traits = json_codec.loads(trait_json)
+                except (TypeError, ValueError):
+                    continue
+                rows.extend(self._trait_rows(run_id, action_id, traits))
+            if rows:
+                cursor.executemany('''
+                INSERT INTO consumer_traits (run_id, action_id, trait_key, trait_value, dimension, trait_level)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+            total += len(rows)
+            last_id = batch[-1][0]
+        return total
+    
+    def rebuild_traits(self):
+        """在一个事务中根据已有的JSON特征数据重建consumer_traits，用于升级已有数据库
+        
+        Returns:
+            bool: 是否重建成功
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            total = self._rebuild_traits(cursor)
+            conn.commit()
+            print(f"心理特征表重建完成，共写入 {total} 条特征")
+            return True
+        except Exception as e:
+            print(f"重建心理特征表时出错: {e}")
+            conn.rollback()
             return False
+        finally:
+            conn.close()
+    
+    def _normalize_consumer(self, consumer, day, index):
+        """将一条消费者记录规范化为consumer_actions表的一行
+        
+        Args:
+            consumer: 模拟生成的消费者数据
+            day: 模拟的天数
+            index: 记录在当天数据中的序号，用于生成缺省ID
+        
+        Returns:
+            dict: 规范化后的记录
+        """
+        # 确保consumer_id存在；缺省ID带上天数，避免不同天的第i条记录被当成同一位消费者
+        customer_id = consumer.get("id") or f"auto_id_d{day}_{index}"
+        
+        consumer_type = consumer.get("consumer_type", consumer.get("type", "未知"))
+        
+        # 提取地域信息
+        region_data = consumer.get("region", {})
+        
+        if isinstance(region_data, dict):
+            region = region_data.get("area", region_data.get("地区", "未知"))
+            city_type = region_data.get("city_type", region_data.get("城市类型", "未知"))
+            city = region_data.get("city", region_data.get("城市", "未知"))  # 获取城市名称
+        else:
+            region = consumer.get("region", "未知")
+            city_type = consumer.get("city_type", "未知")
+            city = consumer.get("city", "未知")
+        
+        # 根据地区和城市映射省份（对应到中国地图）
+        province = self.get_province_by_region_city(region, city)
+        
+        # 将省份信息添加到region字段，格式：原区域名称-省份，例如：华东-上海
+        if province and province != "未知":
+            region = f"{region}-{province}"
+        
+        # 首先优先从behavior字段获取访问和购买信息
+        behavior = consumer.get("behavior", {})
+        if isinstance(behavior, dict):
+            visit_store = behavior.get("entered_store", False)
+            browse_time = behavior.get("browsed_minutes", 0)
+            purchase = behavior.get("made_purchase", False)
+            
+            # 获取购买产品和金额
+            items_purchased = behavior.get("items_purchased", [])
+            product_name = items_purchased[0] if items_purchased and len(items_purchased) > 0 else ""
+            amount = behavior.get("amount_spent", 0.0)
+        else:
+            # 如果没有behavior字段，尝试从顶级字段获取
+            visit_store = consumer.get("visit_store", False)
+            browse_time = consumer.get("browse_time", 0)
+            purchase = consumer.get("purchase", False)
+            product_name = consumer.get("product_name", consumer.get("product", ""))
+            amount = consumer.get("amount", 0.0)
+        
+        amount = float(amount) if amount is not None else 0.0
+        
+        # 确保布尔值正确转换
+        visit_store = bool(visit_store)
+        purchase = bool(purchase)
+        
+        # 修复：强制将有金额的记录设为已购买和已访问
+        if amount > 0:
+            purchase = True
+            visit_store = True
+            
+            # 如果产品名为空但有金额，设置一个默认产品
+            if not product_name:
+                product_name = "未指定产品"
+        
+        # 处理心理特征
+        psych_traits = consumer.get("psychological_trait", {})
+        if not psych_traits and "psychological_traits" in consumer:
+            psych_traits = consumer.get("psychological_traits", {})
+        elif not psych_traits and "consumer_traits" in consumer:
+            psych_traits = consumer.get("consumer_traits", {})
+        
+        # 如果是字符串，尝试解析为字典
+        if isinstance(psych_traits, str):
+            try:
+                psych_traits = json_codec.loads(psych_traits)
+            except:
+                psych_traits = {"未解析特征": psych_traits}
+        
+        # 获取timestamp，将day格式用作日期
+        day_num = consumer.get("day", day) or day
+        
+        return {
+            "customer_id": customer_id,
+            "timestamp": f"Day{day_num}",
+            "consumer_type": consumer_type,
+            "region": region,
+            "city_type": city_type,
+            "visit_store": visit_store,
+            "browse_time": browse_time,
+            "purchase": purchase,
+            "product_name": product_name,
+            "amount": amount,
+            # 将心理特征转为JSON字符串
+            "psychological_trait": json_codec.dumps(psych_traits),
+            "traits": psych_traits,
+            "day": day,
+            "cancelled": bool(consumer.get("cancelled", False)),
+            "returned": bool(consumer.get("return", False))
+        }
     
     def get_province_by_region_city(self, region, city):
         """
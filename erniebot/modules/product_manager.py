@@ -46,6 +46,33 @@ def is_product_generation_request(question):
     
     return False
 
+def is_batch_simulation_request(question):
+    """识别是否为批量并发模拟请求，如 批量模拟：商务人士、年轻新贵"""
+    if not question or not isinstance(question, str):
+        return False
+    return question.strip().startswith(("批量模拟", "批量生成"))
+
+def extract_batch_segments(message):
+    """从批量模拟请求中提取各个目标消费群体
+    
+    Args:
+        message: 如"批量模拟：商务人士、年轻新贵；健康生活主义者"
+        
+    Returns:
+        list: 去重后的消费群体列表，未指定时返回 [None] 表示生成一个不限群体的产品
+    """
+    if not message or not isinstance(message, str):
+        return []
+    
+    content = re.sub(r"^\s*批量(模拟|生成)(产品)?[：:\s]*", "", message)
+    segments = []
+    for segment in re.split(r"[,，、;；\n]+", content):
+        segment = segment.strip()
+        if segment and segment not in segments:
+            segments.append(segment)
+    
+    return segments or [None]
+
 def extract_consumer_type(message):
     """从用户消息中提取目标消费群体类型"""
     if not message or not isinstance(message, str):
@@ -0,0 +1,289 @@
+#coding=utf-8
+"""
+实时日志模块 - 以JSON Lines追加方式记录模拟过程，并可按需重建完整日志结构
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+try:
+    from common import json_codec
+except ImportError:
+    # 直接导入本模块时，添加项目根目录到路径
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from common import json_codec
+
+# fsync策略
+FSYNC_ALWAYS = "always"      # 每条记录都flush并fsync，最安全但最慢
+FSYNC_INTERVAL = "interval"  # 按时间间隔fsync，兼顾安全与性能
+FSYNC_NEVER = "never"        # 只依赖缓冲区，关闭时才落盘
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+# 同一路径共享一个写入器，避免多个文件句柄交错写入
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class RealtimeLogWriter:
+    """实时日志写入器，每个事件追加一行JSON记录"""
+
+    def __init__(self, path, fsync_policy=FSYNC_INTERVAL, fsync_interval=5.0, buffer_size=64 * 1024):
+        """初始化实时日志写入器
+
+        Args:
+            path (str): 日志文件路径(.jsonl)
+            fsync_policy (str): fsync策略，always/interval/never
+            fsync_interval (float): interval策略下两次fsync的最小间隔(秒)
+            buffer_size (int): 写缓冲区大小(字节)
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            logging.warning(f"未知的fsync策略 '{fsync_policy}'，使用 {FSYNC_INTERVAL}")
+            fsync_policy = FSYNC_INTERVAL
+
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.last_sync_time = time.time()
+        self.records_written = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8", buffering=buffer_size)
+
+    def write_event(self, event, raw_fields=None, **fields):
+        """追加一条事件记录
+
+        Args:
+            event (str): 事件类型，如 start/day/brand_info/summary/message
+            raw_fields (dict): 已序列化为JSON字符串的字段，原样拼入记录，避免重复序列化
+            **fields: 事件数据
+
+        Returns:
+            bool: 是否写入成功
+        """
+        record = {
+            "event": event,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        record.update(fields)
+
+        try:
+            line = json_codec.dumps(record, default=str)
+            if raw_fields:
+                # record至少包含event和timestamp，在结尾的"}"前追加已序列化的字段
+                line = line[:-1] + "".join(
+                    f",{json_codec.dumps(str(name))}:{value}" for name, value in raw_fields.items()
+                ) + "}"
+        except (TypeError, ValueError) as e:
+            logging.error(f"序列化实时日志记录失败 ({event}): {e}")
+            return False
+
+        with self.lock:
+            if self.file is None:
+                logging.error(f"实时日志已关闭，无法写入: {self.path}")
+                return False
+            try:
+                self.file.write(line + "\n")
+                self.records_written += 1
+                self._sync_if_needed()
+                return True
+            except (IOError, OSError) as e:
+                logging.error(f"写入实时日志失败 ({event}): {e}")
+                return False
+
+    def _sync_if_needed(self):
+        """根据fsync策略决定是否落盘(调用方需持有锁)"""
+        if self.fsync_policy == FSYNC_NEVER:
+            return
+        now = time.time()
+        if self.fsync_policy == FSYNC_ALWAYS or now - self.last_sync_time >= self.fsync_interval:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.last_sync_time = now
+
+    def log_start(self, start_time):
+        """记录模拟开始"""
+        return self.write_event("start", simulation_start_time=start_time)
+
+    def log_day(self, day, data=None, **extra):
+        """记录某一天的模拟数据
+
+        同一天的多条记录在重建时会合并为一条，因此可以只写入增量字段。
+        """
+        fields = {"day": day}
+        if data is not None:
+            fields["data"] = data
+        fields.update(extra)
+        return self.write_event("day", **fields)
+
+    def log_brand_info(self, brand_info):
+        """记录品牌信息"""
+        return self.write_event("brand_info", data=brand_info)
+
+    def log_summary(self, summary, product_metrics=None):
+        """记录模拟总结和产品指标"""
+        fields = {"data": summary}
+        if product_metrics is not None:
+            fields["product_metrics"] = product_metrics
+        return self.write_event("summary", **fields)
+
+    def log_simulation_complete(self, completion):
+        """记录发送给客户端的模拟完成消息"""
+        return self.write_event("simulation_complete", data=completion)
+
+    def log_message(self, message, direction="outgoing", payload=None):
+        """记录收发的消息
+
+        Args:
+            message: 消息内容
+            direction (str): outgoing/incoming
+            payload (str): 发送方已序列化好的消息JSON，提供时直接复用
+        """
+        if payload is not None:
+            return self.write_event("message", raw_fields={"message": payload}, direction=direction)
+        return self.write_event("message", direction=direction, message=message)
+
+    def flush(self, sync=True):
+        """将缓冲区写入磁盘"""
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+                self.last_sync_time = time.time()
+
+    def close(self):
+        """关闭写入器"""
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            finally:
+                self.file.close()
+                self.file = None
+        with _writers_lock:
+            if _writers.get(os.path.abspath(self.path)) is self:
+                del _writers[os.path.abspath(self.path)]
+
+
+def get_realtime_log_writer(path, fsync_policy=FSYNC_INTERVAL, fsync_interval=5.0):
+    """获取指定路径的共享写入器，不存在时创建
+
+    主循环、SocketManager和WebSocket服务器写同一个文件时共用一个句柄和锁。
+    首次创建时的fsync参数生效。
+    """
+    key = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None or writer.file is None:
+            writer = RealtimeLogWriter(path, fsync_policy, fsync_interval)
+            _writers[key] = writer
+        return writer
+
+
+def close_all_writers():
+    """关闭所有共享写入器"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            logging.error(f"关闭实时日志写入器时出错: {e}")
+
+
+def load_realtime_log(path):
+    """读取实时日志并重建为完整的日志结构
+
+    兼容旧版整文件JSON格式；JSON Lines格式中最后一行不完整(写入中断)时会被跳过。
+
+    Args:
+        path (str): 日志文件路径
+
+    Returns:
+        dict: {"simulation_start_time", "days", "brand_info", "simulation_summary", ...}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if not path.endswith(".jsonl"):
+            return json.load(f)
+
+        log_data = {"days": []}
+        day_index = {}
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json_codec.loads(line)
+            except json_codec.JSONDecodeError as e:
+                logging.warning(f"跳过无法解析的实时日志行 {path}:{line_no}: {e}")
+                continue
+            _apply_record(log_data, day_index, record)
+
+    return log_data
+
+
+def _apply_record(log_data, day_index, record):
+    """将一条事件记录合并到日志结构中"""
+    event = record.pop("event", None)
+    timestamp = record.get("timestamp")
+
+    if event == "start":
+        log_data["simulation_start_time"] = record.get("simulation_start_time")
+    elif event == "day":
+        day = record.get("day")
+        if day in day_index:
+            # 同一天的记录合并为一条
+            log_data["days"][day_index[day]].update(record)
+        else:
+            day_index[day] = len(log_data["days"])
+            log_data["days"].append(record)
+    elif event == "brand_info":
+        log_data["brand_info"] = record.get("data")
+    elif event == "summary":
+        log_data["simulation_summary"] = record.get("data")
+        if "product_metrics" in record:
+            log_data["product_metrics"] = record["product_metrics"]
+    elif event == "simulation_complete":
+        completion = dict(record.get("data") or {})
+        completion.setdefault("timestamp", timestamp)
+        log_data["simulation_complete"] = completion
+    elif event == "message":
+        log_data.setdefault("messages", []).append({
+            "timestamp": timestamp,
+            "direction": record.get("direction", "outgoing"),
+            "message": record.get("message")
+        })
+    else:
+        logging.warning(f"未知的实时日志事件类型: {event}")
+
+
+def compact_realtime_log(path, output_path=None):
+    """将JSON Lines实时日志压缩为单个JSON文件，供仪表盘和旧工具读取
+
+    Args:
+        path (str): 实时日志路径(.jsonl)
+        output_path (str): 输出路径，默认将扩展名替换为.json
+
+    Returns:
+        str: 输出文件路径
+    """
+    log_data = load_realtime_log(path)
+    if output_path is None:
+        output_path = os.path.splitext(path)[0] + ".json"
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(log_data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, output_path)
+    logging.info(f"实时日志已压缩到: {output_path}")
+    return output_path
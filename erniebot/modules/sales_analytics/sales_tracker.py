@@ -42,8 +42,8 @@ class SalesTracker:
         self.points_earned_total = 0  # 总获取积分数
         self.points_used_total = 0  # 总使用积分数
         
-        # 为分析器提供常量
-        self.PRODUCT_COSTS = PRODUCT_COSTS
+        # 为分析器提供常量；产品成本每个跟踪器一份，新生成的产品只加入本次模拟
+        self.PRODUCT_COSTS = dict(PRODUCT_COSTS)
         self.SEASONS = SEASONS
         self.SEASONAL_PREFERENCES = SEASONAL_PREFERENCES
         self.CONSUMER_SEASONAL_PREFERENCES = CONSUMER_SEASONAL_PREFERENCES
@@ -180,7 +180,7 @@ class SalesTracker:
             self.daily_revenue_by_product[product].append(revenue)
             
         # 为没有销售的产品添加0记录，保证数据连续性
-        for product in PRODUCT_COSTS.keys():
+        for product in self.PRODUCT_COSTS.keys():
             if product not in daily_product_sales:
                 self.daily_sales_by_product[product].append(0)
             if product not in daily_product_revenue:
@@ -312,7 +312,7 @@ class SalesTracker:
         total_initial_stock = 0
         
         for product, initial_stock in self.product_stock.items():
-            initial = PRODUCT_COSTS.get(product, {}).get('initial_stock', 0)
+            initial = self.PRODUCT_COSTS.get(product, {}).get('initial_stock', 0)
             current = self.product_stock.get(product, 0)
             total_initial_stock += initial
             total_stock_used += (initial - current)
@@ -0,0 +1,266 @@
+#coding=utf-8
+"""
+模拟运行模块 - 执行单个品牌的30天消费者行为模拟
+"""
+
+import time
+import logging
+
+from .data_processor import string_to_dict, check_completed, clean_emoji_field, verify_and_fix_json
+
+
+def run_simulation_days(question, api_client, sales_tracker, db_manager, socket_manager, realtime_log,
+                        all_simulation_data, brand_name_for_simulation=None, job_id=None, progress_callback=None,
+                        run_id=None):
+    """基于产品描述逐天模拟消费者行为，直到完成30天
+
+    对话历史保存在传入的api_client中，因此每个模拟任务使用独立的ApiClient即可互不干扰。
+
+    Args:
+        question (str): 产品描述，作为第一天的模拟输入
+        api_client (ApiClient): 持有本次模拟对话状态的客户端
+        sales_tracker (SalesTracker): 本次模拟的销售追踪器
+        db_manager (DBManager): 数据库管理器
+        socket_manager (SocketManager): 向客户端推送数据的Socket管理器
+        realtime_log (RealtimeLogWriter): 实时日志写入器
+        all_simulation_data (list): 用于生成总结的模拟数据列表，每天的数据会追加到其中
+        brand_name_for_simulation (str): 品牌名称，用于计算产品指标
+        job_id (str): 并发模拟任务ID，单独模拟时为None
+        progress_callback (callable): 每完成一天后调用 progress_callback(day)
+        run_id (str): 数据库中的模拟运行ID，由 db_manager.start_run 生成，为None时写入默认运行
+
+    Returns:
+        tuple: (每天的模拟数据列表, 模拟总结或None)
+    """
+    logging.info("准备开始消费者行为模拟循环...")
+    prev_cumulative = None  # 存储上一天的累计数据
+    simulation_days = []  # 存储模拟数据
+    summary = None
+
+    for day in range(1, 31):  # 最多模拟30天
+        retry_count = 0 # Reset retry count for each day
+        max_api_retries = 3
+        
+        try:
+            if day == 1:
+                # 首次对话，发送品牌/店铺信息
+                logging.info("开始新的消费者行为模拟...")
+                # 提供消费者数据以增强模拟效果
+                consumer_data = {
+                    "include_region": True,
+                    "include_psychological_traits": True
+                }
+                # 使用生成提示词函数生成带有消费者画像信息的提示词
+                messages = api_client.generate_prompt(
+                    [{"role": "user", "content": question}], 
+                    consumer_data
+                )
+                logging.info(f"准备调用API模拟第{day}天的消费者行为 - 使用提示词：{question[:100]}...")
+                try:
+                    # 与后续天数一致，开启流式响应时逐位推送消费者
+                    response = api_client.chat_with_messages(
+                        messages,
+                        on_interaction=lambda customer, index, day=day: socket_manager.send_simulation_interaction(
+                            day, index, customer, job_id=job_id, run_id=run_id),
+                        on_abort=lambda dispatched, day=day: socket_manager.send_simulation_partial_abort(
+                            day, dispatched, job_id=job_id, run_id=run_id)
+                    )
+                    logging.info(f"成功获取第{day}天API响应，长度：{len(response) if response else 0}字符")
+                except Exception as api_err:
+                    logging.error(f"API调用异常: {str(api_err)}", exc_info=True)
+                    # 创建一个基本的默认响应
+                    response = f"API调用失败: {str(api_err)}"
+            else:
+                logging.info(f"第{day}天：请求模拟下一天消费者行为...")
+                # 增加更详细的日志记录和错误处理
+                try:
+                    # 开启流式响应时，每解析出一位消费者就立即推送给前端
+                    response = api_client.chat(
+                        "继续",
+                        on_interaction=lambda customer, index, day=day: socket_manager.send_simulation_interaction(
+                            day, index, customer, job_id=job_id, run_id=run_id),
+                        on_abort=lambda dispatched, day=day: socket_manager.send_simulation_partial_abort(
+                            day, dispatched, job_id=job_id, run_id=run_id)
+                    )
+                    logging.info(f"成功获取第{day}天API响应，长度：{len(response) if response else 0}字符")
+                except Exception as api_err:
+                    logging.error(f"API调用异常: {str(api_err)}", exc_info=True)
+                    response = f"API调用失败: {str(api_err)}"
+
+            logging.info(f"Day {day} API Response:\n{response[:200]}...") # Log API response (truncated)
+            json_text = api_client.extract_json(response)
+            json_data = None # Initialize json_data for the day
+            
+            retry_count = 0 # 明确重置重试计数器
+            while json_data is None and retry_count < max_api_retries:
+                if json_text:
+                    # Attempt to parse JSON
+                    json_data_attempt = string_to_dict(json_text)
+                    if json_data_attempt: # Check if parsing was successful
+                       json_data = json_data_attempt
+                       logging.info(f"Day {day}: Successfully extracted and parsed JSON.")
+                       break # Exit retry loop on success
+                    else:
+                       logging.warning(f"Day {day}: Failed to parse JSON from extracted text. Retry {retry_count+1}/{max_api_retries}.")
+                       json_text = None # Force retry logic
+                
+                if json_data is None: # If extraction failed or parsing failed
+                    logging.warning(f"Day {day}: Failed to extract/parse JSON. Retry {retry_count+1}/{max_api_retries}.")
+                    retry_count += 1
+                    if retry_count < max_api_retries:
+                        # 更详细的重试提示，明确指定格式
+                        retry_prompt = """请使用标准JSON格式生成消费者行为数据，必须包含以下结构：
+    {
+      "customer_interactions": [
+        {"name": "消费者1", "location": "入口", "comments": "查看商品", "emoji": "😊"},
+        {"name": "消费者2", "location": "茶台", "comments": "品尝产品", "emoji": "👍"}
+      ],
+      "daily_stats": {"visitors": 10, "revenue": 1000},
+      "day": 1
+    }
+    所有字段必须使用双引号，并用```json```标记包裹整个JSON。"""
+                        logging.info(f"Day {day}: Sending retry prompt: {retry_prompt}")
+                        # 增强重试逻辑中的错误处理
+                        try:
+                            response = api_client.chat(retry_prompt)
+                            logging.info(f"Day {day} API Retry Response:\n{response[:200]}...")
+                            json_text = api_client.extract_json(response)
+                        except Exception as retry_err:
+                            logging.error(f"重试API调用时出错: {str(retry_err)}", exc_info=True)
+                            # 在重试失败后继续循环，让外层逻辑处理
+                            time.sleep(8)  # 重试失败后等待8秒再继续
+                    else:
+                        logging.error(f"Day {day}: Max retries reached for API call.")
+                
+            # Fallback logic if json_data is still None after retries
+            if json_data is None:
+                logging.warning(f"Day {day}: Failed to get valid JSON after retries. Attempting fallback.")
+                if len(simulation_days) > 0: 
+                    logging.warning(f"Day {day}: Using previous day's data as fallback.")
+                    prev_day_data = simulation_days[-1].copy()
+                    json_data = prev_day_data.copy() 
+                    # 更新日期
+                    json_data['day'] = day 
+                    # 对fallback数据做轻微随机变化，避免完全重复数据
+                    if 'daily_stats' in json_data:
+                        import random
+                        # 对访客数量和收入做轻微调整，使数据看起来更自然
+                        for stat in ['customer_flow', 'total_sales', 'avg_expense']:
+                            if stat in json_data['daily_stats']:
+                                value = json_data['daily_stats'][stat]
+                                if isinstance(value, (int, float)):
+                                    # 在原值基础上上下浮动10%
+                                    variation = 0.9 + random.random() * 0.2  # 0.9 到 1.1之间
+                                    json_data['daily_stats'][stat] = int(value * variation)
+                    logging.info(f"Day {day}: Applied variation to fallback data.")
+                else:
+                    logging.error(f"Day {day}: No previous day data available. Generating default data.")
+                    json_data = verify_and_fix_json(None, day, prev_cumulative)
+            
+            # --- Processing valid json_data (either from API or fallback) --- 
+            
+            # 验证和修复JSON数据 (always run verify_and_fix)
+            json_data = verify_and_fix_json(json_data, day, prev_cumulative)
+            
+            # 处理表情符号
+            json_data = clean_emoji_field(json_data)
+            
+            # 记录销售数据用于分析
+            sales_tracker.record_daily_sales(
+                day, 
+                json_data.get('customer_interactions', []), 
+                json_data.get('daily_stats', {})
+            )
+            
+            # 保存当天的累计数据用于下一次迭代
+            prev_cumulative = json_data.get('cumulative_stats', {})
+            
+            # 保存本次数据
+            simulation_days.append(json_data.copy())
+            all_simulation_data.append(json_data.copy())
+            
+            # 保存数据到数据库
+            try:
+                logging.info(f"尝试将第 {day} 天的数据保存到数据库...")
+                save_success = db_manager.save_simulation_data(json_data, day, run_id)
+                if save_success:
+                    logging.info(f"第 {day} 天的数据已成功保存到数据库。")
+                else:
+                    logging.warning(f"第 {day} 天的数据保存到数据库失败。")
+            except Exception as db_err:
+                logging.error(f"保存数据到数据库时出错: {str(db_err)}")
+
+            # 发送模拟数据
+            socket_manager.send_simulation_data(day, json_data, job_id=job_id, run_id=run_id)
+            if progress_callback:
+                progress_callback(day)
+            
+            # 实时记录每天的模拟数据到日志文件
+            if realtime_log.log_day(day, json_data):
+                logging.info(f"已将第{day}天的模拟数据实时记录到日志文件")
+            else:
+                logging.error(f"实时记录第{day}天的模拟数据时出错")
+            
+            # 检查是否完成30天模拟
+            if check_completed(json_data) or day >= 30:
+                logging.info("已完成30天模拟，生成总结报告")
+                
+                # 生成模拟总结
+                summary = sales_tracker.generate_simulation_summary(all_simulation_data)
+                
+                # 计算产品爆款指数
+                if brand_name_for_simulation:
+                    product_metrics = sales_tracker.calculate_product_metrics(brand_name_for_simulation)
+                    popularity_score = product_metrics['popularity_score']
+                    
+                    # 添加地域分析和消费心理分析
+                    regional_analysis = sales_tracker.analyze_regional_distribution()
+                    psychological_analysis = sales_tracker.analyze_consumer_psychology()
+                    
+                    # 将分析结果添加到产品指标中
+                    product_metrics['regional_analysis'] = regional_analysis
+                    product_metrics['psychological_analysis'] = psychological_analysis
+                else:
+                    popularity_score = None
+                
+                # 添加总结数据到实时日志
+                if realtime_log.log_summary(summary, product_metrics if brand_name_for_simulation else None):
+                    logging.info("已将模拟总结记录到实时日志文件")
+                else:
+                    logging.error("记录模拟总结到实时日志文件时出错")
+                
+                # 发送模拟总结
+                socket_manager.send_simulation_summary(summary, prev_cumulative, popularity_score,
+                                                       job_id=job_id, run_id=run_id)
+                logging.info("模拟总结已发送")
+                
+                # 更新当天的销售统计
+                sales_tracker.update_from_simulation(json_data)
+                logging.info(f"第 {day} 天模拟处理完成")
+                break
+                
+        except Exception as e:
+            logging.error(f"Day {day} 处理主循环出错: {str(e)}", exc_info=True)
+            if len(simulation_days) > 0:
+                json_data = simulation_days[-1].copy()
+                json_data['day'] = day
+            else:
+                json_data = verify_and_fix_json(None, day, prev_cumulative)
+            
+            # 发送错误恢复的数据
+            socket_manager.send_simulation_data(day, json_data, job_id=job_id, run_id=run_id)
+            if progress_callback:
+                progress_callback(day)
+            
+            # 保存用于下一天
+            simulation_days.append(json_data.copy())
+            all_simulation_data.append(json_data.copy())
+            
+            # 记录错误恢复的数据到实时日志
+            if realtime_log.log_day(day, json_data, error_recovery=True, error=str(e)):
+                logging.info(f"已将第{day}天的错误恢复数据实时记录到日志文件")
+            else:
+                logging.error(f"实时记录第{day}天的错误恢复数据时出错")
+    
+    logging.info("消费者行为模拟完成")
+    return simulation_days, summary
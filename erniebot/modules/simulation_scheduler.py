@@ -0,0 +1,278 @@
+#coding=utf-8
+"""
+模拟调度模块 - 并发运行多个品牌/消费群体的模拟任务
+
+每个任务拥有独立的ApiClient(对话历史)、SalesTracker和实时日志，
+所有任务共享一个限制了同时进行中请求数的ApiConnector，
+进度通过SocketManager以jobProgress事件推送给客户端。
+"""
+
+import os
+import time
+import uuid
+import random
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from config_integration import (MODEL_API_KEY as API_KEY, BASE_URL, MODEL_NAME,
+                                SIMULATION_MAX_JOBS, LLM_MAX_INFLIGHT,
+                                REALTIME_LOG_FSYNC, REALTIME_LOG_FSYNC_INTERVAL)
+
+from .client import ApiClient, ApiConnector
+from .product_manager import extract_brand_summary, save_brand_info_to_file
+from .realtime_log import get_realtime_log_writer
+from .sales_analytics import SalesTracker
+from .simulation_runner import run_simulation_days
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_GENERATING = "generating"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class SimulationJob:
+    """单个模拟任务"""
+
+    def __init__(self, job_id, target_consumers=None, question=None, brand_name=None, batch_id=None):
+        """初始化模拟任务
+
+        Args:
+            job_id (str): 任务ID
+            target_consumers (str): 目标消费群体，未提供question时据此生成产品
+            question (str): 产品描述，提供时跳过产品生成直接模拟
+            brand_name (str): 品牌名称
+            batch_id (str): 所属批次ID
+        """
+        self.job_id = job_id
+        self.batch_id = batch_id
+        self.target_consumers = target_consumers
+        self.question = question
+        self.brand_name = brand_name
+        self.status = JOB_QUEUED
+        self.current_day = 0
+        self.summary = None
+        self.error = None
+        self.log_path = None
+        self.run_id = None  # 数据库中的模拟运行ID，开始模拟时登记
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        """转换为可发送给客户端的字典"""
+        return {
+            "jobId": self.job_id,
+            "batchId": self.batch_id,
+            "targetConsumers": self.target_consumers,
+            "brandName": self.brand_name,
+            "runId": self.run_id,
+            "status": self.status,
+            "day": self.current_day,
+            "error": self.error,
+            "duration": round((self.finished_at or time.time()) - self.started_at, 2) if self.started_at else None,
+        }
+
+
+class SimulationScheduler:
+    """并发模拟调度器"""
+
+    def __init__(self, socket_manager, db_manager, log_dir, max_jobs=SIMULATION_MAX_JOBS,
+                 max_inflight_requests=LLM_MAX_INFLIGHT):
+        """初始化调度器
+
+        Args:
+            socket_manager (SocketManager): 用于推送进度和模拟数据
+            db_manager (DBManager): 所有任务共享的数据库管理器(连接池)
+            log_dir (str): 各任务实时日志所在目录
+            max_jobs (int): 同时运行的任务数
+            max_inflight_requests (int): 所有任务共享的同时进行中的LLM请求数
+        """
+        self.socket_manager = socket_manager
+        self.db_manager = db_manager
+        self.log_dir = log_dir
+        self.max_jobs = max(1, int(max_jobs))
+
+        # 共享连接器，限制全局同时进行中的请求数；对话历史由每个任务的ApiClient各自保存
+        self.connector = ApiConnector(API_KEY, BASE_URL, MODEL_NAME,
+                                      max_concurrent_requests=max_inflight_requests)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="simulation-job")
+
+        self.jobs = {}
+        self.batches = {}  # batch_id -> [job_id, ...]
+        self.lock = threading.Lock()
+
+        logging.info(f"模拟调度器初始化: 最大并发任务数={self.max_jobs}, 最大并发请求数={max_inflight_requests}")
+
+    def submit(self, target_consumers=None, question=None, brand_name=None, batch_id=None):
+        """提交一个模拟任务
+
+        Returns:
+            SimulationJob: 已提交的任务
+        """
+        job = SimulationJob(uuid.uuid4().hex[:8], target_consumers, question, brand_name, batch_id)
+        with self.lock:
+            self.jobs[job.job_id] = job
+            if batch_id:
+                self.batches.setdefault(batch_id, []).append(job.job_id)
+
+        self.socket_manager.send_job_progress(job.job_id, JOB_QUEUED, **self._job_fields(job))
+        self.executor.submit(self._run_job, job)
+        return job
+
+    def submit_batch(self, segments):
+        """为多个目标消费群体各提交一个任务
+
+        Args:
+            segments (list): 目标消费群体列表
+
+        Returns:
+            tuple: (批次ID, 任务列表)
+        """
+        batch_id = datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:4]
+        jobs = [self.submit(target_consumers=segment, batch_id=batch_id) for segment in segments]
+        logging.info(f"已提交批量模拟 {batch_id}，共 {len(jobs)} 个任务")
+        return batch_id, jobs
+
+    def get_status(self, batch_id=None):
+        """获取任务状态列表
+
+        Args:
+            batch_id (str): 只返回指定批次的任务，为None时返回全部
+
+        Returns:
+            list: 任务状态字典列表
+        """
+        with self.lock:
+            if batch_id is None:
+                jobs = list(self.jobs.values())
+            else:
+                jobs = [self.jobs[job_id] for job_id in self.batches.get(batch_id, [])]
+        return [job.to_dict() for job in jobs]
+
+    def shutdown(self, wait=False):
+        """关闭调度器，未开始的任务将被取消"""
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _job_fields(self, job):
+        """进度事件中附带的任务信息"""
+        return {
+            "batchId": job.batch_id,
+            "targetConsumers": job.target_consumers,
+            "brandName": job.brand_name,
+            "runId": job.run_id,
+        }
+
+    def _set_status(self, job, status, **fields):
+        """更新任务状态并推送进度事件"""
+        job.status = status
+        self.socket_manager.send_job_progress(job.job_id, status, **self._job_fields(job), **fields)
+
+    def _run_job(self, job):
+        """在工作线程中运行一个模拟任务"""
+        job.started_at = time.time()
+        api_client = ApiClient(connector=self.connector)
+        sales_tracker = SalesTracker()
+        realtime_log = None
+
+        try:
+            # 每个任务单独一个实时日志文件
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            job.log_path = os.path.join(self.log_dir, f"realtime_simulation_log_{timestamp}_{job.job_id}.jsonl")
+            realtime_log = get_realtime_log_writer(job.log_path, REALTIME_LOG_FSYNC, REALTIME_LOG_FSYNC_INTERVAL)
+            realtime_log.log_start(timestamp)
+            self.socket_manager.set_realtime_log_path(job.log_path, job_id=job.job_id)
+
+            if not job.question:
+                self._set_status(job, JOB_GENERATING)
+                self._generate_product(job, api_client, sales_tracker, realtime_log)
+
+            sales_tracker.new_product_name = job.brand_name
+            self._set_status(job, JOB_RUNNING, day=0, totalDays=30)
+
+            def on_day(day):
+                job.current_day = day
+                self.socket_manager.send_job_progress(job.job_id, JOB_RUNNING, day=day, totalDays=30,
+                                                      **self._job_fields(job))
+
+            job.run_id = self.db_manager.start_run(job.brand_name)
+            _, job.summary = run_simulation_days(
+                job.question, api_client, sales_tracker, self.db_manager, self.socket_manager, realtime_log,
+                [], job.brand_name, job_id=job.job_id, progress_callback=on_day, run_id=job.run_id
+            )
+            self.db_manager.finish_run(job.run_id)
+            job.finished_at = time.time()
+            self._set_status(job, JOB_COMPLETED, day=job.current_day, totalDays=30,
+                             duration=round(job.finished_at - job.started_at, 2))
+            logging.info(f"模拟任务 {job.job_id} ({job.brand_name}) 完成，耗时 {job.finished_at - job.started_at:.2f} 秒")
+
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = time.time()
+            logging.error(f"模拟任务 {job.job_id} 出错: {e}", exc_info=True)
+            if job.run_id:
+                self.db_manager.finish_run(job.run_id, status="failed")
+            self._set_status(job, JOB_FAILED, error=job.error)
+
+        finally:
+            # 任务结束即释放日志文件句柄和路径记录，长时间运行的服务不随任务数累积
+            if realtime_log is not None:
+                realtime_log.close()
+            self.socket_manager.clear_realtime_log_path(job.job_id)
+            self._check_batch_complete(job.batch_id)
+
+    def _generate_product(self, job, api_client, sales_tracker, realtime_log):
+        """为任务的目标消费群体生成产品建议"""
+        brand_suggestion = api_client.generate_tea_product(job.target_consumers)
+        if not brand_suggestion or brand_suggestion.startswith("调用AI服务时出错"):
+            raise RuntimeError(f"生成产品建议失败: {brand_suggestion}")
+
+        brand_name, simple_description = extract_brand_summary(brand_suggestion)
+        save_brand_info_to_file(brand_suggestion, brand_name)
+
+        # 添加新产品到本任务的成本和库存数据中 (估算成本为定价的40%)，不修改其他任务共用的全局配置
+        estimated_price = random.randint(200, 500)
+        sales_tracker.PRODUCT_COSTS[brand_name] = {
+            "cost": int(estimated_price * 0.4),
+            "initial_stock": 200
+        }
+        sales_tracker.product_stock[brand_name] = 200
+
+        job.brand_name = brand_name
+        job.question = simple_description
+
+        realtime_log.log_brand_info({
+            "name": brand_name,
+            "description": simple_description,
+            "full_suggestion": brand_suggestion,
+            "target_consumers": job.target_consumers
+        })
+
+    def _check_batch_complete(self, batch_id):
+        """批次中所有任务结束后发送批次完成消息"""
+        if not batch_id:
+            return
+        with self.lock:
+            jobs = [self.jobs[job_id] for job_id in self.batches.get(batch_id, [])]
+        if any(job.status not in (JOB_COMPLETED, JOB_FAILED) for job in jobs):
+            return
+
+        with self.lock:
+            # 只发送一次
+            if self.batches.pop(batch_id, None) is None:
+                return
+
+        durations = [job.finished_at - job.started_at for job in jobs if job.started_at and job.finished_at]
+        self.socket_manager.send({
+            "resultType": "batchComplete",
+            "batchId": batch_id,
+            "jobs": [job.to_dict() for job in jobs],
+            "completed": sum(1 for job in jobs if job.status == JOB_COMPLETED),
+            "failed": sum(1 for job in jobs if job.status == JOB_FAILED),
+            "wallTime": round(max(job.finished_at for job in jobs) - min(job.created_at for job in jobs), 2),
+            "sumOfDurations": round(sum(durations), 2),
+        })
+        logging.info(f"批量模拟 {batch_id} 完成")
@@ -3,15 +3,21 @@
 Socket通信管理模块 - 负责与Socket客户端的通信
 """
 
-import json
 import time
 import os
-from datetime import datetime
 import sys
+import threading
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from socketplus import socketclient
+try:
+    from common import json_codec
+except ImportError:
+    # 添加项目根目录到路径
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from common import json_codec
 import logging
 from .config import VALID_LOCATIONS  # 导入config中定义的场所
+from .realtime_log import get_realtime_log_writer
 
 class SocketManager:
     """Socket通信管理类"""
@@ -29,6 +35,8 @@ class SocketManager:
         self.max_retries = 3
         self.connected = False
         self.realtime_log_path = None
+        self.job_log_paths = {}  # 并发模拟任务ID -> 实时日志路径
+        self.send_lock = threading.Lock()  # 多个模拟任务线程共用同一个连接发送
         logging.info(f"SocketManager初始化: {self.host}:{self.port}")
         
     def initialize(self):
@@ -67,32 +75,66 @@ class SocketManager:
             return False
             
         try:
-            return self.socket_client.send(data)
+            with self.send_lock:
+                return self.socket_client.send(data)
         except Exception as e:
             logging.error(f"发送数据失败: {e}")
             return False
             
-    def receive(self):
-        """从客户端接收数据
+    def receive(self, timeout=None):
+        """从客户端接收数据，没有消息时阻塞等待，消息到达后立即返回
         
+        Args:
+            timeout (float): 最长等待秒数，None表示一直等到有消息
+            
         Returns:
-            object: 接收到的数据,或者False表示接收失败
+            object: 接收到的数据,或者False表示超时或接收失败
         """
         if self.socket_client is None:
             logging.error("尚未初始化Socket连接")
             return False
             
+        started = time.monotonic()
         try:
-            return self.socket_client.recv()
+            data = self.socket_client.recv(timeout)
         except Exception as e:
             logging.error(f"接收数据失败: {e}")
-            return False
+            data = False
+        
+        if data is False and timeout:
+            # 连接断开等错误会立即返回，等满超时时间再返回，避免调用方空转
+            remaining = timeout - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+        return data
     
-    def set_realtime_log_path(self, path):
-        """设置实时日志路径"""
-        self.realtime_log_path = path
+    def set_realtime_log_path(self, path, job_id=None):
+        """设置实时日志路径
+        
+        Args:
+            path (str): 实时日志路径
+            job_id (str): 并发模拟任务ID，为None时设置主日志路径
+        """
+        if job_id is None:
+            self.realtime_log_path = path
+        else:
+            self.job_log_paths[job_id] = path
         print(f"已设置实时日志文件路径: {path}")
         return True
+    
+    def clear_realtime_log_path(self, job_id):
+        """任务结束后移除该任务的实时日志路径
+        
+        Args:
+            job_id (str): 并发模拟任务ID
+        """
+        self.job_log_paths.pop(job_id, None)
+    
+    def _get_realtime_log_path(self, job_id=None):
+        """获取主日志或指定任务的实时日志路径"""
+        if job_id is None:
+            return self.realtime_log_path
+        return self.job_log_paths.get(job_id)
             
     def send_product_generated_message(self):
         """发送产品生成成功的消息"""
@@ -102,8 +144,15 @@ class SocketManager:
         }
         return self.send(result)
     
-    def send_simulation_data(self, day, json_data):
-        """发送模拟数据到客户端并选择性地写入实时日志"""
+    def send_simulation_data(self, day, json_data, job_id=None, run_id=None):
+        """发送模拟数据到客户端并选择性地写入实时日志
+        
+        Args:
+            day (int): 模拟天数
+            json_data (dict): 当天的模拟数据
+            job_id (str): 并发模拟任务ID，客户端据此区分不同任务的数据
+            run_id (str): 数据库中的模拟运行ID，客户端可按运行订阅
+        """
         # 创建一个干净的数据结构
         result_data = {
             'resultType': 'task',
@@ -112,13 +161,13 @@ class SocketManager:
             'time': 30,                    # 总天数
             'tasks': []                    # 任务列表
         }
+        if job_id is not None:
+            result_data['jobId'] = job_id
+        if run_id is not None:
+            result_data['runId'] = run_id
         
         # 详细记录输入的JSON数据
-        logging.info(f"Day {day}: 发送模拟数据, 原始JSON数据: {json.dumps(json_data, ensure_ascii=False)}")
-        
-        # 使用config.py中定义的有效位置名称
-        # 如果位置不匹配，使用默认位置
-        default_location = VALID_LOCATIONS[0] if VALID_LOCATIONS else "茶艺体验区"
+        logging.info(f"Day {day}: 发送模拟数据, 原始JSON数据: {json_codec.dumps(json_data)}")
         
         # 打印所有有效位置，便于调试
         logging.info(f"有效的位置名称: {VALID_LOCATIONS}")
@@ -127,71 +176,107 @@ class SocketManager:
         if 'customer_interactions' in json_data:
             logging.info(f"Day {day}: 找到 {len(json_data['customer_interactions'])} 个消费者交互数据")
             for customer in json_data['customer_interactions']:
-                if 'location' in customer:
-                    # 检查location是否有效，如果无效则使用默认位置
-                    if customer['location'] not in VALID_LOCATIONS:
-                        logging.warning(f"Day {day}: 位置 '{customer['location']}' 无效，使用默认位置 '{default_location}'")
-                        customer['location'] = default_location
-                    
-                    # 添加任务（包含名称、位置映射等信息）
-                    task = {
-                        'name': customer.get('name', ''),
-                        'position': customer.get('location', ''), # 当前位置
-                        'to': customer.get('location', ''),       # 目标位置（与location相同）
-                        'do_': customer.get('comments', '无'),     # 动作描述
-                        'emoji': customer.get('emoji', '👍')       # 表情
-                    }
+                task = self._build_task(customer, day)
+                if task is not None:
                     result_data['tasks'].append(task)
-                    logging.info(f"Day {day}: 添加消费者任务 - 名称: {task['name']}, 位置: {task['position']}, 目标: {task['to']}")
-                else:
-                    logging.warning(f"Day {day}: 消费者数据缺少location字段: {json.dumps(customer, ensure_ascii=False)}")
         else:
             logging.error(f"Day {day}: JSON数据缺少customer_interactions字段")
         
         # 记录要发送的数据
-        logging.info(f"Day {day}: 即将发送任务数据: {json.dumps(result_data, ensure_ascii=False)}")
+        logging.info(f"Day {day}: 即将发送任务数据: {json_codec.dumps(result_data)}")
         
-        # 记录数据到实时日志文件(如果已设置)
-        if self.realtime_log_path and os.path.exists(self.realtime_log_path):
-            try:
-                # 读取当前日志
-                with open(self.realtime_log_path, "r", encoding="utf-8") as f:
-                    realtime_log = json.load(f)
-                
-                # 添加当天数据
-                day_data = {
-                    "day": day,
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "data": json_data,
-                    "sent_to_client": True
-                }
-                
-                # 检查是否已存在该天的数据，如果存在则更新
-                day_exists = False
-                for i, existing_day in enumerate(realtime_log.get("days", [])):
-                    if existing_day.get("day") == day:
-                        realtime_log["days"][i] = day_data
-                        day_exists = True
-                        break
-                
-                if not day_exists:
-                    # 如果不存在该天的数据，则添加
-                    if "days" not in realtime_log:
-                        realtime_log["days"] = []
-                    realtime_log["days"].append(day_data)
-                
-                # 写回文件
-                with open(self.realtime_log_path, "w", encoding="utf-8") as f:
-                    json.dump(realtime_log, f, ensure_ascii=False, indent=2)
-                
+        # 记录发送状态到实时日志文件(如果已设置)
+        # 当天的完整数据由主循环写入，这里只追加发送标记，重建日志时按天合并
+        realtime_log_path = self._get_realtime_log_path(job_id)
+        if realtime_log_path:
+            if get_realtime_log_writer(realtime_log_path).log_day(day, sent_to_client=True):
                 print(f"已将第{day}天的模拟数据实时记录到日志文件")
-            except Exception as e:
-                print(f"实时记录第{day}天的模拟数据时出错: {str(e)}")
+            else:
+                print(f"实时记录第{day}天的模拟数据时出错")
         
         # 不再合并原始json_data，仅发送Unity需要的数据
         return self.send(result_data)
     
-    def send_simulation_summary(self, summary, prev_cumulative, popularity_score=None):
+    def _build_task(self, customer, day):
+        """将一条消费者交互转换为Unity导航任务，缺少location字段时返回None"""
+        if 'location' not in customer:
+            logging.warning(f"Day {day}: 消费者数据缺少location字段: {json_codec.dumps(customer)}")
+            return None
+        
+        # 使用config.py中定义的有效位置名称
+        # 如果位置不匹配，使用默认位置
+        default_location = VALID_LOCATIONS[0] if VALID_LOCATIONS else "茶艺体验区"
+        if customer['location'] not in VALID_LOCATIONS:
+            logging.warning(f"Day {day}: 位置 '{customer['location']}' 无效，使用默认位置 '{default_location}'")
+            customer['location'] = default_location
+        
+        # 添加任务（包含名称、位置映射等信息）
+        task = {
+            'name': customer.get('name', ''),
+            'position': customer.get('location', ''), # 当前位置
+            'to': customer.get('location', ''),       # 目标位置（与location相同）
+            'do_': customer.get('comments', '无'),     # 动作描述
+            'emoji': customer.get('emoji', '👍')       # 表情
+        }
+        logging.info(f"Day {day}: 添加消费者任务 - 名称: {task['name']}, 位置: {task['position']}, 目标: {task['to']}")
+        return task
+    
+    def send_simulation_interaction(self, day, index, customer, job_id=None, run_id=None):
+        """流式模拟时逐条推送消费者，不必等待当天的完整结果
+        
+        当天结果完整后仍会通过send_simulation_data发送完整的任务列表，
+        客户端可按name去重。流式中途失败时会先发送taskPartialAbort，
+        客户端应丢弃当天已收到的taskPartial条目。
+        
+        Args:
+            day (int): 模拟天数
+            index (int): 消费者在当天交互列表中的序号
+            customer (dict): 一条customer_interactions条目
+            job_id (str): 并发模拟任务ID
+            run_id (str): 数据库中的模拟运行ID
+        """
+        task = self._build_task(customer, day)
+        if task is None:
+            return False
+        
+        result_data = {
+            'resultType': 'taskPartial',
+            'task': f"第{day}天消费者模拟",
+            'process': day,
+            'time': 30,
+            'index': index,
+            'tasks': [task]
+        }
+        if job_id is not None:
+            result_data['jobId'] = job_id
+        if run_id is not None:
+            result_data['runId'] = run_id
+        return self.send(result_data)
+    
+    def send_simulation_partial_abort(self, day, dispatched, job_id=None, run_id=None):
+        """通知客户端作废当天已推送的taskPartial条目
+        
+        流式响应中途失败后会改用另一次非流式调用的结果，之后按新结果重新推送。
+        
+        Args:
+            day (int): 模拟天数
+            dispatched (int): 已推送并需要作废的条目数
+            job_id (str): 并发模拟任务ID
+            run_id (str): 数据库中的模拟运行ID
+        """
+        result_data = {
+            'resultType': 'taskPartialAbort',
+            'task': f"第{day}天消费者模拟",
+            'process': day,
+            'discarded': dispatched
+        }
+        if job_id is not None:
+            result_data['jobId'] = job_id
+        if run_id is not None:
+            result_data['runId'] = run_id
+        return self.send(result_data)
+    
+    def send_simulation_summary(self, summary, prev_cumulative, popularity_score=None, job_id=None, run_id=None):
         """发送模拟总结到客户端"""
         result = {
             'resultType': 'simulationComplete',
@@ -202,33 +287,43 @@ class SocketManager:
             'loyalCustomers': prev_cumulative.get('loyal_customers', 0),
             'productPopularityScore': popularity_score,
         }
+        if job_id is not None:
+            result['jobId'] = job_id
+        if run_id is not None:
+            result['runId'] = run_id
         
         # 记录总结到实时日志文件(如果已设置)
-        if self.realtime_log_path and os.path.exists(self.realtime_log_path):
-            try:
-                # 读取当前日志
-                with open(self.realtime_log_path, "r", encoding="utf-8") as f:
-                    realtime_log = json.load(f)
-                
-                # 添加总结数据
-                realtime_log["simulation_complete"] = {
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "summary": summary,
-                    "totalDays": 30,
-                    "totalCustomers": prev_cumulative.get('total_customers', 0),
-                    "totalRevenue": prev_cumulative.get('total_revenue', 0),
-                    "loyalCustomers": prev_cumulative.get('loyal_customers', 0),
-                    "productPopularityScore": popularity_score,
-                }
-                
-                # 写回文件
-                with open(self.realtime_log_path, "w", encoding="utf-8") as f:
-                    json.dump(realtime_log, f, ensure_ascii=False, indent=2)
-                
+        realtime_log_path = self._get_realtime_log_path(job_id)
+        if realtime_log_path:
+            completion = {
+                "summary": summary,
+                "totalDays": 30,
+                "totalCustomers": prev_cumulative.get('total_customers', 0),
+                "totalRevenue": prev_cumulative.get('total_revenue', 0),
+                "loyalCustomers": prev_cumulative.get('loyal_customers', 0),
+                "productPopularityScore": popularity_score,
+            }
+            if get_realtime_log_writer(realtime_log_path).log_simulation_complete(completion):
                 print("已将模拟总结记录到实时日志文件")
-            except Exception as e:
-                print(f"记录模拟总结到实时日志文件时出错: {str(e)}")
+            else:
+                print("记录模拟总结到实时日志文件时出错")
+        
+        return self.send(result)
+    
+    def send_job_progress(self, job_id, status, **fields):
+        """发送并发模拟任务的进度事件
         
+        Args:
+            job_id (str): 任务ID
+            status (str): 任务状态，如 queued/generating/running/completed/failed
+            **fields: 其他进度信息，如 day、brandName、error
+        """
+        result = {
+            'resultType': 'jobProgress',
+            'jobId': job_id,
+            'status': status,
+        }
+        result.update(fields)
         return self.send(result)
         
     def wait_for_continue(self):
@@ -238,14 +333,13 @@ class SocketManager:
         max_retries = 10  # 最多等待10次
         
         while retries < max_retries:
-            recv_data = self.receive()
+            recv_data = self.receive(timeout=1)  # 最多等待1秒
             if recv_data == False:
                 retries += 1
                 print(f"等待确认失败，尝试重新接收 ({retries}/{max_retries})")
                 if retries >= max_retries:
                     print("等待确认超过最大尝试次数，自动继续")
                     return True
-                time.sleep(1)  # 等待1秒后重试
                 continue
                 
             try:
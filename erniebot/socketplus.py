@@ -1,9 +1,19 @@
-import json
 import socket
+import select
+import time
 import os
 import sys
 import logging
 
+try:
+    from common import json_codec
+    from common.framing import FrameDecoder, FrameError, encode_frame, FRAMING_RAW, SUPPORTED_FRAMINGS
+except ImportError:
+    # 从erniebot目录直接运行时，添加项目根目录到路径
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from common import json_codec
+    from common.framing import FrameDecoder, FrameError, encode_frame, FRAMING_RAW, SUPPORTED_FRAMINGS
+
 # 检查是否在WebGL环境下运行
 WEB_MODE = os.environ.get('WEB_MODE', 'False').lower() == 'true'
 
@@ -21,6 +31,9 @@ class socketclient():
     def __init__(self,host,port):
         self.host = host
         self.port = port
+        # 接收缓冲区和发送帧格式，客户端握手时可协商为length/ndjson，默认兼容旧客户端
+        self.decoder = FrameDecoder()
+        self.framing = FRAMING_RAW
         
         # 如果是Web模式，使用WebSocket适配器
         if WEB_MODE:
@@ -59,8 +72,7 @@ class socketclient():
         
         # 标准Socket模式
         try:
-            data = json.dumps(data,ensure_ascii=False,indent=4)
-            self.conn.sendall(data.encode())
+            self.conn.sendall(encode_frame(json_codec.dumpb(data), self.framing))
             return True
         except (BrokenPipeError, ConnectionResetError) as e:
             print(f"连接已断开: {e}")
@@ -70,26 +82,55 @@ class socketclient():
             print(f"发送数据时出错: {e}")
             return False
 
-    def recv(self):
+    def recv(self, timeout=None):
+        """接收一条消息，没有消息时阻塞等待
+        
+        Args:
+            timeout (float): 最长等待秒数，None表示一直等到有消息
+            
+        Returns:
+            解析后的消息，超时或出错时返回False
+        """
         # 如果是Web模式，使用WebSocket适配器
         if WEB_MODE:
             try:
-                return self.client.receive()
+                return self.client.receive(timeout)
             except Exception as e:
                 print(f"WebSocket接收失败: {e}")
                 return False
         
         # 标准Socket模式
+        # 用select等待数据，socket保持阻塞模式，send不受接收超时影响
+        deadline = None if timeout is None else time.monotonic() + timeout
         try:
-            data = self.conn.recv(1024)
-            if not data:
-                print("Received No return")
-                return False
-            if data:
-                data = json.loads(data)
+            while True:
+                frame = self.decoder.next_frame()
+                if frame is None:
+                    # 缓冲区中没有完整消息，继续接收
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not select.select([self.conn], [], [], remaining)[0]:
+                            # 超时前收到的不完整消息保留在缓冲区，下次继续接收
+                            return False
+                    if not self.decoder.read_from(self.conn):
+                        print("Received No return")
+                        return False
+                    continue
+                
+                if frame == b"ping":
+                    self.conn.sendall(encode_frame(b"pong", self.framing))
+                    continue
+                
+                data = json_codec.loads(frame)
+                if isinstance(data, dict) and 'client_type' in data and 'framing' in data:
+                    self._handshake(data)
+                    continue
                 print(data)
                 return data
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        except FrameError as e:
+            print(f"接收数据格式错误: {e}")
+            return False
+        except json_codec.JSONDecodeError as e:
             print(f"解析接收数据时出错: {e}")
             return False
         except (ConnectionResetError, BrokenPipeError) as e:
@@ -100,6 +141,24 @@ class socketclient():
             print(f"接收数据时出错: {e}")
             return False
     
+    def _handshake(self, data):
+        """处理客户端的帧格式协商，之后发送的消息按协商的格式封装"""
+        framing = data.get('framing')
+        if framing not in SUPPORTED_FRAMINGS:
+            self.conn.sendall(encode_frame(json_codec.dumpb({
+                "type": "error",
+                "message": f"不支持的帧格式: {framing}"
+            }), self.framing))
+            return
+        self.framing = framing
+        print(f"客户端 {data['client_type']} 使用帧格式: {framing}")
+        self.send({
+            "type": "connection_established",
+            "message": f"连接已建立 ({data['client_type']})",
+            "framing": framing,
+            "framings": list(SUPPORTED_FRAMINGS)
+        })
+    
     def close(self):
         """关闭socket连接"""
         # 如果是Web模式，使用WebSocket适配器
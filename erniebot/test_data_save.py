@@ -23,15 +23,19 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # 导入数据库管理器
 try:
     from modules.db_manager import DBManager
+    from modules.realtime_log import load_realtime_log
 except ImportError:
     # 如果直接运行此脚本，添加上级目录到路径，以便导入模块
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from modules.db_manager import DBManager
+    from modules.realtime_log import load_realtime_log
 
 def find_latest_log_file():
     """查找最新的日志文件"""
     base_dir = os.path.dirname(os.path.abspath(__file__))
+    # 同时查找JSON Lines格式(.jsonl)和旧版整文件格式(.json)的日志
     log_files = glob.glob(os.path.join(base_dir, 'realtime_simulation_log_*.json'))
+    log_files += glob.glob(os.path.join(base_dir, 'realtime_simulation_log_*.jsonl'))
     
     if not log_files:
         logging.error("未找到模拟日志文件，请先运行模拟生成数据")
@@ -51,10 +55,9 @@ def read_log_file(log_path):
         return None
     
     try:
-        with open(log_path, 'r', encoding='utf-8') as f:
-            log_data = json.load(f)
-            logging.info(f"成功读取日志文件: {len(log_data)} 个顶级键")
-            return log_data
+        log_data = load_realtime_log(log_path)
+        logging.info(f"成功读取日志文件: {len(log_data)} 个顶级键")
+        return log_data
     except Exception as e:
         logging.error(f"读取日志文件失败: {e}")
         return None
@@ -148,9 +151,11 @@ def clear_existing_data(db_manager, auto_confirm=False):
         if should_clear:
             logging.info("清空现有数据...")
             cursor.execute("DELETE FROM consumer_actions")
+            cursor.execute("DELETE FROM consumer_traits")
             cursor.execute("DELETE FROM daily_stats")
             cursor.execute("DELETE FROM consumers")
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='consumer_actions'")
+            db_manager.clear_rollups(cursor)
             conn.commit()
             logging.info("数据已清空")
             return True
@@ -205,6 +210,7 @@ def process_days_data(log_data, db_manager):
     # 使用集合记录已处理天数，避免重复处理
     processed_days = set()
     success_count = 0
+    batch = []
     
     for day_entry in days_data:
         day = day_entry.get('day', 0)
@@ -232,11 +238,11 @@ def process_days_data(log_data, db_manager):
             logging.warning(f"第 {day} 天没有consumers数据，创建空列表")
             adapted_data["consumers"] = []
         
-        # 保存到数据库
-        result = db_manager.save_simulation_data(adapted_data, day)
-        
-        if result:
-            success_count += 1
+        batch.append((day, adapted_data))
+    
+    # 所有天的数据在一个事务中批量写入数据库
+    if batch and db_manager.save_simulation_batch(batch):
+        success_count = len(batch)
     
     logging.info(f"成功处理 {success_count}/{len(processed_days)} 天的数据")
     return success_count > 0
@@ -355,7 +361,9 @@ def update_daily_stats(db_manager):
         # 从消费者行为数据中汇总统计信息
         cursor.execute('''
         SELECT 
-            date(timestamp) as date,
+            run_id,
+            day_of_simulation,
+            MIN(date(timestamp)) as date,
             COUNT(CASE WHEN purchase = 1 THEN 1 END) as order_count,
             SUM(CASE WHEN purchase = 1 THEN amount ELSE 0 END) as gmv,
             COUNT(DISTINCT customer_id) as user_count,
@@ -365,7 +373,7 @@ def update_daily_stats(db_manager):
             0 as cancelled_order_count,
             0 as return_count
         FROM consumer_actions
-        GROUP BY date(timestamp)
+        GROUP BY run_id, day_of_simulation
         ''')
         
         daily_stats = cursor.fetchall()
@@ -373,10 +381,12 @@ def update_daily_stats(db_manager):
         for stats in daily_stats:
             cursor.execute('''
             INSERT OR REPLACE INTO daily_stats (
-                date, order_count, gmv, user_count, new_user_count, returning_user_count,
+                run_id, day_of_simulation, date, order_count, gmv, user_count, new_user_count, returning_user_count,
                 avg_order_value, cancelled_order_count, return_count
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
+                stats["run_id"],
+                stats["day_of_simulation"],
                 stats["date"],
                 stats["order_count"],
                 stats["gmv"],
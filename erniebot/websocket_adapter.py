@@ -9,13 +9,12 @@ import json
 import logging
 import sys
 import os
-import time
-import concurrent.futures
 
 # 导入WebSocket服务器模块
 from websocket_server import (
     broadcast_message, 
     get_next_message, 
+    get_topic_stats,
     start_server,
     set_realtime_log_path
 )
@@ -33,22 +32,27 @@ class WebSocketAdapter:
         self.host = host
         self.port = port
         self.connected = False
-        self.message_buffer = asyncio.Queue()
         self.loop = None
         self.server_thread = None
         self.running = False
-        self.last_client_message = None
+        self.started = threading.Event()  # 服务器开始监听时设置
         
-    def initialize(self):
-        """初始化WebSocket服务器（在单独线程中运行）"""
+    def initialize(self, startup_timeout=10):
+        """初始化WebSocket服务器（在单独线程中运行）
+        
+        Args:
+            startup_timeout (float): 等待服务器开始监听的最长秒数
+        """
         try:
             # 启动服务器线程
             self.server_thread = threading.Thread(target=self._run_server_thread)
             self.server_thread.daemon = True
             self.server_thread.start()
             
-            # 等待服务器启动
-            time.sleep(1)
+            # 等待服务器开始监听，启动完成后立即返回
+            if not self.started.wait(timeout=startup_timeout):
+                logging.error(f"WebSocket服务器在 {startup_timeout} 秒内未能启动")
+                return False
             self.connected = True
             logging.info(f"WebSocket适配器初始化成功，服务器运行在 {self.host}:{self.port}")
             return True
@@ -63,12 +67,9 @@ class WebSocketAdapter:
             asyncio.set_event_loop(self.loop)
             self.running = True
             
-            # 添加消息处理任务
-            self.loop.create_task(self._message_processor())
-            
             # 启动WebSocket服务器并捕获异常
             try:
-                self.loop.run_until_complete(start_server())
+                self.loop.run_until_complete(start_server(on_started=self.started.set))
             except Exception as e:
                 logging.error(f"WebSocket服务器运行出错: {str(e)}")
                 # 即使有错误，也让主线程继续运行
@@ -83,27 +84,12 @@ class WebSocketAdapter:
             if self.loop and not self.loop.is_closed():
                 self.loop.close()
     
-    async def _message_processor(self):
-        """处理接收到的WebSocket消息，并放入缓冲区"""
-        while self.running:
-            try:
-                client, message = await get_next_message()
-                if client and message:
-                    logging.info(f"接收到WebSocket消息: {message}")
-                    # 保存最新的消息
-                    self.last_client_message = message
-                    # 将消息放入缓冲区
-                    await self.message_buffer.put(message)
-            except Exception as e:
-                logging.error(f"处理WebSocket消息时出错: {str(e)}")
-                await asyncio.sleep(0.1)
-            await asyncio.sleep(0.01)  # 避免CPU占用过高
-    
-    def send(self, data):
-        """发送数据到WebSocket客户端
+    def send(self, data, topics=None):
+        """发送数据到订阅了相关主题的WebSocket客户端
         
         Args:
             data: 要发送的数据(字典或其他可序列化对象)
+            topics: 可选，消息所属的主题，未指定时根据消息内容确定
             
         Returns:
             bool: 发送是否成功
@@ -115,7 +101,7 @@ class WebSocketAdapter:
         try:
             # 在主线程中，通过run_coroutine_threadsafe跨线程执行异步操作
             future = asyncio.run_coroutine_threadsafe(
-                broadcast_message(data), 
+                broadcast_message(data, topics), 
                 self.loop
             )
             # 等待异步操作完成
@@ -124,60 +110,39 @@ class WebSocketAdapter:
             logging.error(f"发送WebSocket消息时出错: {str(e)}")
             return False
             
-    def receive(self):
-        """从消息缓冲区接收数据
+    def receive(self, timeout=None):
+        """接收客户端消息，没有消息时阻塞等待，消息到达后立即返回
         
+        Args:
+            timeout (float): 最长等待秒数，None表示一直等到有消息
+            
         Returns:
-            object: 接收到的数据,或者False表示接收失败
+            object: 接收到的数据,或者False表示超时或接收失败
         """
         if not self.connected:
             logging.error("WebSocket服务器未初始化")
             return False
             
         try:
-            # 如果消息缓冲区不为空，取出消息
-            if self.loop and not self.message_buffer.empty():
-                # 使用run_coroutine_threadsafe从消息缓冲区获取消息
-                future = asyncio.run_coroutine_threadsafe(
-                    self.message_buffer.get(), 
-                    self.loop
-                )
-                try:
-                    message = future.result(timeout=1)
-                    logging.info(f"从WebSocket接收到消息: {message}")
-                    return message
-                except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
-                    logging.warning("从消息队列获取数据超时")
-                    pass
-            
-            # 如果有上一条未处理的消息，返回它
-            if self.last_client_message:
-                # 如果已经处理过此消息，返回None以避免重复处理
-                if getattr(self, '_last_processed_message', None) == self.last_client_message:
-                    time.sleep(0.1)  # 小暂停避免CPU过载
-                    return False
-                    
-                # 有上一条未处理的消息，返回它
-                logging.info(f"返回上一条未处理的WebSocket消息: {self.last_client_message}")
-                self._last_processed_message = self.last_client_message
-                return self.last_client_message
-            
-            # 没有消息时等待一小段时间避免忙等
-            time.sleep(0.1)
-            return False
+            # 服务器线程收到消息后直接放入线程安全队列，这里阻塞等待，不轮询
+            client, message = get_next_message(timeout)
+            if message is None:
+                return False
+            logging.info(f"从WebSocket接收到消息: {message}")
+            return message
         except Exception as e:
             logging.error(f"接收WebSocket消息时出错: {str(e)}")
-            time.sleep(0.5)  # 出错时等待更长时间
             return False
     
+    def get_topic_stats(self):
+        """获取各主题的消息计数和订阅数"""
+        return get_topic_stats()
+    
     def set_realtime_log_path(self, path):
         """设置实时日志路径"""
         try:
-            future = asyncio.run_coroutine_threadsafe(
-                asyncio.coroutine(lambda: set_realtime_log_path(path))(), 
-                self.loop
-            )
-            return future.result(timeout=1)
+            # 只是设置模块级路径，写入器自身是线程安全的，无需切换到事件循环线程
+            return set_realtime_log_path(path)
         except Exception as e:
             logging.error(f"设置实时日志路径时出错: {str(e)}")
             return False
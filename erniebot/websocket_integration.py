@@ -138,7 +138,8 @@ class ErnieBotWebSocket:
                 return
             
             # 发送到AI处理
-            response = self.api_client.chat_with_messages(session["history"])
+            # 模型调用耗时较长，放到线程中执行，避免阻塞其他连接
+            response = await asyncio.to_thread(self.api_client.chat_with_messages, session["history"])
             
             # 提取JSON数据(如果有)
             json_text = self.api_client.extract_json(response)
@@ -213,7 +214,8 @@ class ErnieBotWebSocket:
             session["history"].append({"role": "user", "content": "继续"})
             
             # 发送到AI处理
-            response = self.api_client.chat_with_messages(session["history"])
+            # 模型调用耗时较长，放到线程中执行，避免阻塞其他连接
+            response = await asyncio.to_thread(self.api_client.chat_with_messages, session["history"])
             
             # 提取JSON数据(如果有)
             json_text = self.api_client.extract_json(response)
@@ -278,7 +280,7 @@ class ErnieBotWebSocket:
             target_consumers = extract_consumer_type(content)
             
             # 生成产品建议
-            brand_suggestion = self.api_client.generate_tea_product(target_consumers)
+            brand_suggestion = await asyncio.to_thread(self.api_client.generate_tea_product, target_consumers)
             
             # 提取品牌名称和简洁描述
             brand_name, simple_description = extract_brand_summary(brand_suggestion)
@@ -403,12 +405,12 @@ class ErnieBotWebSocket:
             logger.error(f"格式化Unity任务数据时出错: {e}")
     
     def start(self):
-        """启动WebSocket服务器"""
+        """启动WebSocket服务器(在当前线程中运行事件循环，直到服务器停止)"""
         # 设置消息处理器
         self.setup_handlers()
         
         # 启动WebSocket服务器
-        self.ws_server.start()
+        asyncio.run(self.ws_server.start())
     
     def start_in_thread(self):
         """在新线程中启动WebSocket服务器"""
@@ -1,15 +1,27 @@
 #coding=utf-8
 """
 WebSocket服务器 - 为WebGL客户端提供连接服务
+
+客户端可按主题订阅消息，只接收自己关心的数据：
+- 连接地址带参数: ws://host:port/?topics=simulation:<run_id>,summary
+- 或发送订阅消息: {"type": "subscribe", "topics": [...]}，取消订阅用 "unsubscribe"
+未订阅任何主题的客户端(如旧版Unity客户端)接收全部消息。
+
+主题:
+- simulation: 所有模拟过程数据(每天的任务数据、逐条推送、任务进度)
+- simulation:<run_id>: 指定模拟运行的数据，run_id为数据库中的运行ID
+- job:<job_id>: 指定并发模拟任务的数据
+- summary: 模拟总结和批量模拟完成通知
+- chat: 指令回复、品牌建议、系统状态和错误消息
 """
 
 import asyncio
+import queue
+from urllib.parse import urlparse, parse_qs
 import websockets
-import json
 import logging
 import signal
 import time
-from datetime import datetime
 import sys
 import os
 
@@ -20,6 +32,8 @@ sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
 
 # 导入配置
 from config_integration import HOST, PORT, DEBUG
+from modules.realtime_log import get_realtime_log_writer
+from common import json_codec
 
 # 配置日志
 logging.basicConfig(level=logging.WARNING if not DEBUG else logging.DEBUG,
@@ -27,9 +41,96 @@ logging.basicConfig(level=logging.WARNING if not DEBUG else logging.DEBUG,
 
 # WebSocket连接状态
 connected_clients = set()
-message_queue = asyncio.Queue()
+client_topics = {}  # websocket -> 订阅的主题集合，包含ALL_TOPICS时接收全部消息
+topic_stats = {}  # 主题 -> 消息计数
+# 收到的客户端消息，由事件循环线程放入，主命令循环所在线程阻塞读取(线程安全)
+message_queue = queue.Queue()
 realtime_log_path = None
 
+ALL_TOPICS = "*"
+# resultType/type -> 主题
+SIMULATION_MESSAGE_TYPES = {"task", "taskPartial", "taskPartialAbort", "jobProgress"}
+SUMMARY_MESSAGE_TYPES = {"simulationComplete", "batchComplete"}
+
+def message_topics(message):
+    """根据消息内容确定所属的主题
+    
+    Args:
+        message: 要发送的消息(字典或字符串)
+        
+    Returns:
+        set: 主题集合
+    """
+    if not isinstance(message, dict):
+        return {"chat"}
+    
+    message_type = message.get("resultType") or message.get("type")
+    if message_type in SIMULATION_MESSAGE_TYPES:
+        topics = {"simulation"}
+    elif message_type in SUMMARY_MESSAGE_TYPES:
+        topics = {"summary"}
+    else:
+        return {"chat"}
+    
+    # 同时归入对应运行和任务的主题，订阅具体运行的客户端只收到该运行的数据
+    if message.get("runId"):
+        topics.add(f"simulation:{message['runId']}")
+    if message.get("jobId"):
+        topics.add(f"job:{message['jobId']}")
+    return topics
+
+def parse_topics(value):
+    """解析客户端提交的主题列表(列表或逗号分隔的字符串)"""
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return set()
+    return {str(topic).strip() for topic in value if str(topic).strip()}
+
+def subscribe(websocket, topics):
+    """为客户端增加订阅主题，首次订阅时不再接收全部消息"""
+    current = client_topics.get(websocket, set())
+    if ALL_TOPICS in current and ALL_TOPICS not in topics:
+        current = set()
+    current |= topics
+    client_topics[websocket] = current
+    return current
+
+def unsubscribe(websocket, topics):
+    """取消客户端订阅的主题"""
+    current = client_topics.get(websocket, set()) - topics
+    client_topics[websocket] = current
+    return current
+
+def get_topic_stats():
+    """获取各主题的消息计数和当前订阅数"""
+    subscribers = {}
+    for topics in client_topics.values():
+        for topic in topics:
+            subscribers[topic] = subscribers.get(topic, 0) + 1
+    stats = {topic: dict(counts) for topic, counts in topic_stats.items()}
+    for topic, count in subscribers.items():
+        stats.setdefault(topic, {"messages": 0, "deliveries": 0, "bytes": 0})["subscribers"] = count
+    return stats
+
+async def handle_subscription(websocket, data):
+    """处理订阅消息，返回True表示消息已处理、无需交给主程序"""
+    message_type = data.get("type")
+    if message_type not in ("subscribe", "unsubscribe") and not (data.get("client_type") and "topics" in data):
+        return False
+    
+    topics = parse_topics(data.get("topics"))
+    if message_type == "unsubscribe":
+        current = unsubscribe(websocket, topics)
+    else:
+        current = subscribe(websocket, topics)
+    logging.info(f"客户端 {id(websocket)} 订阅主题: {sorted(current)}")
+    await websocket.send(json_codec.dumps({
+        "type": "subscribed",
+        "topics": sorted(current)
+    }))
+    return True
+
 async def handle_client(websocket, path):
     """处理WebSocket客户端连接"""
     global connected_clients
@@ -37,90 +138,103 @@ async def handle_client(websocket, path):
     client_id = id(websocket)
     logging.info(f"新的WebSocket客户端连接: {client_id}")
     connected_clients.add(websocket)
+    # 连接地址中可直接指定订阅的主题，未指定时接收全部消息
+    initial_topics = parse_topics(",".join(parse_qs(urlparse(path or "").query).get("topics", [])))
+    client_topics[websocket] = initial_topics or {ALL_TOPICS}
     
     # 发送连接确认消息
     confirmation = {
         "type": "question",
         "question": "Unity客户端已连接"
     }
-    await websocket.send(json.dumps(confirmation, ensure_ascii=False))
+    await websocket.send(json_codec.dumps(confirmation))
     
     try:
         async for message in websocket:
             try:
                 # 解析收到的消息
-                data = json.loads(message)
+                data = json_codec.loads(message)
                 logging.info(f"收到消息: {data}")
                 
-                # 将消息放入队列供主程序处理
-                await message_queue.put((websocket, data))
+                # 订阅消息由服务器处理，不交给主程序
+                if isinstance(data, dict) and await handle_subscription(websocket, data):
+                    continue
+                
+                # 将消息放入队列供主程序处理，等待中的主循环会立即被唤醒
+                message_queue.put_nowait((websocket, data))
                 
-            except json.JSONDecodeError:
+            except json_codec.JSONDecodeError:
                 logging.error(f"无法解析JSON消息: {message}")
                 # 尝试发送错误消息
                 error_msg = {
                     "type": "error",
                     "message": "无效的JSON格式"
                 }
-                await websocket.send(json.dumps(error_msg, ensure_ascii=False))
+                await websocket.send(json_codec.dumps(error_msg))
                 
     except websockets.exceptions.ConnectionClosed:
         logging.info(f"客户端断开连接: {client_id}")
     finally:
         connected_clients.remove(websocket)
+        client_topics.pop(websocket, None)
 
-async def broadcast_message(message):
-    """向所有连接的客户端广播消息"""
+async def broadcast_message(message, topics=None):
+    """向订阅了消息主题的客户端发送消息
+    
+    Args:
+        message: 要发送的消息(字典或已序列化的字符串)
+        topics: 可选，消息所属的主题，未指定时根据消息内容确定
+        
+    Returns:
+        bool: 是否有连接的客户端
+    """
     if not connected_clients:
         logging.warning("没有连接的客户端，无法发送消息")
         return False
     
-    # 将消息记录到日志
-    if isinstance(message, dict):
-        logging.info(f"广播消息: {json.dumps(message, ensure_ascii=False)[:200]}...")
-    else:
-        logging.info(f"广播消息: {message[:200]}...")
-    
-    # 记录到实时日志文件(如果已设置)
-    if realtime_log_path and os.path.exists(realtime_log_path):
-        try:
-            # 读取当前日志
-            with open(realtime_log_path, "r", encoding="utf-8") as f:
-                realtime_log = json.load(f)
-            
-            # 添加消息记录
-            if "messages" not in realtime_log:
-                realtime_log["messages"] = []
-            
-            message_record = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "direction": "outgoing",
-                "message": message
-            }
-            realtime_log["messages"].append(message_record)
-            
-            # 写回文件
-            with open(realtime_log_path, "w", encoding="utf-8") as f:
-                json.dump(realtime_log, f, ensure_ascii=False, indent=2)
-            
-        except Exception as e:
-            logging.error(f"记录消息到日志文件失败: {e}")
-    
-    # 发送消息给所有客户端
-    if connected_clients:
-        message_json = json.dumps(message, ensure_ascii=False)
+    topics = set(topics) if topics else message_topics(message)
+    recipients = [
+        client for client in connected_clients
+        if ALL_TOPICS in client_topics.get(client, ()) or not topics.isdisjoint(client_topics.get(client, ()))
+    ]
+    
+    # 只序列化一次，日志、实时日志和所有客户端共用同一份JSON
+    is_text = isinstance(message, str)
+    message_json = message if is_text else json_codec.dumps(message)
+    logging.info(f"发送消息到 {len(recipients)} 个客户端 (主题: {sorted(topics)}): {message_json[:200]}...")
+    
+    for topic in topics:
+        counts = topic_stats.setdefault(topic, {"messages": 0, "deliveries": 0, "bytes": 0})
+        counts["messages"] += 1
+        counts["deliveries"] += len(recipients)
+        counts["bytes"] += len(message_json) * len(recipients)
+    
+    # 记录到实时日志文件(如果已设置)，追加一行而不是重写整个文件
+    if realtime_log_path:
+        get_realtime_log_writer(realtime_log_path).log_message(
+            message, direction="outgoing", payload=None if is_text else message_json
+        )
+    
+    # 只发送给订阅了相关主题的客户端
+    if recipients:
         await asyncio.gather(
-            *[client.send(message_json) for client in connected_clients],
+            *[client.send(message_json) for client in recipients],
             return_exceptions=True
         )
-        return True
-    return False
+    return True
 
-async def get_next_message():
-    """从消息队列获取下一条消息"""
+def get_next_message(timeout=None):
+    """从消息队列获取下一条消息，没有消息时阻塞等待(可在事件循环线程之外调用)
+    
+    Args:
+        timeout (float): 最长等待秒数，None表示一直等到有消息
+        
+    Returns:
+        tuple: (客户端连接, 消息)，超时返回(None, None)
+    """
     try:
-        return await asyncio.wait_for(message_queue.get(), timeout=0.1)
-    except asyncio.TimeoutError:
+        return message_queue.get(timeout=timeout)
+    except queue.Empty:
         return None, None
 
 def set_realtime_log_path(path):
@@ -130,8 +244,12 @@ def set_realtime_log_path(path):
     logging.info(f"已设置WebSocket实时日志路径: {path}")
     return True
 
-async def start_server():
-    """启动WebSocket服务器"""
+async def start_server(on_started=None):
+    """启动WebSocket服务器
+    
+    Args:
+        on_started: 可选，开始监听后调用的函数(无参数)
+    """
     server = await websockets.serve(
         handle_client, 
         HOST, 
@@ -141,6 +259,8 @@ async def start_server():
     )
     
     logging.info(f"WebSocket服务器启动在 {HOST}:{PORT}")
+    if on_started:
+        on_started()
     
     # 确保优雅关闭
     loop = asyncio.get_event_loop()